@@ -0,0 +1,242 @@
+import asyncio
+import json
+import math
+import os
+import subprocess
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Optional
+
+import ffmpeg
+
+from shared_state import SharedState
+
+# Rough per-video-second costs of a dubbing job, measured on our Cloud Run boxes
+GEMINI_SECONDS_PER_VIDEO_SECOND = 0.5  # File API processing + transcription
+GEMINI_FIXED_SECONDS = 30  # Upload and first status polls
+TTS_CHARS_PER_VIDEO_SECOND = 15  # Typical speaking rate in translated text
+TTS_SECONDS_PER_CHAR = 0.01
+ENCODE_SECONDS_PER_VIDEO_SECOND = 0.6  # libx264 -preset fast, one core
+
+YOUTUBE_PROBE_TIMEOUT_SECONDS = 60
+YOUTUBE_PROBE_RETRY_AFTER_SECONDS = 30
+
+
+class AdmissionRejected(Exception):
+    """A dubbing job that cannot be admitted now; maps to an HTTP response."""
+
+    def __init__(self, status_code: int, message: str, retry_after: int = 0):
+        super().__init__(message)
+        self.status_code, self.message, self.retry_after = (
+            status_code,
+            message,
+            retry_after,
+        )
+
+
+class JobCost:
+    """
+    Estimated resource cost of dubbing a video of the given length into
+    ``languages`` languages. Only TTS grows with the languages: the video is
+    transcribed and encoded once, and translating the transcript is cheap.
+    A ``captions`` job stops after transcription: no TTS and no encode.
+    """
+
+    def __init__(
+        self,
+        duration: float,
+        size_bytes: int = 0,
+        languages: int = 1,
+        captions: bool = False,
+    ):
+        self.duration = duration
+        self.size_bytes = size_bytes
+        self.languages = languages
+        self.gemini_seconds = GEMINI_FIXED_SECONDS + duration * (
+            GEMINI_SECONDS_PER_VIDEO_SECOND
+        )
+        if captions:
+            self.tts_characters, self.encode_seconds = 0, 0.0
+        else:
+            self.tts_characters = int(duration * TTS_CHARS_PER_VIDEO_SECOND * languages)
+            self.encode_seconds = duration * ENCODE_SECONDS_PER_VIDEO_SECOND
+        # Budget weight: the CPU-bound encode dominates what a box can hold
+        self.units = self.encode_seconds
+
+    @property
+    def wall_seconds(self) -> float:
+        """Expected end-to-end processing time."""
+        return (
+            self.gemini_seconds
+            + self.tts_characters * TTS_SECONDS_PER_CHAR
+            + self.encode_seconds
+        )
+
+    def __repr__(self) -> str:
+        return (
+            f"JobCost(duration={self.duration:.0f}s, gemini={self.gemini_seconds:.0f}s, "
+            f"languages={self.languages}, tts_chars={self.tts_characters}, "
+            f"encode={self.encode_seconds:.0f}s)"
+        )
+
+
+def probe_file(path: str, languages: int = 1, captions: bool = False) -> JobCost:
+    """Read duration and size of a local video with ffprobe."""
+    try:
+        info = ffmpeg.probe(path)
+        duration = float(info["format"]["duration"])
+    except (ffmpeg.Error, KeyError, ValueError) as e:
+        raise AdmissionRejected(400, f"Could not read video duration: {e}")
+    return JobCost(duration, os.path.getsize(path), languages, captions)
+
+
+def probe_youtube(url: str, languages: int = 1, captions: bool = False) -> JobCost:
+    """Read duration and approximate size of a YouTube video without downloading it."""
+    try:
+        result = subprocess.run(
+            ["yt-dlp", "--skip-download", "--no-warnings", "--dump-json", url],
+            capture_output=True,
+            text=True,
+            timeout=YOUTUBE_PROBE_TIMEOUT_SECONDS,
+        )
+    except subprocess.TimeoutExpired:
+        # YouTube being slow is not the client's fault; let them come back
+        raise AdmissionRejected(
+            503,
+            "Timed out reading video metadata, please retry.",
+            retry_after=YOUTUBE_PROBE_RETRY_AFTER_SECONDS,
+        )
+    if result.returncode != 0:
+        raise AdmissionRejected(400, f"Could not read video metadata: {result.stderr}")
+    try:
+        info = json.loads(result.stdout)
+    except json.JSONDecodeError as e:
+        raise AdmissionRejected(400, f"Could not read video metadata: {e}")
+    if not isinstance(info, dict) or not info.get("duration"):
+        raise AdmissionRejected(400, "Live streams and videos of unknown length are not supported.")
+    size = info.get("filesize") or info.get("filesize_approx") or 0
+    return JobCost(float(info["duration"]), int(size), languages, captions)
+
+
+class AdmissionController:
+    """
+    Cost-aware admission for dubbing jobs.
+
+    - Videos longer than ``max_duration`` are rejected outright (413).
+    - Each client may submit ``client_seconds_per_hour`` of video per hour,
+      tracked in shared state so the budget is per host (429).
+    - Running jobs may hold at most ``capacity`` cost units (estimated encode
+      seconds) in this worker. Jobs that do not fit wait in a FIFO queue of
+      at most ``max_queue`` jobs; beyond that they are rejected (503).
+
+    Rejections carry a ``retry_after`` computed from the work actually ahead
+    of the caller: remaining estimated time of running jobs plus the queue.
+    """
+
+    def __init__(
+        self,
+        state: SharedState,
+        capacity: float,
+        max_queue: int = 10,
+        max_duration: float = 2 * 3600,
+        client_seconds_per_hour: float = 3 * 3600,
+    ):
+        self.state = state
+        self.capacity = capacity
+        self.max_queue = max_queue
+        self.max_duration = max_duration
+        self.client_seconds_per_hour = client_seconds_per_hour
+        self.in_use = 0.0
+        self._running = {}  # id -> (started, cost)
+        self._queue = deque()  # (future, cost)
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._queue)
+
+    def _estimated_wait(self, extra: Optional[JobCost] = None) -> int:
+        now = time.time()
+        remaining = sum(
+            max(0.0, cost.wall_seconds - (now - started))
+            for started, cost in self._running.values()
+        )
+        queued = sum(cost.wall_seconds for _, cost in self._queue)
+        if extra is not None:
+            queued += extra.wall_seconds
+        # Running and queued work drains roughly in parallel across the jobs
+        # that fit in the budget at once
+        parallelism = max(1, len(self._running))
+        return max(1, math.ceil((remaining + queued) / parallelism))
+
+    def charge_client(self, client_id: str, cost: JobCost) -> None:
+        if cost.duration > self.max_duration:
+            raise AdmissionRejected(
+                413,
+                f"Video is {cost.duration / 60:.0f} minutes long; the limit is "
+                f"{self.max_duration / 60:.0f} minutes.",
+            )
+        key = f"dub:client_budget:{client_id}"
+        used = self.state.incr(key, cost.duration, ttl=3600)
+        if used > self.client_seconds_per_hour:
+            self.state.incr(key, -cost.duration)
+            expires_at = self.state.expires_at(key) or time.time() + 3600
+            raise AdmissionRejected(
+                429,
+                "Hourly dubbing budget exceeded for this client.",
+                retry_after=max(1, math.ceil(expires_at - time.time())),
+            )
+
+    def refund_client(self, client_id: str, cost: JobCost) -> None:
+        self.state.incr(f"dub:client_budget:{client_id}", -cost.duration)
+
+    @asynccontextmanager
+    async def slot(self, cost: JobCost):
+        """Hold budget for one job, queueing until it fits."""
+        # A job bigger than the whole budget runs alone rather than never;
+        # one that needs no budget (captions) never waits behind the queue
+        units = min(cost.units, self.capacity)
+        if units > 0 and (self._queue or self.in_use + units > self.capacity):
+            if len(self._queue) >= self.max_queue:
+                raise AdmissionRejected(
+                    503,
+                    "Dubbing queue is full. Please retry later.",
+                    retry_after=self._estimated_wait(),
+                )
+            waiter = asyncio.get_running_loop().create_future()
+            entry = (waiter, cost)
+            self._queue.append(entry)
+            print(f"Queued dubbing job {cost} (queue depth {len(self._queue)})")
+            try:
+                await waiter
+            except BaseException:
+                if entry in self._queue:
+                    self._queue.remove(entry)
+                elif waiter.done() and not waiter.cancelled():
+                    # Admitted just as we were cancelled; hand the budget back
+                    self.in_use -= units
+                    self._wake()
+                raise
+        else:
+            self.in_use += units
+
+        job_id = id(cost)
+        self._running[job_id] = (time.time(), cost)
+        try:
+            yield
+        finally:
+            self._running.pop(job_id, None)
+            self.in_use -= units
+            self._wake()
+
+    def _wake(self) -> None:
+        # Strict FIFO: admit from the head while it fits, so big jobs don't starve
+        while self._queue:
+            waiter, cost = self._queue[0]
+            units = min(cost.units, self.capacity)
+            if self.in_use + units > self.capacity:
+                break
+            self._queue.popleft()
+            if not waiter.done():
+                self.in_use += units
+                waiter.set_result(None)
@@ -0,0 +1,554 @@
+"""
+Local stand-ins for the services the backend calls: the Gemini API (File
+API, generateContent, streaming and cached contents), Sarvam TTS and the
+Knewbit course API. Each is a small FastAPI app with configurable latency,
+so benchmarks run offline and repeatably.
+"""
+
+import asyncio
+import base64
+import io
+import json
+import math
+import os
+import random
+import re
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import uuid
+import wave
+from collections import Counter
+from typing import Dict, List, Optional
+
+import ffmpeg
+import uvicorn
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# Fallback when ffprobe cannot read an upload (e.g. not a real video)
+DEFAULT_VIDEO_SECONDS = 30.0
+SEGMENT_SECONDS = 3.0  # One transcript segment per this much video
+TTS_CHARS_PER_SECOND = 15  # Speaking rate used to size fake TTS clips
+
+
+class Latency:
+    """Base delay plus uniform jitter, in seconds."""
+
+    def __init__(self, base: float = 0.0, jitter: float = 0.0):
+        self.base, self.jitter = base, jitter
+
+    async def wait(self, extra: float = 0.0) -> None:
+        delay = self.base + extra + random.uniform(0, self.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class Stats:
+    """Per-route call counters, reported next to the benchmark results."""
+
+    def __init__(self):
+        self.calls = Counter()
+        self._lock = threading.Lock()
+
+    def count(self, name: str) -> None:
+        with self._lock:
+            self.calls[name] += 1
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self.calls)
+
+
+# --- Knewbit course API ---
+TOPICS = [
+    "Python", "Machine Learning", "Web Development", "Data Structures",
+    "Cloud Computing", "Cybersecurity", "Databases", "Rust", "Statistics",
+    "Product Design",
+]
+
+
+def make_catalog(size: int = 200) -> List[dict]:
+    """Deterministic course catalog in the Knewbit API's shape."""
+    courses = []
+    for i in range(size):
+        topic = TOPICS[i % len(TOPICS)]
+        level = ["beginner", "intermediate", "advanced"][i % 3]
+        title = f"{topic} {level.title()} {i // len(TOPICS) + 1}"
+        courses.append(
+            {
+                "id": f"course-{i}",
+                "slug": f"{topic.lower().replace(' ', '-')}-{level}-{i}",
+                "title": title,
+                "description": f"A {level} course on {topic.lower()} with hands-on projects.",
+                "category_name": topic,
+                "difficulty_level": level,
+                "tags": [topic.lower(), level],
+                "status": "published",
+                "is_free": i % 4 == 0,
+                "price": 0 if i % 4 == 0 else 49,
+                "average_rating": 3.5 + (i % 15) / 10,
+                "enrollment_count": 100 + i * 7,
+            }
+        )
+    return courses
+
+
+def course_details(course: dict) -> dict:
+    """A catalog entry expanded with the material the tutor reads."""
+    topic = course["category_name"]
+    script = " ".join(
+        f"Lesson {n} of {course['title']} covers {topic.lower()} concept {n}: "
+        f"what it is, why it matters and how to apply it in practice."
+        for n in range(1, 41)
+    )
+    return {
+        **course,
+        "lecture_script": script,
+        "key_concepts": [
+            {"concept": f"{topic} concept {n}", "description": f"Core idea {n} of {topic}."}
+            for n in range(1, 8)
+        ],
+        "core_educational_takeaways": [
+            f"Apply {topic.lower()} technique {n} to real problems" for n in range(1, 5)
+        ],
+        "important_facts_figures": [
+            f"{topic} fact {n}: {n * 17}% of practitioners use it" for n in range(1, 5)
+        ],
+    }
+
+
+def knewbit_app(
+    catalog: List[dict], latency: Latency, stats: Stats, enrolled_count: int = 2
+) -> FastAPI:
+    app = FastAPI()
+    by_key = {key: c for c in catalog for key in (c["id"], c["slug"])}
+
+    @app.get("/courses")
+    async def all_courses():
+        stats.count("knewbit.courses")
+        await latency.wait()
+        return catalog
+
+    @app.get("/courses/{course_id}")
+    async def course(course_id: str):
+        stats.count("knewbit.course")
+        await latency.wait()
+        if course_id not in by_key:
+            return JSONResponse(status_code=404, content={"error": "Not found"})
+        return course_details(by_key[course_id])
+
+    @app.get("/api/user/enrolled-courses")
+    async def enrolled(request: Request):
+        stats.count("knewbit.enrolled")
+        await latency.wait()
+        if not request.headers.get("authorization", "").startswith("Bearer "):
+            return JSONResponse(status_code=401, content={"error": "Unauthorized"})
+        return catalog[:enrolled_count]
+
+    return app
+
+
+# --- Sarvam TTS ---
+def make_wav(seconds: float, sample_rate: int, frequency: float = 220.0) -> bytes:
+    """Mono 16-bit WAV of a quiet tone."""
+    frames = int(seconds * sample_rate)
+    step = 2 * math.pi * frequency / sample_rate
+    samples = bytearray()
+    for i in range(frames):
+        samples += int(3000 * math.sin(i * step)).to_bytes(2, "little", signed=True)
+    out = io.BytesIO()
+    with wave.open(out, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(bytes(samples))
+    return out.getvalue()
+
+
+def sarvam_app(
+    latency: Latency,
+    stats: Stats,
+    rate_limit_ratio: float = 0.0,
+    seconds_per_char: float = 0.0,
+    batching: bool = True,
+) -> FastAPI:
+    """
+    ``rate_limit_ratio`` of requests get a 429, like the real API under load.
+    ``seconds_per_char`` adds latency proportional to the text synthesized.
+    """
+    app = FastAPI()
+    clips: Dict[tuple, bytes] = {}
+
+    def clip(text: str, sample_rate: int) -> bytes:
+        seconds = round(max(0.3, len(text) / TTS_CHARS_PER_SECOND), 1)
+        key = (seconds, sample_rate)
+        if key not in clips:
+            clips[key] = make_wav(seconds, sample_rate)
+        return clips[key]
+
+    @app.post("/text-to-speech")
+    async def text_to_speech(request: Request):
+        body = await request.json()
+        texts = body.get("inputs")
+        if texts is not None and not batching:
+            stats.count("sarvam.rejected_batch")
+            return JSONResponse(status_code=400, content={"error": "inputs not supported"})
+        texts = texts if texts is not None else [body.get("text", "")]
+        stats.count("sarvam.requests")
+        if random.random() < rate_limit_ratio:
+            stats.count("sarvam.429")
+            return JSONResponse(
+                status_code=429,
+                content={"error": {"message": "Rate limit exceeded"}},
+                headers={"Retry-After": "1"},
+            )
+        await latency.wait(seconds_per_char * sum(len(t) for t in texts))
+        sample_rate = int(body.get("speech_sample_rate", 22050))
+        audios = [base64.b64encode(clip(t, sample_rate)).decode() for t in texts]
+        return {"request_id": uuid.uuid4().hex, "audios": audios}
+
+    return app
+
+
+# --- Gemini ---
+def discovery_document(root_url: str) -> dict:
+    """Just enough of the Generative Language discovery doc for File API uploads."""
+    return {
+        "kind": "discovery#restDescription",
+        "discoveryVersion": "v1",
+        "id": "generativelanguage:v1beta",
+        "name": "generativelanguage",
+        "version": "v1beta",
+        "rootUrl": root_url,
+        "servicePath": "",
+        "baseUrl": root_url,
+        "batchPath": "batch",
+        "protocol": "rest",
+        "parameters": {
+            "key": {"type": "string", "location": "query"},
+            "alt": {"type": "string", "location": "query", "default": "json"},
+        },
+        "schemas": {
+            "CreateFileRequest": {
+                "id": "CreateFileRequest",
+                "type": "object",
+                "properties": {"file": {"type": "object"}},
+            },
+            "CreateFileResponse": {
+                "id": "CreateFileResponse",
+                "type": "object",
+                "properties": {"file": {"type": "object"}},
+            },
+        },
+        "resources": {
+            "media": {
+                "methods": {
+                    "upload": {
+                        "id": "generativelanguage.media.upload",
+                        "path": "v1beta/files",
+                        "flatPath": "v1beta/files",
+                        "httpMethod": "POST",
+                        "parameters": {},
+                        "parameterOrder": [],
+                        "request": {"$ref": "CreateFileRequest"},
+                        "response": {"$ref": "CreateFileResponse"},
+                        "supportsMediaUpload": True,
+                        "mediaUpload": {
+                            "accept": ["*/*"],
+                            "protocols": {
+                                "simple": {"multipart": True, "path": "/upload/v1beta/files"},
+                                "resumable": {
+                                    "multipart": True,
+                                    "path": "/resumable/upload/v1beta/files",
+                                },
+                            },
+                        },
+                    }
+                }
+            }
+        },
+    }
+
+
+def probe_seconds(path: str) -> float:
+    try:
+        return float(ffmpeg.probe(path)["format"]["duration"])
+    except Exception:
+        return DEFAULT_VIDEO_SECONDS
+
+
+def fake_transcript(seconds: float, rng: random.Random) -> dict:
+    """Dubbing transcript with one segment per few seconds of video."""
+    segments = []
+    start = 0.2
+    while start + 1.0 < seconds:
+        end = min(seconds, start + SEGMENT_SECONDS - 0.4)
+        words = rng.randint(4, 12)
+        segments.append(
+            {
+                "start": round(start, 2),
+                "end": round(end, 2),
+                "original_text": " ".join(["word"] * words),
+                "translated_text": " ".join(["शब्द"] * words),
+                "emotion": rng.choice(["neutral", "joy", "excitement"]),
+            }
+        )
+        start += SEGMENT_SECONDS
+    return {"segments": segments}
+
+
+def fake_recommendations(prompt: str) -> list:
+    """Pick the first few courses from the catalog embedded in the prompt."""
+    match = re.search(r"Available Platform Courses \(JSON\):\s*(\[.*?\])\s*\n", prompt, re.S)
+    courses = json.loads(match.group(1)) if match else []
+    return [
+        {
+            "id": c["id"],
+            "title": c["title"],
+            "slug": c.get("slug", ""),
+            "reason": f"Builds directly on what you asked about with {c.get('category', 'this topic')}.",
+        }
+        for c in courses[2:5]
+    ]
+
+
+def fake_translations(prompt: str) -> list:
+    """One made-up translation per transcript line embedded in the prompt."""
+    match = re.search(r"Lines \(JSON\):\s*(\[.*\])", prompt, re.S)
+    lines = json.loads(match.group(1)) if match else []
+    return [" ".join(["சொல்"] * len(line.get("text", "").split())) for line in lines]
+
+
+TUTOR_REPLY = (
+    "Great question! Let's break it down step by step. First, think about what "
+    "the concept is trying to solve. Then look at a small example and predict "
+    "what happens before running it. What do you think the first step would be?"
+)
+
+
+def _text_of(body: dict) -> str:
+    return "\n".join(
+        part.get("text", "")
+        for content in body.get("contents", [])
+        for part in content.get("parts", [])
+    )
+
+
+def _has_file(body: dict) -> Optional[str]:
+    for content in body.get("contents", []):
+        for part in content.get("parts", []):
+            data = part.get("fileData") or part.get("file_data")
+            if data:
+                return data.get("fileUri") or data.get("file_uri")
+    return None
+
+
+def _candidate(text: str, finish: bool = True) -> dict:
+    candidate = {"content": {"role": "model", "parts": [{"text": text}]}, "index": 0}
+    if finish:
+        candidate["finishReason"] = "STOP"
+    return candidate
+
+
+def gemini_app(
+    latency: Latency,
+    stats: Stats,
+    processing_seconds: float = 0.0,
+    transcribe_seconds_per_video_second: float = 0.0,
+    stream_chunks: int = 8,
+) -> FastAPI:
+    """
+    ``processing_seconds`` is how long an uploaded file stays PROCESSING.
+    Transcription takes ``transcribe_seconds_per_video_second`` per second of
+    uploaded video on top of the base latency.
+    """
+    app = FastAPI()
+    workdir = tempfile.mkdtemp(prefix="fake-gemini-")
+    files: Dict[str, dict] = {}
+    uploads: Dict[str, dict] = {}
+    rng = random.Random(0)
+
+    def file_resource(file_id: str, base_url: str) -> dict:
+        meta = files[file_id]
+        ready = time.time() >= meta["ready_at"]
+        return {
+            "name": f"files/{file_id}",
+            "displayName": meta["display_name"],
+            "mimeType": meta["mime_type"],
+            "sizeBytes": str(meta["size"]),
+            "uri": f"{base_url}v1beta/files/{file_id}",
+            "state": "ACTIVE" if ready else "PROCESSING",
+        }
+
+    @app.get("/$discovery/rest")
+    async def discovery(request: Request):
+        stats.count("gemini.discovery")
+        return discovery_document(str(request.base_url))
+
+    @app.post("/upload/v1beta/files")
+    @app.put("/upload/v1beta/files")
+    @app.post("/resumable/upload/v1beta/files")
+    async def upload(request: Request):
+        params = request.query_params
+        upload_id = params.get("upload_id")
+        if upload_id is None:
+            # Start of a resumable upload: remember the metadata, hand out a URL
+            stats.count("gemini.upload")
+            await latency.wait()
+            body = await request.body()
+            try:
+                metadata = json.loads(body or b"{}").get("file", {})
+            except ValueError:
+                metadata = {}
+            upload_id = uuid.uuid4().hex
+            uploads[upload_id] = {
+                "display_name": metadata.get("displayName", ""),
+                "mime_type": request.headers.get("x-upload-content-type", "video/mp4"),
+            }
+            location = f"{request.base_url}upload/v1beta/files?upload_id={upload_id}"
+            return Response(status_code=200, headers={"Location": location})
+
+        meta = uploads.pop(upload_id)
+        file_id = uuid.uuid4().hex[:12]
+        path = os.path.join(workdir, file_id)
+        size = 0
+        with open(path, "wb") as f:
+            async for chunk in request.stream():
+                size += len(chunk)
+                f.write(chunk)
+        files[file_id] = {
+            **meta,
+            "path": path,
+            "size": size,
+            "seconds": await asyncio.to_thread(probe_seconds, path),
+            "ready_at": time.time() + processing_seconds,
+        }
+        return {"file": file_resource(file_id, str(request.base_url))}
+
+    @app.get("/v1beta/files/{file_id}")
+    async def get_file(file_id: str, request: Request):
+        stats.count("gemini.get_file")
+        await latency.wait()
+        if file_id not in files:
+            return JSONResponse(status_code=404, content={"error": {"code": 404}})
+        return file_resource(file_id, str(request.base_url))
+
+    @app.delete("/v1beta/files/{file_id}")
+    async def delete_file(file_id: str):
+        stats.count("gemini.delete_file")
+        meta = files.pop(file_id, None)
+        if meta and os.path.exists(meta["path"]):
+            os.remove(meta["path"])
+        return {}
+
+    @app.post("/v1beta/cachedContents")
+    async def create_cached_content(request: Request):
+        stats.count("gemini.cache_create")
+        await latency.wait()
+        body = await request.json()
+        return {
+            "name": f"cachedContents/{uuid.uuid4().hex[:12]}",
+            "model": body.get("model", ""),
+            "displayName": body.get("displayName", ""),
+        }
+
+    def reply_for(body: dict) -> tuple:
+        """Response text plus extra latency, by what the prompt asks for."""
+        file_uri = _has_file(body)
+        if file_uri:
+            meta = files.get(file_uri.rstrip("/").rsplit("/", 1)[-1], {})
+            seconds = meta.get("seconds", DEFAULT_VIDEO_SECONDS)
+            transcript = fake_transcript(seconds, rng)
+            return json.dumps(transcript), seconds * transcribe_seconds_per_video_second
+        prompt = _text_of(body)
+        if "Available Platform Courses (JSON):" in prompt:
+            return json.dumps(fake_recommendations(prompt)), 0.0
+        if "Lines (JSON):" in prompt:
+            return json.dumps(fake_translations(prompt)), 0.0
+        if "running summary" in prompt:
+            return "The student is working through the basics and asked follow-ups.", 0.0
+        return TUTOR_REPLY, 0.0
+
+    @app.post("/v1beta/models/{target:path}")
+    async def models(target: str, request: Request):
+        model, _, method = target.partition(":")
+        body = await request.json()
+        text, extra = reply_for(body)
+
+        if method == "streamGenerateContent":
+            stats.count("gemini.stream")
+
+            # google-genai asks for SSE; the legacy SDK's REST transport for a JSON array
+            sse = request.query_params.get("alt") == "sse"
+
+            async def events():
+                await latency.wait(extra)
+                size = max(1, math.ceil(len(text) / stream_chunks))
+                pieces = [text[i : i + size] for i in range(0, len(text), size)]
+                if not sse:
+                    yield "["
+                for i, piece in enumerate(pieces):
+                    chunk = json.dumps({"candidates": [_candidate(piece, i == len(pieces) - 1)]})
+                    if sse:
+                        yield f"data: {chunk}\r\n\r\n"
+                    else:
+                        yield chunk if i == 0 else f",\n{chunk}"
+                    await asyncio.sleep(0.005)
+                if not sse:
+                    yield "]"
+
+            return StreamingResponse(
+                events(), media_type="text/event-stream" if sse else "application/json"
+            )
+
+        stats.count("gemini.generate")
+        await latency.wait(extra)
+        return {
+            "candidates": [_candidate(text)],
+            "usageMetadata": {"promptTokenCount": len(_text_of(body)) // 4},
+            "modelVersion": model.split("/")[-1],
+        }
+
+    app.state.workdir = workdir
+    return app
+
+
+# --- Running the fakes ---
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class FakeServer:
+    """Runs an ASGI app with uvicorn on a background thread."""
+
+    def __init__(self, app, port: Optional[int] = None):
+        self.app, self.port = app, port or free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self._server = uvicorn.Server(
+            uvicorn.Config(
+                app, host="127.0.0.1", port=self.port, log_level="warning",
+                access_log=False,
+            )
+        )
+        self._thread = threading.Thread(target=self._server.run, daemon=True)
+
+    def start(self) -> "FakeServer":
+        self._thread.start()
+        deadline = time.time() + 10
+        while not self._server.started:
+            if time.time() > deadline:
+                raise RuntimeError(f"Fake server on port {self.port} did not start")
+            time.sleep(0.01)
+        return self
+
+    def stop(self) -> None:
+        self._server.should_exit = True
+        self._thread.join(timeout=5)
+        workdir = getattr(getattr(self.app, "state", None), "workdir", None)
+        if workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
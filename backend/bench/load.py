@@ -0,0 +1,372 @@
+"""
+Load test with latency and error-rate budgets.
+
+Ramps closed-loop virtual users through stages (e.g. 1, 2, 4, 8 ... users),
+each user sending a weighted mix of ``/recommend-courses``, ``/ai-tutor`` and
+``/dub`` requests back to back against the API and the upstream fakes from
+``bench/fakes.py``. Every stage is checked against per-endpoint p95 and
+error-rate budgets. The run writes a JSON report, including the saturation
+point (the most users one worker served within budget) and the API's
+import-to-ready startup time.
+
+    cd backend
+    python -m bench.load --ramp 1,2,4,8,16,32 --stage-seconds 20 --output load.json
+    python -m bench.load --mix recommend=1 --budget recommend.p95=0.5 --required-users 8
+    python -m bench.load --in-process   # drive the ASGI app directly, no uvicorn
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from contextlib import AsyncExitStack
+from typing import Callable, Dict, List, Optional
+
+import httpx
+
+from bench.fakes import Stats
+from bench.run import (
+    BACKEND_DIR,
+    SCENARIOS,
+    STARTUP_POLL_SECONDS,
+    add_environment_arguments,
+    app_environment,
+    dub_request,
+    recommend_request,
+    sample_peak_rss,
+    start_app,
+    start_fakes,
+    stop_app,
+    tutor_request,
+)
+from bench.videos import make_videos
+
+# Seconds at p95 and fraction of failed requests each endpoint may reach
+DEFAULT_BUDGETS = {
+    "recommend": {"p95": 2.0, "error_rate": 0.01},
+    "tutor": {"p95": 3.0, "error_rate": 0.01},
+    "dub": {"p95": 180.0, "error_rate": 0.05},
+}
+DEFAULT_MIX = "recommend=70,tutor=28,dub=2"
+REPORT_VERSION = 1
+
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    """Nearest-rank percentile, or None without samples."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+
+def parse_mix(spec: str) -> Dict[str, float]:
+    mix = {}
+    for item in spec.split(","):
+        name, _, weight = item.partition("=")
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise SystemExit(f"Unknown endpoint in --mix: {name}")
+        mix[name] = float(weight or 1)
+    return {name: weight for name, weight in mix.items() if weight > 0}
+
+
+def parse_budgets(overrides: List[str]) -> Dict[str, Dict[str, float]]:
+    """``DEFAULT_BUDGETS`` with ``endpoint.metric=value`` overrides applied."""
+    budgets = {name: dict(limits) for name, limits in DEFAULT_BUDGETS.items()}
+    for override in overrides:
+        key, _, value = override.partition("=")
+        name, _, metric = key.partition(".")
+        if name not in budgets or metric not in ("p95", "error_rate") or not value:
+            raise SystemExit(f"Bad --budget {override!r}; use e.g. recommend.p95=1.5")
+        budgets[name][metric] = float(value)
+    return budgets
+
+
+class Stage:
+    def __init__(self, users: int):
+        self.users = users
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.statuses: Dict[str, Counter] = defaultdict(Counter)
+        self.elapsed = 0.0
+        self.peak_rss: Optional[int] = None
+
+    def record(self, endpoint: str, latency: float, status) -> None:
+        self.latencies[endpoint].append(latency)
+        self.statuses[endpoint][status] += 1
+
+    def summary(self, budgets: Dict[str, Dict[str, float]]) -> dict:
+        endpoints, violations = {}, []
+        total = 0
+        for endpoint, latencies in sorted(self.latencies.items()):
+            statuses = self.statuses[endpoint]
+            errors = sum(n for status, n in statuses.items() if status not in (200, 202))
+            error_rate = errors / len(latencies)
+            p95 = percentile(latencies, 95)
+            total += len(latencies)
+            endpoints[endpoint] = {
+                "requests": len(latencies),
+                "errors": errors,
+                "error_rate": round(error_rate, 4),
+                "throughput": round(len(latencies) / self.elapsed, 3),
+                "p50": round(percentile(latencies, 50), 4),
+                "p95": round(p95, 4),
+                "p99": round(percentile(latencies, 99), 4),
+                "max": round(max(latencies), 4),
+                "statuses": {str(status): n for status, n in statuses.items()},
+            }
+            limits = budgets.get(endpoint, {})
+            if "p95" in limits and p95 > limits["p95"]:
+                violations.append(f"{endpoint} p95 {p95:.3f}s > {limits['p95']}s")
+            if "error_rate" in limits and error_rate > limits["error_rate"]:
+                violations.append(
+                    f"{endpoint} error rate {error_rate:.2%} > {limits['error_rate']:.2%}"
+                )
+        return {
+            "users": self.users,
+            "seconds": round(self.elapsed, 3),
+            "requests": total,
+            "throughput": round(total / self.elapsed, 3) if self.elapsed else 0,
+            "peak_rss_bytes": self.peak_rss,
+            "endpoints": endpoints,
+            "budget_violations": violations,
+            "within_budget": not violations,
+        }
+
+
+async def run_stage(
+    stage: Stage,
+    client: httpx.AsyncClient,
+    senders: Dict[str, Callable],
+    mix: Dict[str, float],
+    seconds: float,
+    think_seconds: float,
+    rng: random.Random,
+    counter: List[int],
+    pid: int,
+) -> None:
+    names, weights = list(mix), list(mix.values())
+    deadline = time.perf_counter() + seconds
+
+    async def user():
+        while time.perf_counter() < deadline:
+            endpoint = rng.choices(names, weights)[0]
+            counter[0] += 1
+            started = time.perf_counter()
+            try:
+                status = await senders[endpoint](client, counter[0])
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            stage.record(endpoint, time.perf_counter() - started, status)
+            if think_seconds:
+                await asyncio.sleep(rng.uniform(0, 2 * think_seconds))
+
+    stop = asyncio.Event()
+    sampler = asyncio.create_task(sample_peak_rss(pid, stage, stop))
+    started = time.perf_counter()
+    # Users finish the request they are in when the stage ends
+    await asyncio.gather(*(user() for _ in range(stage.users)))
+    stage.elapsed = time.perf_counter() - started
+    stop.set()
+    await sampler
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=BACKEND_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def saturation(stages: List[dict]) -> dict:
+    """Largest stage within budget, and the best throughput seen at any stage."""
+    within = None
+    for stage in stages:
+        if not stage["within_budget"]:
+            break
+        within = stage
+    peak = max(stages, key=lambda s: s["throughput"], default=None)
+    return {
+        "users_within_budget": within["users"] if within else 0,
+        "throughput_within_budget": within["throughput"] if within else 0,
+        "peak_throughput": peak["throughput"] if peak else 0,
+        "peak_throughput_users": peak["users"] if peak else 0,
+    }
+
+
+def print_stage(summary: dict) -> None:
+    parts = [
+        f"{name} {s['requests']} req p95 {s['p95'] * 1000:.0f}ms err {s['error_rate']:.1%}"
+        for name, s in summary["endpoints"].items()
+    ]
+    rss = f"{summary['peak_rss_bytes'] / 2**20:.0f}MB" if summary["peak_rss_bytes"] else "n/a"
+    status = "ok" if summary["within_budget"] else "OVER BUDGET"
+    print(
+        f"  {summary['users']:>4} users: {summary['throughput']:.1f} req/s, RSS {rss}, "
+        f"{'; '.join(parts)} [{status}]",
+        file=sys.stderr,
+    )
+    for violation in summary["budget_violations"]:
+        print(f"        {violation}", file=sys.stderr)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--ramp", default="1,2,4,8,16", help="Concurrent users per stage")
+    parser.add_argument("--stage-seconds", type=float, default=20)
+    parser.add_argument("--think-seconds", type=float, default=0.0, help="Mean pause between a user's requests")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Endpoint weights, e.g. recommend=70,tutor=30")
+    parser.add_argument(
+        "--budget", action="append", default=[],
+        help="Override a budget, e.g. recommend.p95=1.5 or dub.error_rate=0.1 (repeatable)",
+    )
+    parser.add_argument(
+        "--required-users", type=int,
+        help="Fail only if a stage up to this many users breaks a budget (default: every stage)",
+    )
+    parser.add_argument("--videos", type=int, default=4, help="Distinct videos cycled by /dub")
+    parser.add_argument("--in-process", action="store_true", help="Drive the ASGI app in this process")
+    parser.add_argument("--output", help="Write the JSON report here (default: stdout)")
+    add_environment_arguments(parser)
+    return parser.parse_args(argv)
+
+
+async def run(args) -> dict:
+    mix = parse_mix(args.mix)
+    budgets = parse_budgets(args.budget)
+    user_stages = [int(n) for n in args.ramp.split(",") if n.strip()]
+    rng = random.Random(args.seed)
+    random.seed(args.seed)
+
+    workdir = tempfile.mkdtemp(prefix="knewbit-load-")
+    stats = Stats()
+    fakes = start_fakes(args, stats)
+    app = None
+    stages = []
+    startup = {}
+    try:
+        senders = {
+            "recommend": recommend_request(args.users),
+            "tutor": tutor_request(args.catalog_size, args.tutor_stream),
+        }
+        if "dub" in mix:
+            print(f"Generating {args.videos} synthetic {args.video_seconds:.0f}s videos...", file=sys.stderr)
+            videos = await asyncio.to_thread(
+                make_videos, os.path.join(workdir, "videos"), args.videos, args.video_seconds
+            )
+            senders["dub"] = dub_request(videos)
+
+        async with AsyncExitStack() as stack:
+            if args.in_process:
+                os.environ.update(app_environment(fakes))
+                # Uploads and dubbed outputs are written relative to the working directory
+                os.chdir(workdir)
+                sys.path.insert(0, BACKEND_DIR)
+                started = time.perf_counter()
+                import main
+
+                await stack.enter_async_context(main.app.router.lifespan_context(main.app))
+                while not main.startup_ready:
+                    if main.startup_error:
+                        raise RuntimeError(f"API did not become ready: {main.startup_error}")
+                    await asyncio.sleep(STARTUP_POLL_SECONDS)
+                startup = {
+                    "ready_seconds": round(time.perf_counter() - started, 3),
+                    "phases": main.startup_seconds,
+                }
+                transport = httpx.ASGITransport(app=main.app)
+                base_url, pid = "http://bench", os.getpid()
+            else:
+                app, base_url, startup = start_app(args, fakes, workdir)
+                transport, pid = None, app.pid
+            client = await stack.enter_async_context(
+                httpx.AsyncClient(
+                    base_url=base_url,
+                    transport=transport,
+                    timeout=args.timeout,
+                    limits=httpx.Limits(max_connections=max(user_stages)),
+                )
+            )
+
+            counter = [0]
+            print(f"Ramping {user_stages} users, {args.stage_seconds:.0f}s per stage, mix {mix}", file=sys.stderr)
+            for users in user_stages:
+                stage = Stage(users)
+                await run_stage(
+                    stage, client, senders, mix, args.stage_seconds,
+                    args.think_seconds, rng, counter, pid,
+                )
+                summary = stage.summary(budgets)
+                stages.append(summary)
+                print_stage(summary)
+    finally:
+        if app is not None:
+            stop_app(app)
+        for fake in fakes.values():
+            fake.stop()
+        if args.keep_workdir:
+            print(f"Kept {workdir} for inspection", file=sys.stderr)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    required = args.required_users or max(user_stages)
+    failed = [s for s in stages if s["users"] <= required and not s["within_budget"]]
+    return {
+        "version": REPORT_VERSION,
+        "commit": git_commit(),
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "mode": "in-process" if args.in_process else "uvicorn",
+        "config": {
+            "users": user_stages,
+            "stage_seconds": args.stage_seconds,
+            "think_seconds": args.think_seconds,
+            "mix": mix,
+            "budgets": budgets,
+            "required_users": required,
+            "upstream_latency": {
+                "gemini": args.gemini_latency,
+                "sarvam": args.tts_latency,
+                "knewbit": args.knewbit_latency,
+                "jitter": args.jitter,
+            },
+            "tts_429_ratio": args.tts_429_ratio,
+        },
+        "startup": startup,
+        "stages": stages,
+        "saturation": saturation(stages),
+        "upstream_calls": stats.snapshot(),
+        "passed": not failed,
+    }
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    report = asyncio.run(run(args))
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+        print(f"Wrote {args.output}", file=sys.stderr)
+    else:
+        print(output)
+    saturation_point = report["saturation"]
+    print(
+        f"{'PASSED' if report['passed'] else 'FAILED'}: within budget up to "
+        f"{saturation_point['users_within_budget']} users "
+        f"({saturation_point['throughput_within_budget']:.1f} req/s)",
+        file=sys.stderr,
+    )
+    return 0 if report["passed"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
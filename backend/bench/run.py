@@ -0,0 +1,413 @@
+"""
+Offline end-to-end benchmark.
+
+Starts the fakes from ``bench/fakes.py``, runs the API as a real uvicorn
+process pointed at them, and drives ``/dub``, ``/recommend-courses`` and
+``/ai-tutor`` with concurrent requests. Reports throughput, latency
+percentiles and the API's peak RSS per scenario, and how long the API took
+from launch to answering ``/health`` (live) and ``/ready`` (ready).
+
+    cd backend
+    python -m bench.run
+    python -m bench.run --scenarios recommend,tutor --requests 500 --concurrency 32
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+from bench.fakes import (
+    FakeServer,
+    Latency,
+    Stats,
+    free_port,
+    gemini_app,
+    knewbit_app,
+    make_catalog,
+    sarvam_app,
+)
+from bench.videos import make_videos
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIOS = ("dub", "recommend", "tutor")
+RSS_SAMPLE_SECONDS = 0.05
+STARTUP_POLL_SECONDS = 0.02
+
+QUESTIONS = [
+    "I want to learn python for data analysis",
+    "What should I take to get into machine learning?",
+    "Recommend something for building web apps",
+    "How do I get better at data structures for interviews?",
+    "I'd like to learn cloud computing",
+    "Courses on cybersecurity basics",
+    "I want to learn Rust",
+    "Help me understand statistics",
+]
+TUTOR_MESSAGES = [
+    "Can you explain the first concept again?",
+    "Why does this matter in practice?",
+    "Give me an example I can try.",
+    "I don't get the difference between concept 2 and 3.",
+]
+
+
+class Result:
+    def __init__(self, scenario: str):
+        self.scenario = scenario
+        self.latencies: List[float] = []
+        self.statuses = Counter()
+        self.elapsed = 0.0
+        self.peak_rss: Optional[int] = None
+
+    @property
+    def ok(self) -> int:
+        return self.statuses[200] + self.statuses[202]
+
+    @property
+    def errors(self) -> int:
+        return sum(self.statuses.values()) - self.ok
+
+    def percentile(self, p: float) -> float:
+        """Nearest-rank percentile of the latencies, in seconds."""
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+
+# --- Process memory ---
+def tree_rss(pid: int) -> Optional[int]:
+    """Resident bytes of a process and its children (Linux only)."""
+    total, stack = 0, [pid]
+    while stack:
+        current = stack.pop()
+        try:
+            with open(f"/proc/{current}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+                        break
+            for tid in os.listdir(f"/proc/{current}/task"):
+                with open(f"/proc/{current}/task/{tid}/children") as f:
+                    stack.extend(int(child) for child in f.read().split())
+        except (FileNotFoundError, ProcessLookupError, PermissionError):
+            if current == pid:
+                return None
+    return total
+
+
+async def sample_peak_rss(pid: int, result: Result, stop: asyncio.Event) -> None:
+    while not stop.is_set():
+        rss = tree_rss(pid)
+        if rss is not None:
+            result.peak_rss = max(result.peak_rss or 0, rss)
+        try:
+            await asyncio.wait_for(stop.wait(), RSS_SAMPLE_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+
+
+# --- Requests ---
+def bench_jwt(user: int) -> str:
+    """Unsigned JWT with a ``sub`` claim; the fake Knewbit API only checks presence."""
+
+    def encode(data: dict) -> str:
+        return base64.urlsafe_b64encode(json.dumps(data).encode()).decode().rstrip("=")
+
+    return f"{encode({'alg': 'none'})}.{encode({'sub': f'bench-user-{user}'})}.bench"
+
+
+def dub_request(videos: List[str]) -> Callable:
+    async def send(client: httpx.AsyncClient, i: int) -> int:
+        path = videos[i % len(videos)]
+        with open(path, "rb") as f:
+            response = await client.post(
+                "/dub",
+                files={"file": (os.path.basename(path), f, "video/mp4")},
+                data={"target_language": "Hindi", "lang_code": "hi-IN"},
+            )
+        return response.status_code
+
+    return send
+
+
+def recommend_request(users: int) -> Callable:
+    async def send(client: httpx.AsyncClient, i: int) -> int:
+        response = await client.post(
+            "/recommend-courses",
+            json={"user_question": QUESTIONS[i % len(QUESTIONS)]},
+            headers={"Authorization": f"Bearer {bench_jwt(i % users)}"},
+        )
+        return response.status_code
+
+    return send
+
+
+def tutor_request(courses: int, stream: bool) -> Callable:
+    async def send(client: httpx.AsyncClient, i: int) -> int:
+        body = {
+            "user_message": TUTOR_MESSAGES[i % len(TUTOR_MESSAGES)],
+            "course_id": f"course-{i % courses}",
+            "stream": stream,
+        }
+        async with client.stream("POST", "/ai-tutor", json=body) as response:
+            async for _ in response.aiter_bytes():
+                pass
+        return response.status_code
+
+    return send
+
+
+async def run_scenario(
+    scenario: str,
+    send: Callable,
+    base_url: str,
+    requests: int,
+    concurrency: int,
+    app_pid: int,
+    timeout: float,
+) -> Result:
+    result = Result(scenario)
+    queue = asyncio.Queue()
+    for i in range(requests):
+        queue.put_nowait(i)
+
+    async def worker(client: httpx.AsyncClient):
+        while not queue.empty():
+            i = queue.get_nowait()
+            started = time.perf_counter()
+            try:
+                status = await send(client, i)
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            result.latencies.append(time.perf_counter() - started)
+            result.statuses[status] += 1
+
+    stop = asyncio.Event()
+    sampler = asyncio.create_task(sample_peak_rss(app_pid, result, stop))
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=limits) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        result.elapsed = time.perf_counter() - started
+    stop.set()
+    await sampler
+    return result
+
+
+# --- Setup ---
+def start_fakes(args, stats: Stats) -> Dict[str, FakeServer]:
+    jitter = args.jitter
+    return {
+        "gemini": FakeServer(
+            gemini_app(
+                Latency(args.gemini_latency, jitter),
+                stats,
+                processing_seconds=args.gemini_processing_seconds,
+                transcribe_seconds_per_video_second=args.transcribe_seconds_per_video_second,
+            )
+        ).start(),
+        "sarvam": FakeServer(
+            sarvam_app(
+                Latency(args.tts_latency, jitter),
+                stats,
+                rate_limit_ratio=args.tts_429_ratio,
+            )
+        ).start(),
+        "knewbit": FakeServer(
+            knewbit_app(make_catalog(args.catalog_size), Latency(args.knewbit_latency, jitter), stats)
+        ).start(),
+    }
+
+
+def app_environment(fakes: Dict[str, FakeServer]) -> Dict[str, str]:
+    """Settings that point the API at the fakes and lift per-client limits."""
+    return {
+        "GOOGLE_API_KEY": "bench",
+        "GOOGLE_GEMINI_BASE_URL": fakes["gemini"].url,
+        "SARVAM_TTS_URL": f"{fakes['sarvam'].url}/text-to-speech",
+        "KNEWBIT_API_URL": fakes["knewbit"].url,
+        "SHARED_STATE_URL": "memory://",
+        "RATE_LIMIT_ENABLED": "false",
+        "DUB_CLIENT_MINUTES_PER_HOUR": "1000000",
+        "TRACE_SAMPLE_RATE": "0",
+    }
+
+
+def start_app(
+    args, fakes: Dict[str, FakeServer], workdir: str
+) -> Tuple[subprocess.Popen, str, Dict[str, Any]]:
+    """
+    Launch the API and wait for ``/ready``. Also returns the startup timings:
+    seconds from launch until the server answered at all (live) and until it
+    was ready, plus the per-phase timings the API reports.
+    """
+    port = free_port()
+    env = {**os.environ, "PYTHONPATH": BACKEND_DIR, **app_environment(fakes)}
+    log = open(os.path.join(workdir, "app.log"), "w")
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [
+            sys.executable, "-m", "uvicorn", "main:app",
+            "--host", "127.0.0.1", "--port", str(port),
+            "--log-level", "warning", "--no-access-log",
+        ],
+        cwd=workdir,  # Uploads and dubbed outputs land in the workdir
+        env=env,
+        stdout=log,
+        stderr=subprocess.STDOUT,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    startup: Dict[str, Any] = {}
+    deadline = time.time() + args.startup_timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"API exited during startup; see {log.name}")
+        try:
+            response = httpx.get(f"{base_url}/ready", timeout=1)
+        except httpx.HTTPError:
+            time.sleep(STARTUP_POLL_SECONDS)
+            continue
+        startup.setdefault("live_seconds", round(time.perf_counter() - started, 3))
+        body = response.json()
+        if response.status_code == 200:
+            startup["ready_seconds"] = round(time.perf_counter() - started, 3)
+            startup["phases"] = body.get("startup_seconds", {})
+            return process, base_url, startup
+        if body.get("status") == "failed":
+            break
+        time.sleep(STARTUP_POLL_SECONDS)
+    process.kill()
+    raise RuntimeError(f"API did not become ready; see {log.name}")
+
+
+def stop_app(process: subprocess.Popen) -> None:
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def report(results: List[Result], stats: Stats) -> None:
+    header = f"{'scenario':<10} {'requests':>8} {'ok':>6} {'errors':>6} {'req/s':>8} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9} {'peak RSS MB':>12}"
+    print()
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        rss = f"{r.peak_rss / 2**20:.0f}" if r.peak_rss else "n/a"
+        print(
+            f"{r.scenario:<10} {len(r.latencies):>8} {r.ok:>6} {r.errors:>6} "
+            f"{len(r.latencies) / r.elapsed if r.elapsed else 0:>8.1f} "
+            f"{r.percentile(50) * 1000:>9.0f} {r.percentile(99) * 1000:>9.0f} "
+            f"{max(r.latencies, default=0) * 1000:>9.0f} {rss:>12}"
+        )
+        failed = {status: n for status, n in r.statuses.items() if status not in (200, 202)}
+        if failed:
+            print(f"{'':<10} failures by status: {failed}")
+    print()
+    print("Upstream calls:", ", ".join(f"{k}={v}" for k, v in sorted(stats.snapshot().items())))
+
+
+def add_environment_arguments(parser: argparse.ArgumentParser) -> None:
+    """Flags shared with bench/load.py: request shapes and fake upstream behaviour."""
+    parser.add_argument("--timeout", type=float, default=600, help="Per-request timeout (s)")
+    parser.add_argument("--video-seconds", type=float, default=20)
+    parser.add_argument("--users", type=int, default=20, help="Distinct users for recommendations")
+    parser.add_argument("--catalog-size", type=int, default=200)
+    parser.add_argument("--tutor-stream", action="store_true", help="Use SSE for tutor replies")
+    parser.add_argument("--gemini-latency", type=float, default=0.3)
+    parser.add_argument("--gemini-processing-seconds", type=float, default=0.0)
+    parser.add_argument("--transcribe-seconds-per-video-second", type=float, default=0.02)
+    parser.add_argument("--tts-latency", type=float, default=0.15)
+    parser.add_argument("--tts-429-ratio", type=float, default=0.0)
+    parser.add_argument("--knewbit-latency", type=float, default=0.02)
+    parser.add_argument("--jitter", type=float, default=0.05, help="Max extra latency (s)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--startup-timeout", type=float, default=60)
+    parser.add_argument("--keep-workdir", action="store_true")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--requests", type=int, default=100, help="Requests per scenario")
+    parser.add_argument("--dub-requests", type=int, default=8, help="Requests for the dub scenario")
+    parser.add_argument("--concurrency", type=int, default=8)
+    add_environment_arguments(parser)
+    return parser.parse_args(argv)
+
+
+async def run(args) -> List[Result]:
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        raise SystemExit(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+    random.seed(args.seed)
+
+    workdir = tempfile.mkdtemp(prefix="knewbit-bench-")
+    stats = Stats()
+    fakes = start_fakes(args, stats)
+    app = None
+    results = []
+    failed = True
+    try:
+        if "dub" in scenarios:
+            print(f"Generating {args.dub_requests} synthetic {args.video_seconds:.0f}s videos...")
+            videos = await asyncio.to_thread(
+                make_videos, os.path.join(workdir, "videos"), args.dub_requests, args.video_seconds
+            )
+        app, base_url, startup = start_app(args, fakes, workdir)
+        print(f"API at {base_url} (pid {app.pid}), logs in {workdir}/app.log")
+        print(
+            f"Startup: live in {startup['live_seconds']:.2f}s, "
+            f"ready in {startup['ready_seconds']:.2f}s"
+        )
+
+        for scenario in scenarios:
+            if scenario == "dub":
+                send, count = dub_request(videos), args.dub_requests
+            elif scenario == "recommend":
+                send, count = recommend_request(args.users), args.requests
+            else:
+                send, count = tutor_request(args.catalog_size, args.tutor_stream), args.requests
+            print(f"Running {scenario}: {count} requests at concurrency {args.concurrency}...")
+            results.append(
+                await run_scenario(
+                    scenario, send, base_url, count, args.concurrency, app.pid, args.timeout
+                )
+            )
+        failed = any(r.errors for r in results)
+    finally:
+        if app is not None:
+            stop_app(app)
+        for fake in fakes.values():
+            fake.stop()
+        if args.keep_workdir or failed:
+            print(f"Kept {workdir} for inspection")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report(results, stats)
+    return results
+
+
+def main(argv=None) -> int:
+    results = asyncio.run(run(parse_args(argv)))
+    return 1 if any(r.errors for r in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,172 @@
+"""
+Cold-start profile.
+
+Launches the API several times against the upstream fakes and reports, per
+launch, the seconds until it answered at all (live) and until ``/ready``
+returned 200, with the per-phase timings the API reports. Then profiles
+``import main`` with ``python -X importtime`` and lists the slowest direct
+imports. Fails if a module that should load lazily was imported eagerly.
+
+    cd backend
+    python -m bench.startup
+    python -m bench.startup --runs 10 --top 20 --output startup.json
+"""
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+from typing import Dict, List
+
+from bench.fakes import Stats
+from bench.run import (
+    BACKEND_DIR,
+    add_environment_arguments,
+    app_environment,
+    start_app,
+    start_fakes,
+    stop_app,
+)
+
+# Heavy SDKs that main.py only loads on first use or in the startup warm-up
+DEFERRED_MODULES = ("google.genai", "google.generativeai", "langgraph", "langchain_core")
+
+
+def import_profile(env: Dict[str, str]) -> List[dict]:
+    """
+    ``import main`` under ``-X importtime``: every module with its self and
+    cumulative import time in seconds and its nesting depth (1 = imported by
+    main itself).
+    """
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=BACKEND_DIR,
+        env={**os.environ, "PYTHONPATH": BACKEND_DIR, **env},
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    modules = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or line.count("|") != 2:
+            continue
+        head, cumulative_us, name = line.split("|")
+        self_us = head.removeprefix("import time:").strip()
+        if not self_us.isdigit():
+            continue  # Header row
+        stripped = name.lstrip(" ")
+        modules.append(
+            {
+                "module": stripped,
+                "self_seconds": int(self_us) / 1e6,
+                "cumulative_seconds": int(cumulative_us) / 1e6,
+                "depth": (len(name) - len(stripped) - 1) // 2,
+            }
+        )
+    return modules
+
+
+def summarize(values: List[float]) -> dict:
+    return {
+        "min": round(min(values), 3),
+        "median": round(statistics.median(values), 3),
+        "max": round(max(values), 3),
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--runs", type=int, default=5, help="Cold starts to measure")
+    parser.add_argument("--top", type=int, default=10, help="Slowest imports to list")
+    parser.add_argument("--output", help="Write the JSON report here")
+    add_environment_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def run(args) -> dict:
+    workdir = tempfile.mkdtemp(prefix="knewbit-startup-")
+    stats = Stats()
+    fakes = start_fakes(args, stats)
+    launches = []
+    try:
+        for i in range(args.runs):
+            app, _, startup = start_app(args, fakes, workdir)
+            stop_app(app)
+            launches.append(startup)
+            print(
+                f"Run {i + 1}: live {startup['live_seconds']:.2f}s, "
+                f"ready {startup['ready_seconds']:.2f}s "
+                f"{json.dumps(startup['phases'])}",
+                file=sys.stderr,
+            )
+        modules = import_profile(app_environment(fakes))
+    finally:
+        for fake in fakes.values():
+            fake.stop()
+        if args.keep_workdir:
+            print(f"Kept {workdir} for inspection", file=sys.stderr)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    main_module = next(m for m in modules if m["module"] == "main")
+    eager = [
+        deferred
+        for deferred in DEFERRED_MODULES
+        if any(
+            m["module"] == deferred or m["module"].startswith(deferred + ".")
+            for m in modules
+        )
+    ]
+    top = sorted(
+        (m for m in modules if m["depth"] == 1),
+        key=lambda m: m["cumulative_seconds"],
+        reverse=True,
+    )[: args.top]
+    return {
+        "runs": args.runs,
+        "live_seconds": summarize([s["live_seconds"] for s in launches]),
+        "ready_seconds": summarize([s["ready_seconds"] for s in launches]),
+        "phases": {
+            name: summarize([s["phases"][name] for s in launches if name in s["phases"]])
+            for name in launches[0]["phases"]
+        },
+        "import_main_seconds": main_module["cumulative_seconds"],
+        "slowest_imports": [
+            {"module": m["module"], "seconds": round(m["cumulative_seconds"], 3)}
+            for m in top
+        ],
+        "eagerly_imported": eager,
+        "passed": not eager,
+    }
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    report = run(args)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(json.dumps(report, indent=2) + "\n")
+        print(f"Wrote {args.output}", file=sys.stderr)
+
+    print()
+    print(
+        f"Cold start over {report['runs']} runs (median): "
+        f"live {report['live_seconds']['median']:.2f}s, "
+        f"ready {report['ready_seconds']['median']:.2f}s"
+    )
+    for name, seconds in report["phases"].items():
+        print(f"  {name:<22} {seconds['median']:>7.3f}s")
+    print(f"import main: {report['import_main_seconds']:.2f}s; slowest direct imports:")
+    for m in report["slowest_imports"]:
+        print(f"  {m['module']:<30} {m['seconds']:>7.3f}s")
+    if report["eagerly_imported"]:
+        print(f"FAILED: imported at startup: {', '.join(report['eagerly_imported'])}")
+    return 0 if report["passed"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,43 @@
+"""Synthetic test videos for the dubbing benchmark, generated with ffmpeg."""
+
+import os
+from typing import List
+
+import ffmpeg
+
+
+def make_video(path: str, seconds: float, seed: int = 0) -> str:
+    """
+    Write a small H.264/AAC MP4 with a test pattern and a tone. The tone's
+    pitch depends on ``seed`` so every video hashes differently and misses
+    the transcription and result caches.
+    """
+    video = ffmpeg.input(
+        f"testsrc2=size=320x240:rate=15:duration={seconds}", f="lavfi"
+    )
+    audio = ffmpeg.input(
+        f"sine=frequency={200 + seed % 800}:duration={seconds}", f="lavfi"
+    )
+    (
+        ffmpeg.output(
+            video,
+            audio,
+            path,
+            vcodec="libx264",
+            preset="ultrafast",
+            pix_fmt="yuv420p",
+            acodec="aac",
+            shortest=None,
+        )
+        .overwrite_output()
+        .run(quiet=True)
+    )
+    return path
+
+
+def make_videos(directory: str, count: int, seconds: float) -> List[str]:
+    os.makedirs(directory, exist_ok=True)
+    return [
+        make_video(os.path.join(directory, f"bench_{i}.mp4"), seconds, seed=i)
+        for i in range(count)
+    ]
@@ -0,0 +1,353 @@
+import asyncio
+import hashlib
+import heapq
+import json
+import math
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+
+class TTLCache:
+    """
+    LRU cache whose entries also expire ``ttl`` seconds after being set.
+
+    ``on_evict(key, value)`` is called for entries dropped by expiry or LRU
+    eviction (not for explicit ``pop``/``clear``), e.g. to delete files.
+    """
+
+    def __init__(
+        self,
+        max_size: int = 256,
+        ttl: float = 300,
+        on_evict: Optional[Callable[[Any, Any], None]] = None,
+    ):
+        self.max_size, self.ttl, self.on_evict = max_size, ttl, on_evict
+        self._data: "OrderedDict[Any, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _evicted(self, items: List[Tuple[Any, Any]]) -> None:
+        if self.on_evict:
+            for key, value in items:
+                self.on_evict(key, value)
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            expires_at, value = entry
+            if expires_at > time.monotonic():
+                self._data.move_to_end(key)
+                return value
+            del self._data[key]
+        self._evicted([(key, value)])
+        return default
+
+    def set(self, key: Any, value: Any, ttl: Optional[float] = None) -> None:
+        ttl = self.ttl if ttl is None else ttl
+        evicted = []
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                old_key, (_, old_value) = self._data.popitem(last=False)
+                evicted.append((old_key, old_value))
+        self._evicted(evicted)
+
+    def purge_expired(self) -> int:
+        """Drop every expired entry now rather than on next access."""
+        now = time.monotonic()
+        with self._lock:
+            expired = [(k, v) for k, (exp, v) in self._data.items() if exp <= now]
+            for key, _ in expired:
+                del self._data[key]
+        self._evicted(expired)
+        return len(expired)
+
+    def pop(self, key: Any, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def items(self) -> List[Tuple[Any, Any]]:
+        """Snapshot of the live ``(key, value)`` pairs, oldest first."""
+        now = time.monotonic()
+        with self._lock:
+            return [(k, v) for k, (exp, v) in self._data.items() if exp > now]
+
+    def __contains__(self, key: Any) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+_MISSING = object()
+
+
+class ExpiringMap:
+    """
+    Mapping whose entries expire at a deadline.
+
+    Deadlines sit in a min-heap, so setting a key and expiring the earliest
+    entries are O(log n), and ``expire`` touches only what is actually due
+    instead of walking the whole map. Re-setting a key leaves its old heap
+    entry behind; stale entries are recognised by their sequence number and
+    skipped. Expired entries read as absent but are only removed (and
+    returned) by ``expire``, so callers can release what they hold. Not
+    thread-safe on its own; callers hold their own lock.
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.time):
+        self.clock = clock
+        self._data: Dict[Any, Tuple[Optional[float], int, Any]] = {}
+        self._heap: List[Tuple[float, int, Any]] = []
+        self._seq = 0
+        self._overwritten: List[Tuple[Any, Any]] = []
+
+    def set(self, key: Any, value: Any, ttl: Optional[float] = None) -> None:
+        old = self._data.get(key)
+        if old is not None and old[0] is not None and old[0] <= self.clock():
+            # Expired but not yet collected; still report it from expire()
+            self._overwritten.append((key, old[2]))
+        self._seq += 1
+        deadline = None if ttl is None else self.clock() + ttl
+        self._data[key] = (deadline, self._seq, value)
+        if deadline is not None:
+            heapq.heappush(self._heap, (deadline, self._seq, key))
+
+    def replace(self, key: Any, value: Any) -> None:
+        """Change a live entry's value while keeping its deadline."""
+        deadline, seq, _ = self._data[key]
+        self._data[key] = (deadline, seq, value)
+
+    def _entry(self, key: Any):
+        entry = self._data.get(key)
+        if entry is not None and entry[0] is not None and entry[0] <= self.clock():
+            return None
+        return entry
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        entry = self._entry(key)
+        return default if entry is None else entry[2]
+
+    def deadline(self, key: Any) -> Optional[float]:
+        entry = self._entry(key)
+        return None if entry is None else entry[0]
+
+    def pop(self, key: Any, default: Any = None) -> Any:
+        entry = self._data.pop(key, None)
+        return default if entry is None else entry[2]
+
+    def __contains__(self, key: Any) -> bool:
+        return self._entry(key) is not None
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def keys(self) -> List[Any]:
+        return list(self._data)
+
+    def items(self) -> List[Tuple[Any, Any]]:
+        """Snapshot of the live ``(key, value)`` pairs."""
+        now = self.clock()
+        return [
+            (key, value)
+            for key, (deadline, _, value) in self._data.items()
+            if deadline is None or deadline > now
+        ]
+
+    def next_deadline(self) -> Optional[float]:
+        """Earliest pending deadline, or None if nothing can expire."""
+        while self._heap:
+            deadline, seq, key = self._heap[0]
+            entry = self._data.get(key)
+            if entry is not None and entry[1] == seq:
+                return deadline
+            heapq.heappop(self._heap)
+        return None
+
+    def expire(self) -> List[Tuple[Any, Any]]:
+        """Remove every entry whose deadline has passed and return them."""
+        now, expired = self.clock(), self._overwritten
+        self._overwritten = []
+        while self._heap and self._heap[0][0] <= now:
+            _, seq, key = heapq.heappop(self._heap)
+            entry = self._data.get(key)
+            if entry is not None and entry[1] == seq:
+                del self._data[key]
+                expired.append((key, entry[2]))
+        return expired
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls for the same key into a single in-flight task.
+
+    Every caller awaits the same result (or exception). The task is shielded,
+    so one caller going away does not cancel the work for the others.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[Any, "asyncio.Future"] = {}
+
+    async def do(self, key: Any, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    def __contains__(self, key: Any) -> bool:
+        return key in self._inflight
+
+    def __len__(self) -> int:
+        return len(self._inflight)
+
+
+# --- Recommendation cache ---
+_STOPWORDS = {
+    "a", "an", "the", "i", "me", "my", "we", "you", "to", "of", "in", "on",
+    "for", "and", "or", "is", "are", "am", "be", "it", "that", "this", "with",
+    "about", "what", "which", "some", "any", "can", "could", "would", "should",
+    "do", "does", "want", "wanna", "like", "please", "get", "recommend",
+    "suggest", "how",
+}
+# Kept as terms, and two questions only match semantically when they agree
+# on them: "I do not want python" must not reuse "I want python"
+_NEGATIONS = {"no", "not", "never", "without", "nor", "except", "avoid"}
+
+
+def normalize_question(question: str) -> str:
+    """Lowercase, expand "n't", strip punctuation and collapse whitespace."""
+    question = re.sub(r"n[’']t\b", " not", question.lower())
+    question = re.sub(r"[^\w\s]", " ", question)
+    return " ".join(question.split())
+
+
+def _question_terms(normalized: str) -> Counter:
+    # Crude plural folding so "network" and "networks" land on the same term
+    terms = [
+        t[:-1] if len(t) > 3 and t.endswith("s") and not t.endswith("ss") else t
+        for t in normalized.split()
+        if t not in _STOPWORDS
+    ]
+    return Counter(terms)
+
+
+def _cosine(a: Counter, b: Counter) -> float:
+    if not a or not b:
+        return 0.0
+    dot = sum(count * b.get(term, 0) for term, count in a.items())
+    norm = math.sqrt(sum(v * v for v in a.values())) * math.sqrt(
+        sum(v * v for v in b.values())
+    )
+    return dot / norm if norm else 0.0
+
+
+def enrollment_fingerprint(enrolled_courses: List[dict]) -> str:
+    """Stable hash of the set of enrolled course ids."""
+    ids = sorted(str(course["id"]) for course in enrolled_courses or [])
+    return hashlib.md5(",".join(ids).encode()).hexdigest()
+
+
+# Course fields that recommendations depend on; ratings and enrollment counts
+# change all day and must not invalidate every cached answer
+CATALOG_FINGERPRINT_FIELDS = (
+    "id", "slug", "title", "description", "difficulty", "tags",
+)
+
+
+def catalog_fingerprint(all_courses: List[dict]) -> str:
+    """Version string for a catalog snapshot; changes when a course's content does."""
+    stable = sorted(
+        (
+            {field: course.get(field) for field in CATALOG_FINGERPRINT_FIELDS}
+            for course in all_courses
+        ),
+        key=lambda course: str(course["id"]),
+    )
+    return hashlib.md5(json.dumps(stable, sort_keys=True).encode()).hexdigest()
+
+
+class RecommendationCache:
+    """
+    Two-tier cache for ``/recommend-courses`` results.
+
+    Entries are keyed by (enrolled course fingerprint, normalized question,
+    catalog version). The exact tier is a plain LRU+TTL lookup; the semantic
+    tier compares the question's term vector against other cached questions
+    for the same user state and catalog, so paraphrases above
+    ``similarity_threshold`` with the same negations reuse an earlier answer. Storing or looking up
+    under a new catalog version drops everything cached for the old one.
+    """
+
+    def __init__(
+        self,
+        max_size: int = 512,
+        ttl: float = 3600,
+        similarity_threshold: float = 0.85,
+    ):
+        self.similarity_threshold = similarity_threshold
+        self._entries = TTLCache(max_size=max_size, ttl=ttl)
+        self._catalog_version: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def _check_catalog(self, catalog_version: str) -> None:
+        with self._lock:
+            if catalog_version != self._catalog_version:
+                if self._catalog_version is not None:
+                    print(
+                        f"Catalog changed ({self._catalog_version[:8]} -> "
+                        f"{catalog_version[:8]}), invalidating recommendation cache"
+                    )
+                self._entries.clear()
+                self._catalog_version = catalog_version
+
+    def get(
+        self, enrolled_hash: str, question: str, catalog_version: str
+    ) -> Optional[List[dict]]:
+        self._check_catalog(catalog_version)
+        normalized = normalize_question(question)
+        entry = self._entries.get((enrolled_hash, normalized))
+        if entry is not None:
+            return entry["recommendations"]
+
+        terms = _question_terms(normalized)
+        negations = _NEGATIONS & terms.keys()
+        best, best_value, best_score = None, None, 0.0
+        for key, value in self._entries.items():
+            if key[0] != enrolled_hash or _NEGATIONS & value["terms"].keys() != negations:
+                continue
+            score = _cosine(terms, value["terms"])
+            if score > best_score:
+                best, best_value, best_score = key, value, score
+        if best is not None and best_score >= self.similarity_threshold:
+            print(f"Semantic recommendation cache hit ({best_score:.2f}): {best[1]!r}")
+            return best_value["recommendations"]
+        return None
+
+    def set(
+        self,
+        enrolled_hash: str,
+        question: str,
+        catalog_version: str,
+        recommendations: List[dict],
+    ) -> None:
+        self._check_catalog(catalog_version)
+        normalized = normalize_question(question)
+        self._entries.set(
+            (enrolled_hash, normalized),
+            {
+                "recommendations": recommendations,
+                "terms": _question_terms(normalized),
+            },
+        )
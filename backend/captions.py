@@ -0,0 +1,96 @@
+import subprocess
+from typing import List, Tuple
+
+from dub_pipeline import language_tag, mp4_movflags
+
+# Shown this long when a segment has no usable end time
+DEFAULT_CUE_SECONDS = 2.0
+CAPTION_FORMATS = ("srt", "vtt")
+
+
+def caption_cues(segments: List[dict]) -> List[Tuple[float, float, str]]:
+    """
+    ``(start, end, text)`` cues from transcript segments, in time order.
+    Segments without text are dropped; a missing or backwards end time
+    runs to the next cue (or ``DEFAULT_CUE_SECONDS``).
+    """
+    ordered = sorted(
+        (s for s in segments if str(s.get("translated_text") or "").strip()),
+        key=lambda s: float(s["start"]),
+    )
+    cues = []
+    for i, segment in enumerate(ordered):
+        start = max(0.0, float(segment["start"]))
+        try:
+            end = float(segment.get("end"))
+        except (TypeError, ValueError):
+            end = 0.0
+        if end <= start:
+            later = [float(s["start"]) for s in ordered[i + 1 :] if float(s["start"]) > start]
+            end = later[0] if later else start + DEFAULT_CUE_SECONDS
+        # Blank lines end a cue in both formats
+        lines = [line.strip() for line in segment["translated_text"].splitlines()]
+        cues.append((start, end, "\n".join(line for line in lines if line)))
+    return cues
+
+
+def _timestamp(seconds: float, separator: str) -> str:
+    millis = int(round(seconds * 1000))
+    hours, millis = divmod(millis, 3_600_000)
+    minutes, millis = divmod(millis, 60_000)
+    secs, millis = divmod(millis, 1000)
+    return f"{hours:02d}:{minutes:02d}:{secs:02d}{separator}{millis:03d}"
+
+
+def format_captions(segments: List[dict], caption_format: str) -> str:
+    """Transcript segments as an SRT (``srt``) or WebVTT (``vtt``) document."""
+    cues = caption_cues(segments)
+    if caption_format == "srt":
+        blocks = [
+            f"{i}\n{_timestamp(start, ',')} --> {_timestamp(end, ',')}\n{text}"
+            for i, (start, end, text) in enumerate(cues, 1)
+        ]
+        return "\n\n".join(blocks) + "\n"
+    if caption_format == "vtt":
+        blocks = ["WEBVTT"] + [
+            # "-->" would be read as a timing line
+            f"{_timestamp(start, '.')} --> {_timestamp(end, '.')}\n{text.replace('-->', '->')}"
+            for start, end, text in cues
+        ]
+        return "\n\n".join(blocks) + "\n"
+    raise ValueError(f"Unknown caption format: {caption_format}")
+
+
+def mux_soft_subtitles(
+    video_path: str, subtitles: List[Tuple[str, str, str]], output_path: str
+) -> None:
+    """
+    Copy a video with its original audio into an MP4 with one soft subtitle
+    track per ``(srt_path, lang_code, title)``, the first being the
+    default. Video and audio are stream copied, never re-encoded or burned
+    in; only the subtitles are converted (to MP4's ``mov_text``).
+    """
+    cmd = ["ffmpeg", "-y", "-i", video_path]
+    for srt_path, _, _ in subtitles:
+        cmd += ["-i", srt_path]
+    cmd += ["-map", "0:v", "-map", "0:a?"]
+    for i, (_, lang_code, title) in enumerate(subtitles):
+        cmd += [
+            "-map",
+            f"{i + 1}:s",
+            f"-metadata:s:s:{i}",
+            f"language={language_tag(lang_code)}",
+            f"-metadata:s:s:{i}",
+            f"title={title}",
+            f"-disposition:s:{i}",
+            "default" if i == 0 else "0",
+        ]
+    cmd += ["-c", "copy", "-c:s", "mov_text", "-f", "mp4", *mp4_movflags(False), output_path]
+    print(f"Running FFmpeg command: {' '.join(cmd[:6])}... ({len(subtitles)} subtitle tracks)")
+    result = subprocess.run(
+        cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+    )
+    if result.returncode != 0:
+        stderr = result.stderr.decode(errors="replace")[-2000:]
+        print(f"FFmpeg error: {stderr}")
+        raise Exception(f"FFmpeg failed: {stderr}")
@@ -1,143 +1,204 @@
-import os
-import json
-import requests
-from typing import List, Optional, TypedDict
-from pydantic import BaseModel
-from langgraph.graph import StateGraph, END
-from langchain_core.runnables import RunnableLambda
-from google import genai
-
-# --- ENV ---
-client = genai.Client(api_key=os.getenv("GOOGLE_API_KEY"))
-KNEWBIT_API_URL = os.getenv("KNEWBIT_API_URL")
-
-# --- API Endpoints ---
-ENROLLED_COURSES_API = f"{KNEWBIT_API_URL}/enrolled_courses"
-ALL_COURSES_API = f"{KNEWBIT_API_URL}/all_courses"
-
-
-# --- Types ---
-class CleanedCourse(TypedDict):
-    id: str
-    title: str
-    description: Optional[str]
-    category: Optional[str]
-    difficulty: str
-    tags: List[str]
-    is_free: bool
-    price: float
-    rating: float
-    enrollments: int
-
-
-class AgentState(TypedDict):
-    user_id: str
-    user_question: str
-    enrolled_courses: Optional[List[CleanedCourse]]
-    all_courses: Optional[List[CleanedCourse]]
-    matched_courses: Optional[List[dict]]
-
-
-class QueryRequest(BaseModel):
-    user_id: str
-    user_question: str
-
-
-# --- Clean course data ---
-def clean_course_data(courses: List[dict]) -> List[CleanedCourse]:
-    return [
-        {
-            "id": c["id"],
-            "title": c["title"],
-            "description": c.get("description") or c.get("summary") or "",
-            "category": c.get("category_name", ""),
-            "difficulty": c["difficulty_level"],
-            "tags": c.get("tags", []),
-            "is_free": c["is_free"],
-            "price": c["price"],
-            "rating": c["average_rating"],
-            "enrollments": c["enrollment_count"],
-        }
-        for c in courses
-        if c["status"] == "published"
-    ]
-
-
-# --- Step 1: Get enrolled courses ---
-def fetch_enrolled(state: AgentState) -> AgentState:
-    response = requests.get(f"{ENROLLED_COURSES_API}?user_id={state['user_id']}")
-    enrolled = clean_course_data(response.json())
-    return {**state, "enrolled_courses": enrolled}
-
-
-# --- Step 2: Get all platform courses ---
-def fetch_all_courses(state: AgentState) -> AgentState:
-    response = requests.get(ALL_COURSES_API)
-    all_courses = clean_course_data(response.json())
-    return {**state, "all_courses": all_courses}
-
-
-# --- Step 3: Gemini selects best matches ---
-def gemini_match_courses(state: AgentState) -> AgentState:
-    user_question = state["user_question"]
-    enrolled_courses = state["enrolled_courses"]
-    all_courses = state["all_courses"]
-    enrolled_ids = {course["id"] for course in enrolled_courses}
-    available_courses = [c for c in all_courses if c["id"] not in enrolled_ids]
-
-    # Limit courses for token efficiency
-    available_courses = available_courses[:100]
-
-    prompt = f"""
-You are an intelligent course recommendation system.
-
-Analyze the user's learning query and their enrolled course history to determine their skill level, learning pattern, and interests.
-Then, select the most relevant existing platform courses that would help the user achieve their goal.
-
-User Question:
-{user_question}
-
-User's Enrolled Courses (JSON):
-{json.dumps(enrolled_courses)}
-
-Available Platform Courses (JSON):
-{json.dumps(all_courses)}
-
-Instructions:
-1. Understand the user's domain knowledge and learning style from enrolled courses.
-2. Identify the top 3–5 platform courses that are not already enrolled, which best align with the user's question.
-3. Return a JSON list like:
-[
-  {{
-    "id": "...",
-    "title": "...",
-    "reason": "why this course is ideal for the user"
-  }}
-]
+"""
+Nightly batch of "next course" recommendations.
+
+Runs the same steps as a live ``/recommend-courses`` request (catalog
+snapshot, enrolled courses, Gemini match) for every active user, a few users
+at a time, and stores the picks in SQLite keyed by user and catalog version.
+``/recommend-courses`` serves them instantly when the request carries no
+question; free-form questions still go through the live graph.
+
+    cd backend
+    python -m course --users active_users.jsonl
+    python -m course --users - --concurrency 16 < active_users.jsonl
+
+Each input line is one active user: ``{"user_id": "<JWT sub>",
+"enrolled_course_ids": ["..."]}``. A line with a ``token`` (the user's
+Knewbit JWT) instead of ``enrolled_course_ids`` fetches the enrollments from
+the course API like a live request does.
 """
 
-    result = client.models.generate_content(model="gemini-2.5-flash", contents=prompt)
-
-    try:
-        content = result.text.strip()
-        matched = json.loads(content)
-    except Exception as e:
-        print("Gemini output parsing failed:", e)
-        matched = []
-
-    return {**state, "matched_courses": matched}
-
-
-# --- LangGraph Workflow ---
-graph = StateGraph(AgentState)
-
-graph.add_node("fetch_enrolled", RunnableLambda(fetch_enrolled))
-graph.add_node("fetch_all_courses", RunnableLambda(fetch_all_courses))
-graph.add_node("gemini_match", RunnableLambda(gemini_match_courses))
-
-graph.set_entry_point("fetch_enrolled")
-graph.add_edge("fetch_enrolled", "fetch_all_courses")
-graph.add_edge("fetch_all_courses", "gemini_match")
-graph.add_edge("gemini_match", END)
-
-compiled = graph.compile()
+import argparse
+import asyncio
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from typing import Iterable, List, Optional
+
+import dotenv
+
+dotenv.load_dotenv()
+
+# Question the batch (and a question-less request) is answered for
+NEXT_COURSE_QUESTION = (
+    "Based on the courses I have already taken, which course should I take next?"
+)
+RECOMMENDATIONS_DB = os.getenv(
+    "RECOMMENDATIONS_DB",
+    os.path.join(tempfile.gettempdir(), "knewbit-max-recommendations.db"),
+)
+RECOMMENDATION_BATCH_CONCURRENCY = int(
+    os.getenv("RECOMMENDATION_BATCH_CONCURRENCY", "8")
+)
+
+
+class PrecomputedRecommendations:
+    """Recommendations per (user, catalog version) in a SQLite file shared by workers."""
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS recommendations ("
+            "user_id TEXT NOT NULL, catalog_version TEXT NOT NULL, "
+            "data TEXT NOT NULL, created_at REAL NOT NULL, "
+            "PRIMARY KEY (user_id, catalog_version))"
+        )
+        self._conn.commit()
+
+    def get(self, user_id: str, catalog_version: str) -> Optional[List[dict]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM recommendations "
+                "WHERE user_id = ? AND catalog_version = ?",
+                (user_id, catalog_version),
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, user_id: str, catalog_version: str, recommendations: List[dict]) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO recommendations "
+                "(user_id, catalog_version, data, created_at) VALUES (?, ?, ?, ?)",
+                (user_id, catalog_version, json.dumps(recommendations), time.time()),
+            )
+            self._conn.commit()
+
+    def delete_user(self, user_id: str) -> None:
+        """Drop a user's picks, e.g. after their enrollments changed."""
+        with self._lock:
+            self._conn.execute("DELETE FROM recommendations WHERE user_id = ?", (user_id,))
+            self._conn.commit()
+
+    def prune(self, catalog_version: str) -> int:
+        """Drop picks made against any other catalog version."""
+        with self._lock:
+            deleted = self._conn.execute(
+                "DELETE FROM recommendations WHERE catalog_version != ?",
+                (catalog_version,),
+            ).rowcount
+            self._conn.commit()
+        return deleted
+
+
+# --- Batch ---
+def read_active_users(lines: Iterable[str]) -> List[dict]:
+    users = []
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        user = json.loads(line)
+        if not user.get("user_id"):
+            raise ValueError(f"Line {number}: missing user_id")
+        if "enrolled_course_ids" not in user and not user.get("token"):
+            raise ValueError(f"Line {number}: needs enrolled_course_ids or token")
+        users.append(user)
+    return users
+
+
+async def run_batch(
+    users: List[dict],
+    store: PrecomputedRecommendations,
+    concurrency: int = RECOMMENDATION_BATCH_CONCURRENCY,
+    force: bool = False,
+) -> dict:
+    """
+    Precompute recommendations for ``users``, at most ``concurrency`` at a
+    time. Users that already have picks for the current catalog are skipped
+    unless ``force``, so an interrupted run can simply be restarted.
+    """
+    # The live pipeline's steps, caches and metrics; imported here because
+    # main imports this module for the store
+    import main as api
+
+    catalog = api.fetch_all_courses({})
+    all_courses, catalog_version = catalog["all_courses"], catalog["catalog_version"]
+    courses_by_id = {course["id"]: course for course in all_courses}
+    semaphore = asyncio.Semaphore(concurrency)
+    counts = {"stored": 0, "skipped": 0, "empty": 0, "failed": 0}
+
+    def recommend(user: dict) -> List[dict]:
+        state = {
+            "knewbit_jwt": user.get("token", ""),
+            "user_question": NEXT_COURSE_QUESTION,
+            "all_courses": all_courses,
+            "catalog_version": catalog_version,
+        }
+        if "enrolled_course_ids" in user:
+            state["enrolled_courses"] = [
+                courses_by_id[course_id]
+                for course_id in user["enrolled_course_ids"]
+                if course_id in courses_by_id
+            ]
+        else:
+            state = api.fetch_enrolled(state)
+        return api.gemini_match_courses(state)["matched_courses"]
+
+    async def process(user: dict) -> None:
+        user_id = str(user["user_id"])
+        if not force and store.get(user_id, catalog_version) is not None:
+            counts["skipped"] += 1
+            return
+        async with semaphore:
+            try:
+                matched = await asyncio.to_thread(recommend, user)
+            except Exception as e:
+                counts["failed"] += 1
+                print(f"Recommendation failed for user {user_id}: {e}")
+                return
+        if not matched:
+            # Left to live generation on the user's next request
+            counts["empty"] += 1
+            return
+        store.set(user_id, catalog_version, matched)
+        counts["stored"] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(process(user) for user in users))
+    pruned = store.prune(catalog_version)
+    return {
+        "users": len(users),
+        "catalog_version": catalog_version,
+        **counts,
+        "pruned": pruned,
+        "seconds": round(time.perf_counter() - started, 1),
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--users", required=True, help="Active users JSON lines file, or - for stdin")
+    parser.add_argument("--db", default=RECOMMENDATIONS_DB)
+    parser.add_argument("--concurrency", type=int, default=RECOMMENDATION_BATCH_CONCURRENCY)
+    parser.add_argument("--force", action="store_true", help="Recompute users that already have picks")
+    args = parser.parse_args(argv)
+
+    if args.users == "-":
+        users = read_active_users(sys.stdin)
+    else:
+        with open(args.users) as f:
+            users = read_active_users(f)
+    print(f"Precomputing recommendations for {len(users)} users into {args.db}...")
+    summary = asyncio.run(
+        run_batch(users, PrecomputedRecommendations(args.db), args.concurrency, args.force)
+    )
+    print(json.dumps(summary))
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
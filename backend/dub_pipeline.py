@@ -0,0 +1,487 @@
+import asyncio
+import io
+import os
+import subprocess
+import sys
+import time
+import wave
+from array import array
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, List, NamedTuple, Tuple
+
+import ffmpeg
+
+from metrics import stage_seconds, track_stage
+from video_process import (
+    TTS_BATCH_MAX_CHARS,
+    TTS_BATCH_MAX_INPUTS,
+    TTS_SAMPLE_RATE,
+    synthesize_speech_batch,
+)
+
+# The dubbed audio track is built as 16-bit mono PCM at the TTS sample rate
+TIMELINE_SAMPLE_RATE = TTS_SAMPLE_RATE
+SILENCE_CHUNK_SAMPLES = TIMELINE_SAMPLE_RATE  # Write long gaps a second at a time
+
+# ISO 639-2 tags for audio and subtitle track metadata, by Sarvam language code prefix
+LANGUAGE_TAGS = {
+    "bn": "ben",
+    "en": "eng",
+    "gu": "guj",
+    "hi": "hin",
+    "kn": "kan",
+    "ml": "mal",
+    "mr": "mar",
+    "od": "ori",
+    "pa": "pan",
+    "ta": "tam",
+    "te": "tel",
+}
+
+
+def mp4_movflags(fragmented: bool) -> List[str]:
+    """
+    ``-movflags`` for MP4 output: fragmented MP4 (empty moov, ~2s fragments)
+    can be played while it is still being written; +faststart moves the moov
+    atom to the front, which only happens once encoding has finished.
+    """
+    if fragmented:
+        return [
+            "-movflags",
+            "+frag_keyframe+empty_moov+default_base_moof",
+            "-frag_duration",
+            "2000000",  # Microseconds per fragment
+        ]
+    return ["-movflags", "+faststart"]
+
+
+def decode_wav(data: bytes, sample_rate: int = TIMELINE_SAMPLE_RATE) -> array:
+    """Decode a 16-bit WAV clip into mono samples at ``sample_rate``."""
+    with wave.open(io.BytesIO(data)) as wav:
+        if wav.getsampwidth() != 2:
+            raise ValueError(f"Unsupported TTS sample width: {wav.getsampwidth()}")
+        channels, rate = wav.getnchannels(), wav.getframerate()
+        samples = array("h", wav.readframes(wav.getnframes()))
+    if sys.byteorder == "big":
+        samples.byteswap()
+    if channels > 1:
+        samples = samples[::channels]
+    if rate != sample_rate:
+        samples = _resample(samples, rate, sample_rate)
+    return samples
+
+
+def _resample(samples: array, rate: int, target: int) -> array:
+    # Linear interpolation; only used if the TTS ignores the requested rate
+    if not samples:
+        return samples
+    length = int(len(samples) * target / rate)
+    step = rate / target
+    last = len(samples) - 1
+    out = array("h", bytes(2 * length))
+    for i in range(length):
+        pos = i * step
+        j = min(int(pos), last)
+        frac = pos - j
+        nxt = samples[min(j + 1, last)]
+        out[i] = int(samples[j] + (nxt - samples[j]) * frac)
+    return out
+
+
+class AudioTimeline:
+    """
+    Places clips at their start times in one PCM stream, written strictly in
+    time order.
+
+    Only audio that can still overlap with a later clip is held in memory
+    (the tail of the most recent clip); everything before a new clip's start
+    is written out immediately. Overlapping clips are mixed with clipping,
+    and a clip starting before what has already been written is pushed to
+    the current write position.
+    """
+
+    def __init__(
+        self,
+        write: Callable[[bytes], Awaitable[None]],
+        sample_rate: int = TIMELINE_SAMPLE_RATE,
+    ):
+        self.write, self.sample_rate = write, sample_rate
+        self.written = 0  # Samples already handed to ``write``
+        self._tail = array("h")  # Mixed samples starting at ``written``
+
+    async def _emit(self, samples: array) -> None:
+        if samples:
+            if sys.byteorder == "big":
+                samples = array("h", samples)
+                samples.byteswap()
+            await self.write(samples.tobytes())
+            self.written += len(samples)
+
+    async def _silence(self, count: int) -> None:
+        while count > 0:
+            n = min(count, SILENCE_CHUNK_SAMPLES)
+            await self.write(bytes(2 * n))
+            self.written += n
+            count -= n
+
+    async def add(self, start_seconds: float, samples: array) -> None:
+        start = int(start_seconds * self.sample_rate)
+        if start < self.written:
+            print(f"Dubbed clip at {start_seconds:.2f}s overlaps written audio; shifting")
+            start = self.written
+        lead = start - self.written
+        if lead >= len(self._tail):
+            await self._emit(self._tail)
+            self._tail = array("h")
+            await self._silence(start - self.written)
+        else:
+            await self._emit(self._tail[:lead])
+            del self._tail[:lead]
+
+        overlap = min(len(self._tail), len(samples))
+        for i in range(overlap):
+            self._tail[i] = max(-32768, min(32767, self._tail[i] + samples[i]))
+        self._tail.extend(samples[overlap:])
+
+    async def finish(self, total_seconds: float) -> None:
+        """Flush what is held and pad with silence up to ``total_seconds``."""
+        await self._emit(self._tail)
+        self._tail = array("h")
+        await self._silence(int(total_seconds * self.sample_rate) - self.written)
+
+
+async def batch_segments(
+    segments: AsyncIterator[dict],
+    max_inputs: int = TTS_BATCH_MAX_INPUTS,
+    max_chars: int = TTS_BATCH_MAX_CHARS,
+) -> AsyncIterator[List[dict]]:
+    """
+    Group adjacent segments into TTS batches of at most ``max_inputs`` texts
+    of at most ``max_chars`` characters each. Longer texts go on their own.
+    A batch is closed when full or when the source ends.
+    """
+    batch = []
+    async for segment in segments:
+        if len(segment["translated_text"]) > max_chars:
+            if batch:
+                yield batch
+                batch = []
+            yield [segment]
+            continue
+        batch.append(segment)
+        if len(batch) >= max_inputs:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+async def synthesize_in_order(
+    segments: AsyncIterator[dict], lang_code: str, window: int, batch_size: int = 1
+) -> AsyncIterator[Tuple[dict, array]]:
+    """
+    Run TTS for segments as they arrive, ``batch_size`` texts per request
+    and at most ``window`` requests at a time, and yield ``(segment,
+    samples)`` in arrival order.
+
+    The window is the bounded queue between TTS and the timeline: a new
+    batch is only pulled from the source once the oldest one has been
+    consumed, so memory holds at most ``window * batch_size`` clips however
+    long the video is.
+    """
+
+    async def synthesize(batch):
+        with track_stage("tts_request"):
+            started = time.perf_counter()
+            clips = await asyncio.to_thread(
+                synthesize_speech_batch,
+                [segment["translated_text"] for segment in batch],
+                lang_code,
+            )
+        # Every segment in the batch waited for the whole request
+        for _ in batch:
+            stage_seconds.observe(time.perf_counter() - started, stage="tts_segment")
+        return [(segment, decode_wav(wav)) for segment, wav in zip(batch, clips)]
+
+    pending = deque()
+    try:
+        async for batch in batch_segments(segments, max_inputs=batch_size):
+            if len(pending) >= window:
+                for item in await pending.popleft():
+                    yield item
+            pending.append(asyncio.create_task(synthesize(batch)))
+        while pending:
+            for item in await pending.popleft():
+                yield item
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+@asynccontextmanager
+async def fan_out(source: AsyncIterator[dict], count: int):
+    """
+    ``count`` iterators that each yield every item of ``source``, for
+    consumers running side by side (one transcript, several dubbed
+    languages). One task reads the source and items wait in a queue per
+    consumer, so a slow consumer never holds up the others; the queues are
+    unbounded, which is fine for transcript segments. An error from the
+    source is raised in every consumer.
+    """
+    queues = [asyncio.Queue() for _ in range(count)]
+    end = object()
+
+    async def pump():
+        try:
+            async for item in source:
+                for queue in queues:
+                    queue.put_nowait(item)
+        except Exception as e:
+            for queue in queues:
+                queue.put_nowait(e)
+            return
+        for queue in queues:
+            queue.put_nowait(end)
+
+    async def consume(queue: asyncio.Queue):
+        while (item := await queue.get()) is not end:
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    task = asyncio.create_task(pump())
+    try:
+        yield [consume(queue) for queue in queues]
+    finally:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+
+class DubTrack(NamedTuple):
+    """One dubbed audio track: its segments, TTS language code and display title."""
+
+    segments: AsyncIterator[dict]
+    lang_code: str
+    title: str = ""
+
+
+def language_tag(lang_code: str) -> str:
+    return LANGUAGE_TAGS.get(lang_code.split("-")[0].lower(), "und")
+
+
+async def dub_video_incremental(
+    video_path: str,
+    tracks: List[DubTrack],
+    output_path: str,
+    fragmented: bool = False,
+    tts_concurrency: int = 8,
+    tts_batch_size: int = TTS_BATCH_MAX_INPUTS,
+) -> int:
+    """
+    Dub a video with segments flowing transcription -> TTS -> timeline -> mux.
+
+    ffmpeg starts right away and reads each dubbed track as raw PCM from a
+    pipe (the first on stdin), so the encode runs alongside TTS and, with
+    ``fragmented``, the first fragments of the output exist as soon as the
+    first clips are placed. No per-segment files are written.
+
+    The video is encoded once however many tracks there are; each track
+    becomes an audio stream tagged with its language, the first being the
+    default. Returns the number of segments dubbed per track.
+    """
+    probe = await asyncio.to_thread(ffmpeg.probe, video_path)
+    duration = float(probe["format"]["duration"])
+
+    # Tracks after the first are read from extra pipes ffmpeg inherits
+    pipes = [os.pipe() for _ in tracks[1:]]
+    cmd = ["ffmpeg", "-y", "-i", video_path]
+    for source in ["pipe:0"] + [f"pipe:{read_fd}" for read_fd, _ in pipes]:
+        cmd += [
+            "-f",
+            "s16le",
+            "-ar",
+            str(TIMELINE_SAMPLE_RATE),
+            "-ac",
+            "1",
+            "-thread_queue_size",
+            "1024",
+            "-i",
+            source,
+        ]
+    cmd += ["-map", "0:v"]
+    for i, track in enumerate(tracks):
+        cmd += [
+            "-map",
+            f"{i + 1}:a",
+            f"-metadata:s:a:{i}",
+            f"language={language_tag(track.lang_code)}",
+            f"-disposition:a:{i}",
+            "default" if i == 0 else "0",
+        ]
+        if track.title:
+            cmd += [f"-metadata:s:a:{i}", f"title={track.title}"]
+    cmd += [
+        "-c:v",
+        "libx264",
+        "-preset",
+        "fast",
+        "-crf",
+        "23",
+        "-c:a",
+        "aac",
+        "-b:a",
+        "128k",
+        "-ac",
+        "2",
+        "-f",
+        "mp4",
+        *mp4_movflags(fragmented),
+        "-shortest",
+        output_path,
+    ]
+    print(f"Running FFmpeg command: {' '.join(cmd[:10])}... ({len(tracks)} audio tracks)")
+    with track_stage("mux"):
+        return await run_mux(
+            cmd, tracks, pipes, duration, tts_concurrency, tts_batch_size
+        )
+
+
+async def run_mux(
+    cmd: List[str],
+    tracks: List[DubTrack],
+    pipes: List[Tuple[int, int]],
+    duration: float,
+    tts_concurrency: int,
+    tts_batch_size: int,
+) -> int:
+    """
+    Run ffmpeg, feeding it each dubbed track as its clips are placed: the
+    first on stdin, the others on ``pipes`` (read end, write end). Tracks
+    are fed independently, so one language waiting on TTS never stalls
+    another.
+    """
+    loop = asyncio.get_running_loop()
+    pipe_files = [os.fdopen(write_fd, "wb", buffering=0) for _, write_fd in pipes]
+    try:
+        process = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            pass_fds=[read_fd for read_fd, _ in pipes],
+        )
+    except BaseException:
+        for f in pipe_files:
+            f.close()
+        raise
+    finally:
+        # ffmpeg has its own copies of the read ends
+        for read_fd, _ in pipes:
+            os.close(read_fd)
+
+    # Keep the end of ffmpeg's log for errors without buffering all of it
+    stderr_tail = deque(maxlen=50)
+
+    async def drain_stderr():
+        async for line in process.stderr:
+            stderr_tail.append(line.decode(errors="replace"))
+
+    stderr_task = asyncio.create_task(drain_stderr())
+
+    async def pipe_writer(f) -> asyncio.StreamWriter:
+        transport, protocol = await loop.connect_write_pipe(
+            lambda: asyncio.streams.FlowControlMixin(loop), f
+        )
+        return asyncio.StreamWriter(transport, protocol, None, loop)
+
+    async def feed(track: DubTrack, writer: asyncio.StreamWriter) -> int:
+        async def write(data: bytes):
+            writer.write(data)
+            await writer.drain()
+
+        timeline = AudioTimeline(write)
+        count = 0
+        try:
+            async for segment, samples in synthesize_in_order(
+                track.segments, track.lang_code, tts_concurrency, tts_batch_size
+            ):
+                await timeline.add(float(segment["start"]), samples)
+                count += 1
+            if not count:
+                raise ValueError("No segments found in transcript.")
+            await timeline.finish(duration)
+            writer.close()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # ffmpeg exited early; its return code and log explain why
+        return count
+
+    writers = [process.stdin]
+    tasks = []
+    try:
+        try:
+            for f in pipe_files:
+                writers.append(await pipe_writer(f))
+            pipe_files = []
+            tasks = [
+                asyncio.create_task(feed(track, writer))
+                for track, writer in zip(tracks, writers)
+            ]
+            counts = await asyncio.gather(*tasks)
+        finally:
+            # Stop the other tracks if one failed
+            for task in tasks:
+                task.cancel()
+            for writer in writers:
+                writer.close()
+            for f in pipe_files:
+                f.close()
+        returncode = await process.wait()
+        await stderr_task
+        if returncode != 0:
+            stderr = "".join(stderr_tail)
+            print(f"FFmpeg error: {stderr}")
+            raise Exception(f"FFmpeg failed: {stderr}")
+    except BaseException:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+        stderr_task.cancel()
+        raise
+    return counts[0]
+
+
+def extract_audio_track(video_path: str, track_index: int, output_path: str) -> None:
+    """
+    Write the video and one dubbed track of a multi-track output to
+    ``output_path`` with stream copy: nothing is re-encoded, so this takes
+    about as long as reading the file.
+    """
+    partial_path = f"{output_path}.part"
+    cmd = [
+        "ffmpeg",
+        "-y",
+        "-i",
+        video_path,
+        "-map",
+        "0:v",
+        "-map",
+        f"0:a:{track_index}",
+        "-c",
+        "copy",
+        "-disposition:a:0",
+        "default",
+        "-f",
+        "mp4",
+        *mp4_movflags(False),
+        partial_path,
+    ]
+    result = subprocess.run(
+        cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+    )
+    if result.returncode != 0:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        stderr = result.stderr.decode(errors="replace")[-2000:]
+        raise Exception(f"FFmpeg failed: {stderr}")
+    os.replace(partial_path, output_path)
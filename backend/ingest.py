@@ -0,0 +1,242 @@
+import asyncio
+import hashlib
+import os
+import uuid
+from urllib.parse import parse_qsl
+from typing import Dict, List, Optional
+
+from python_multipart import MultipartParser
+from python_multipart.exceptions import MultipartParseError
+from python_multipart.multipart import parse_options_header
+from starlette.requests import Request
+
+# Room for the form fields and multipart framing on top of the file itself
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+MAX_FIELD_BYTES = 8 * 1024
+# MPEG-TS is recognised by its sync byte repeating every 188-byte packet
+TS_PACKET_BYTES = 188
+HEADER_SNIFF_BYTES = 2 * TS_PACKET_BYTES + 1
+
+
+class UploadRejected(Exception):
+    """An upload refused while streaming; maps to an HTTP response."""
+
+    def __init__(self, status_code: int, message: str):
+        super().__init__(message)
+        self.status_code, self.message = status_code, message
+
+
+def sniff_container(header: bytes) -> Optional[str]:
+    """Name the video container from the first bytes of a file, if recognised."""
+    if header[4:8] == b"ftyp" or header[4:8] in (b"moov", b"mdat", b"wide", b"free"):
+        return "mp4"
+    if header.startswith(b"\x1a\x45\xdf\xa3"):
+        return "matroska"
+    if header.startswith(b"RIFF") and header[8:12] == b"AVI ":
+        return "avi"
+    if header.startswith(b"FLV"):
+        return "flv"
+    if header.startswith(b"\x00\x00\x01\xba"):
+        return "mpeg"
+    if header.startswith(b"OggS"):
+        return "ogg"
+    if header.startswith(b"\x30\x26\xb2\x75"):
+        return "asf"
+    if len(header) > 2 * TS_PACKET_BYTES and all(
+        header[i] == 0x47 for i in range(0, 3 * TS_PACKET_BYTES, TS_PACKET_BYTES)
+    ):
+        return "mpegts"
+    return None
+
+
+class IngestedUpload:
+    """Form fields of a ``/dub`` request plus the uploaded file, already on disk."""
+
+    def __init__(self):
+        self.fields: Dict[str, str] = {}
+        self.path: Optional[str] = None
+        self.filename: Optional[str] = None
+        self.container: Optional[str] = None
+        self.size = 0
+        self.md5: Optional[str] = None
+
+    def discard(self) -> None:
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+        self.path = None
+
+
+class _UploadParser:
+    """
+    Multipart callbacks that hash and size-check the file part as it arrives.
+    Callbacks only collect bytes; the caller writes them out between chunks
+    so disk writes stay off the event loop.
+    """
+
+    def __init__(self, upload: IngestedUpload, max_bytes: int, validate_container: bool):
+        self.upload = upload
+        self.max_bytes = max_bytes
+        self.validate_container = validate_container
+        self.pending: List[bytes] = []
+        self._hash = hashlib.md5()
+        self._header_name = b""
+        self._header_value = b""
+        self._disposition = b""
+        self._field: Optional[str] = None
+        self._field_data = bytearray()
+        self._in_file = False
+        self._sniff = b""
+        self.finished = False
+
+    def on_part_begin(self):
+        self._disposition, self._field, self._field_data = b"", None, bytearray()
+        self._in_file = False
+
+    def on_header_field(self, data, start, end):
+        self._header_name += data[start:end]
+
+    def on_header_value(self, data, start, end):
+        self._header_value += data[start:end]
+
+    def on_header_end(self):
+        if self._header_name.lower() == b"content-disposition":
+            self._disposition = self._header_value
+        self._header_name, self._header_value = b"", b""
+
+    def on_headers_finished(self):
+        _, options = parse_options_header(self._disposition)
+        name = options.get(b"name", b"").decode("utf-8", "replace")
+        filename = options.get(b"filename")
+        if filename is None:
+            self._field = name
+            return
+        # Browsers send an empty file part when no file was chosen
+        filename = os.path.basename(filename.decode("utf-8", "replace"))
+        if name != "file" or not filename:
+            return
+        if self.upload.filename is not None:
+            raise UploadRejected(400, "Only one file may be uploaded per request.")
+        self.upload.filename = filename
+        self.upload.path = f"temp_{uuid.uuid4()}_{filename}"
+        self._in_file = True
+
+    def on_part_data(self, data, start, end):
+        chunk = data[start:end]
+        if self._in_file:
+            self.upload.size += len(chunk)
+            if self.upload.size > self.max_bytes:
+                raise UploadRejected(
+                    413,
+                    f"Upload exceeds the {self.max_bytes // (1024 * 1024)} MB limit.",
+                )
+            if self.upload.container is None:
+                self._sniff += chunk[: HEADER_SNIFF_BYTES - len(self._sniff)]
+                if len(self._sniff) >= HEADER_SNIFF_BYTES:
+                    self._check_container()
+            self._hash.update(chunk)
+            self.pending.append(chunk)
+        elif self._field is not None:
+            self._field_data += chunk
+            if len(self._field_data) > MAX_FIELD_BYTES:
+                raise UploadRejected(400, f"Form field '{self._field}' is too large.")
+
+    def _check_container(self):
+        container = sniff_container(self._sniff)
+        if container is None and self.validate_container:
+            raise UploadRejected(415, "Unsupported file type; upload a video file.")
+        self.upload.container = container or "unknown"
+
+    def on_part_end(self):
+        if self._in_file:
+            if self.upload.container is None:
+                self._check_container()
+            self.upload.md5 = self._hash.hexdigest()
+            self._in_file = False
+        elif self._field is not None:
+            self.upload.fields[self._field] = self._field_data.decode("utf-8", "replace")
+
+    def on_end(self):
+        self.finished = True
+
+    def callbacks(self):
+        return {
+            "on_part_begin": self.on_part_begin,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+            "on_end": self.on_end,
+        }
+
+
+async def ingest_upload(
+    request: Request, max_bytes: int, validate_container: bool = True
+) -> IngestedUpload:
+    """
+    Stream a multipart ``/dub`` body straight into the job workspace.
+
+    The file part goes to ``temp_<uuid>_<filename>`` chunk by chunk while its
+    MD5 is computed, so it is written once and never re-read for hashing.
+    Oversize bodies are refused from ``Content-Length`` before reading, and
+    mid-stream once the file passes ``max_bytes``; unrecognised containers
+    are refused after the first few bytes. Malformed or truncated bodies are
+    refused with 400. On rejection the partial file is removed and
+    ``UploadRejected`` raised.
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type == b"application/x-www-form-urlencoded":
+        return await _read_urlencoded(request)
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise UploadRejected(400, "Expected a multipart/form-data body.")
+
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit():
+        if int(content_length) > max_bytes + MULTIPART_OVERHEAD_BYTES:
+            raise UploadRejected(
+                413, f"Upload exceeds the {max_bytes // (1024 * 1024)} MB limit."
+            )
+
+    upload = IngestedUpload()
+    handler = _UploadParser(upload, max_bytes, validate_container)
+    parser = MultipartParser(params[b"boundary"], handler.callbacks())
+    out = None
+    try:
+        try:
+            async for chunk in request.stream():
+                parser.write(chunk)
+                if handler.pending:
+                    if out is None:
+                        out = open(upload.path, "wb")
+                    data = b"".join(handler.pending)
+                    handler.pending.clear()
+                    await asyncio.to_thread(out.write, data)
+            parser.finalize()
+        except MultipartParseError as e:
+            raise UploadRejected(400, f"Malformed multipart body: {e}")
+        if not handler.finished:
+            raise UploadRejected(400, "Multipart body ended before its closing boundary.")
+    except BaseException:
+        if out is not None:
+            out.close()
+        upload.discard()
+        raise
+    if out is not None:
+        out.close()
+    elif upload.path is not None:
+        # Zero-length file part
+        open(upload.path, "wb").close()
+    return upload
+
+
+async def _read_urlencoded(request: Request) -> IngestedUpload:
+    # URL-only requests need no file part; forms without a file arrive this way
+    body = bytearray()
+    async for chunk in request.stream():
+        body += chunk
+        if len(body) > MULTIPART_OVERHEAD_BYTES:
+            raise UploadRejected(413, "Form body is too large.")
+    upload = IngestedUpload()
+    upload.fields = dict(parse_qsl(body.decode("utf-8", "replace")))
+    return upload
@@ -1,89 +1,277 @@
+import time
+
+# Taken before the heavy imports below so /ready can report import time
+PROCESS_IMPORT_STARTED = time.perf_counter()
+
 import re
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
 import os
 import uuid
 import json
-import shutil
+import base64
+import hashlib
+import hmac
+import glob
 import subprocess
 import asyncio
 import threading
-from concurrent.futures import ThreadPoolExecutor
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request
-from fastapi.responses import JSONResponse, FileResponse
+from contextlib import aclosing, asynccontextmanager
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import (
+    JSONResponse,
+    FileResponse,
+    StreamingResponse,
+    PlainTextResponse,
+)
 from video_process import (
     VideoCache,
-    transcribe_video,
-    clean_json_output,
-    generate_tts_audio,
+    transcribe_video_segments,
+    TTS_BATCH_MAX_INPUTS,
+    GEMINI_TIMEOUT_SECONDS,
+    load_genai,
+    translate_segment_stream,
+)
+from tutor_sessions import (
+    TutorSessionStore,
+    MemorySessionBackend,
+    SQLiteSessionBackend,
+)
+from retrieval import BM25Index, course_passages
+from resilience import CircuitOpenError, UpstreamPolicy
+from course import (
+    NEXT_COURSE_QUESTION,
+    RECOMMENDATIONS_DB,
+    PrecomputedRecommendations,
+)
+from shared_state import shared_state
+# Imported for its side effect: registers the "shared-state://" limiter storage
+from shared_state import SharedStateLimitStorage  # noqa: F401
+from admission import AdmissionController, AdmissionRejected, probe_file, probe_youtube
+from ingest import UploadRejected, ingest_upload
+from captions import CAPTION_FORMATS, format_captions, mux_soft_subtitles
+from dub_pipeline import (
+    DubTrack,
+    dub_video_incremental,
+    extract_audio_track,
+    fan_out,
+)
+from tracing import (
+    TracingMiddleware,
+    current_span,
+    sink as trace_sink,
+    trace,
+    traceparent_of,
+)
+from metrics import (
+    CONTENT_TYPE as METRICS_CONTENT_TYPE,
+    Gauge,
+    registry as metrics_registry,
+    record_cache,
+    stage_seconds,
+    timed,
+    track_stage,
+    track_upstream,
+)
+from cache import (
+    TTLCache,
+    SingleFlight,
+    RecommendationCache,
+    enrollment_fingerprint,
+    catalog_fingerprint,
 )
 import ffmpeg
-from google import genai
 import requests
-from typing import List, Optional, TypedDict
+import httpx
+from typing import (
+    TYPE_CHECKING,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+    TypedDict,
+)
 from pydantic import BaseModel
-from langgraph.graph import StateGraph, END
-from langchain_core.runnables import RunnableLambda
 import dotenv
-import google.generativeai as geneai
 from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
 
+if TYPE_CHECKING:
+    from google import genai
+    from google.genai import types
 
-dotenv.load_dotenv()
-
-geneai.configure(api_key=os.environ["GOOGLE_API_KEY"])
 
+dotenv.load_dotenv()
 
 # --- ENV ---
-client = genai.Client(api_key=os.getenv("GOOGLE_API_KEY"))
 KNEWBIT_API_URL = os.getenv("KNEWBIT_API_URL")
+# HS256 key the Knewbit API signs user tokens with. When set, verified tokens
+# share one enrolled-courses entry per user; otherwise entries are per token
+KNEWBIT_JWT_SECRET = os.getenv("KNEWBIT_JWT_SECRET")
 
 # --- API Endpoints ---
 ENROLLED_COURSES_API = f"{KNEWBIT_API_URL}/api/user/enrolled-courses"
 ALL_COURSES_API = f"{KNEWBIT_API_URL}/courses"
 MODEL_NAME = "gemini-2.5-flash-preview-05-20"
 
-# Request deduplication storage
-active_requests = {}
-request_lock = threading.Lock()
+# Request deduplication lives in shared state so it holds across workers:
+#   dub:active:<key>  claim held by the worker running the job; expires if stuck
+#   dub:result:<key>  finished output, kept briefly for late arrivals
+DUB_CLAIM_TTL_SECONDS = 1800  # 30 minutes
+DUB_RESULT_TTL_SECONDS = 600
+DUB_POLL_SECONDS = 2
+
+# Progressive delivery (delivery=progressive):
+#   dub:job:<id>       job id handed to the client -> request key
+#   dub:partial:<key>  output path while the mux is writing it
+#   dub:error:<key>    failure of a background job, reported by /dub/result
+# Fragmented MP4 is playable while it is written; +faststart only after the mux
+DUB_PROGRESSIVE_OUTPUT = os.getenv("DUB_PROGRESSIVE_OUTPUT", "true").lower() == "true"
+DUB_JOB_START_GRACE_SECONDS = 10
+DUB_TAIL_POLL_SECONDS = 0.5
+DUB_STREAM_CHUNK_BYTES = 256 * 1024
+background_dub_tasks = set()
+
+# TTS requests in flight per job; also bounds the clips held in memory
+DUB_TTS_CONCURRENCY = int(os.getenv("DUB_TTS_CONCURRENCY", "8"))
+# Adjacent short segments share one multi-input TTS request (1 disables batching)
+DUB_TTS_BATCH_SIZE = min(
+    int(os.getenv("DUB_TTS_BATCH_SIZE", str(TTS_BATCH_MAX_INPUTS))), TTS_BATCH_MAX_INPUTS
+)
 
+# One request may dub into several languages (comma-separated target_language
+# and lang_code): one transcription and video encode, one audio track each
+DUB_MAX_LANGUAGES = int(os.getenv("DUB_MAX_LANGUAGES", "4"))
 
-# Cleanup function for stuck requests
-def cleanup_old_requests():
-    """Remove old requests that might be stuck"""
-    import time
+# output=srt|vtt|subtitled stops after transcription: captions, no TTS or encode
+DUB_OUTPUTS = ("dubbed", *CAPTION_FORMATS, "subtitled")
 
-    current_time = time.time()
-    with request_lock:
-        # Remove requests older than 30 minutes
-        keys_to_remove = []
-        for key, timestamp in active_requests.items():
-            if isinstance(timestamp, bool):  # Old format, clean up
-                keys_to_remove.append(key)
-            elif current_time - timestamp > 1800:  # 30 minutes
-                keys_to_remove.append(key)
+# Duplicates within this worker attach to the same coroutine
+dub_jobs = SingleFlight()
 
-        for key in keys_to_remove:
-            active_requests.pop(key, None)
-            print(f"Cleaned up old request: {key}")
+# Cost-aware admission: per-worker encode budget and queue, per-client hourly budget
+admission = AdmissionController(
+    shared_state,
+    capacity=float(os.getenv("DUB_ENCODE_BUDGET_SECONDS", "3600")),
+    max_queue=int(os.getenv("DUB_MAX_QUEUE", "10")),
+    max_duration=float(os.getenv("DUB_MAX_VIDEO_MINUTES", "120")) * 60,
+    client_seconds_per_hour=float(os.getenv("DUB_CLIENT_MINUTES_PER_HOUR", "180"))
+    * 60,
+)
 
+# Uploads are streamed to disk and refused past this size or if not a video
+DUB_MAX_UPLOAD_BYTES = int(float(os.getenv("DUB_MAX_UPLOAD_MB", "500")) * 1024 * 1024)
+DUB_VALIDATE_CONTAINER = os.getenv("DUB_VALIDATE_CONTAINER", "true").lower() == "true"
+
+
+def dub_track_path(output_path: str, lang_code: str) -> str:
+    """Where the single-language copy of a multi-track output is kept."""
+    return f"{os.path.splitext(output_path)[0]}.{lang_code}.mp4"
+
+
+def remove_dub_output(request_key, output_path):
+    # The output plus any single-language copies made from it
+    track_copies = glob.glob(dub_track_path(glob.escape(output_path), "*"))
+    for path in [output_path, *track_copies]:
+        if os.path.exists(path):
+            os.remove(path)
+            print(f"Removed expired dubbed output for {request_key}: {path}")
+
+
+# Expired shared state is swept from the event loop (see lifespan)
+STATE_SWEEP_MAX_INTERVAL_SECONDS = 60
 
-# Schedule cleanup every 5 minutes
-import threading
-import time
 
+def sweep_expired_state():
+    """Drop expired claims, progress and results; delete expired dubbed outputs"""
+    for key, value in shared_state.purge_expired():
+        if key.startswith("dub:result:"):
+            remove_dub_output(key.removeprefix("dub:result:"), value)
 
-def periodic_cleanup():
+
+async def run_state_sweeper():
+    # Wake at the next deadline (bounded so other workers' entries get swept too)
     while True:
-        time.sleep(300)  # 5 minutes
-        cleanup_old_requests()
+        next_expiry = await asyncio.to_thread(shared_state.next_expiry)
+        delay = STATE_SWEEP_MAX_INTERVAL_SECONDS
+        if next_expiry is not None:
+            delay = min(delay, max(1.0, next_expiry - time.time()))
+        await asyncio.sleep(delay)
+        try:
+            await asyncio.to_thread(sweep_expired_state)
+        except Exception as e:
+            print(f"Error sweeping expired state: {e}")
+
+
+# --- Startup ---
+# google-genai, LangGraph and the legacy Gemini SDK take seconds to import, so
+# they load on first use. The lifespan warms them up in the background and
+# /ready turns 200 once that is done; /health only says the process is up.
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "true").lower() == "true"
+startup_seconds: Dict[str, float] = {}
+startup_ready = False
+startup_error: Optional[str] = None
+
+gemini_client: Optional["genai.Client"] = None
+gemini_client_lock = threading.Lock()
+
 
+def get_gemini_client() -> "genai.Client":
+    """google-genai client, created on first use."""
+    global gemini_client
+    if gemini_client is None:
+        with gemini_client_lock:
+            if gemini_client is None:
+                from google import genai
+
+                gemini_client = genai.Client(api_key=os.getenv("GOOGLE_API_KEY"))
+    return gemini_client
+
+
+async def warm_up():
+    """Load the lazy SDKs and clients off the event loop, timing each phase."""
+    global startup_ready, startup_error
+    phases = [
+        ("gemini_client", get_gemini_client),
+        ("recommendation_graph", get_recommendation_graph),
+        ("legacy_genai", load_genai),
+    ]
+    for name, load in phases if STARTUP_WARMUP else []:
+        started = time.perf_counter()
+        try:
+            await asyncio.to_thread(load)
+        except Exception as e:
+            startup_error = f"{name}: {e}"
+            print(f"Startup warm-up failed in {startup_error}")
+            return
+        startup_seconds[name] = round(time.perf_counter() - started, 3)
+    startup_seconds["ready"] = round(time.perf_counter() - PROCESS_IMPORT_STARTED, 3)
+    startup_ready = True
+    phase_summary = ", ".join(
+        f"{name} {seconds:.2f}s" for name, seconds in startup_seconds.items()
+    )
+    print(f"Startup finished: {phase_summary}")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    startup_seconds["import"] = round(time.perf_counter() - PROCESS_IMPORT_STARTED, 3)
+    sweeper = asyncio.create_task(run_state_sweeper())
+    warming = asyncio.create_task(warm_up())
+    try:
+        yield
+    finally:
+        sweeper.cancel()
+        warming.cancel()
+        if course_http_client is not None:
+            await course_http_client.aclose()
+        # Write out traces still queued for export
+        await asyncio.to_thread(trace_sink.flush)
 
-# Start cleanup thread
-cleanup_thread = threading.Thread(target=periodic_cleanup, daemon=True)
-cleanup_thread.start()
 
 # Create FastAPI application with metadata for Swagger
 app = FastAPI(
@@ -92,9 +280,41 @@ app = FastAPI(
     version="1.0.0",
     docs_url="/docs",  # Swagger UI
     redoc_url="/redoc",  # ReDoc documentation
+    lifespan=lifespan,
 )
 
-video_cache = VideoCache(max_size=10)
+video_cache = VideoCache()
+
+# Course catalog snapshot and recommendation result caches. Enrolled courses
+# live in shared state (enrolled:<key>) so the enrollment webhook can drop
+# them for every worker
+catalog_cache = TTLCache(max_size=1, ttl=60)
+ENROLLED_CACHE_TTL_SECONDS = 120
+recommendation_cache = RecommendationCache(
+    max_size=512,
+    ttl=3600,
+    similarity_threshold=float(
+        os.getenv("RECOMMENDATION_SIMILARITY_THRESHOLD", "0.85")
+    ),
+)
+# Nightly "next course" picks per (user, catalog version), see course.py
+precomputed_recommendations = PrecomputedRecommendations(RECOMMENDATIONS_DB)
+
+# Course details for the AI tutor, keyed by both id and slug
+course_cache = TTLCache(max_size=256, ttl=300)
+course_fetches = SingleFlight()
+course_http_client: Optional[httpx.AsyncClient] = None
+
+
+def get_course_http_client() -> httpx.AsyncClient:
+    """Shared, connection-pooled client for the course API."""
+    global course_http_client
+    if course_http_client is None or course_http_client.is_closed:
+        course_http_client = httpx.AsyncClient(
+            timeout=10,
+            limits=httpx.Limits(max_connections=50, max_keepalive_connections=20),
+        )
+    return course_http_client
 
 # Configure CORS for frontend integration
 app.add_middleware(
@@ -110,8 +330,17 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Outermost, so traced requests time everything below (see tracing.py)
+app.add_middleware(TracingMiddleware)
+
 # Add rate limiting middleware (optional but recommended for production)
-limiter = Limiter(key_func=get_remote_address)
+# Counters live in shared state so limits apply per host, not per worker
+# RATE_LIMIT_ENABLED=false is for load tests and benchmarks (see bench/)
+limiter = Limiter(
+    key_func=get_remote_address,
+    storage_uri="shared-state://",
+    enabled=os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true",
+)
 app.state.limiter = limiter
 app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
 
@@ -140,15 +369,105 @@ async def health_check():
     return {"status": "healthy", "service": "knewbit-max-api"}
 
 
-@app.post("/dub")
+# Readiness endpoint, separate from liveness
+@app.get("/ready")
+async def readiness_check():
+    """
+    Readiness probe: 503 until the startup warm-up has loaded the Gemini
+    clients and the recommendation graph, then 200 with the startup timings
+    """
+    if startup_ready:
+        status = "ready"
+    elif startup_error:
+        status = "failed"
+    else:
+        status = "starting"
+    body = {"status": status, "startup_seconds": startup_seconds}
+    if startup_error:
+        body["error"] = startup_error
+    return JSONResponse(body, status_code=200 if startup_ready else 503)
+
+
+# Values read at scrape time
+metrics_registry.register(
+    Gauge(
+        "knewbit_dub_jobs_in_flight",
+        "Dubbing jobs running or waiting in this worker.",
+        fn=lambda: len(dub_jobs),
+    )
+)
+metrics_registry.register(
+    Gauge(
+        "knewbit_dub_queue_depth",
+        "Dubbing jobs waiting for encode budget.",
+        fn=lambda: admission.queue_depth,
+    )
+)
+metrics_registry.register(
+    Gauge(
+        "knewbit_dub_encode_budget_in_use",
+        "Estimated encode seconds held by running jobs.",
+        fn=lambda: admission.in_use,
+    )
+)
+metrics_registry.register(
+    Gauge(
+        "knewbit_startup_ready_seconds",
+        "Seconds from process import to ready (0 until ready).",
+        fn=lambda: startup_seconds.get("ready", 0.0),
+    )
+)
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus metrics for this worker process."""
+    return PlainTextResponse(
+        metrics_registry.render(), media_type=METRICS_CONTENT_TYPE
+    )
+
+
+# The body is parsed by ingest_upload, so describe the form for Swagger here
+DUB_FORM_SCHEMA = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "properties": {
+                        "youtube_url": {"type": "string"},
+                        "file": {"type": "string", "format": "binary"},
+                        "target_language": {
+                            "type": "string",
+                            "description": "Comma-separated for several languages, e.g. Hindi,Tamil",
+                        },
+                        "lang_code": {
+                            "type": "string",
+                            "description": "Same order as target_language, e.g. hi-IN,ta-IN",
+                        },
+                        "delivery": {
+                            "type": "string",
+                            "enum": ["download", "progressive"],
+                            "default": "download",
+                        },
+                        "output": {
+                            "type": "string",
+                            "enum": list(DUB_OUTPUTS),
+                            "default": "dubbed",
+                        },
+                    },
+                    "required": ["target_language", "lang_code"],
+                }
+            }
+        },
+    }
+}
+
+
+@app.post("/dub", openapi_extra=DUB_FORM_SCHEMA)
 @limiter.limit("3/minute")  # Allow max 3 dubbing requests per minute per IP
-async def dub_video(
-    request: Request,
-    youtube_url: Optional[str] = Form(None),
-    file: Optional[UploadFile] = File(None),
-    target_language: str = Form(...),
-    lang_code: str = Form(...),
-):
+async def dub_video(request: Request):
     """
     Video dubbing endpoint that ensures MP4 output format.
 
@@ -157,95 +476,529 @@ async def dub_video(
     2. Input videos converted to H.264/MP4 format before processing
     3. FFmpeg output forced to use libx264 codec and MP4 container
     4. Added movflags +faststart for web optimization
+
+    Identical requests (same video and language) share one job: duplicates
+    arriving while it runs wait for the same result, and a finished result
+    is served directly for ``DUB_RESULT_TTL_SECONDS``.
+
+    New jobs pass cost-aware admission first (see ``admission.py``): too-long
+    videos get 413, clients over their hourly budget 429 and a full queue
+    503, the latter two with ``Retry-After``.
+
+    Uploads are streamed straight to disk and hashed on the way (see
+    ``ingest.py``); files over ``DUB_MAX_UPLOAD_MB`` get 413 and
+    non-video files 415 before the rest of the body is read.
+
+    With ``delivery=progressive`` the job runs in the background and the
+    response is 202 with a ``result_url`` (see ``dub_result``) that starts
+    playing while the output is still being muxed.
+
+    Several comma-separated languages produce one MP4 with an audio track
+    per language (the first is the default). The video is downloaded,
+    transcribed and encoded once; ``dub_result`` also serves each language
+    as its own MP4, copied from the shared one without re-encoding.
+
+    ``output=srt`` or ``output=vtt`` returns translated captions instead
+    (one language), and ``output=subtitled`` the original video with a soft
+    subtitle track per language; both stop after transcription (see
+    ``process_caption_job``).
     """
     temp_filename = None
-    output_path = None
+    input_path = None
     request_key = None
 
     try:
+        upload = await ingest_upload(
+            request, DUB_MAX_UPLOAD_BYTES, validate_container=DUB_VALIDATE_CONTAINER
+        )
+        temp_filename = upload.path
+        youtube_url = upload.fields.get("youtube_url") or None
+        target_language = upload.fields.get("target_language")
+        lang_code = upload.fields.get("lang_code")
+        progressive = upload.fields.get("delivery") == "progressive"
+        output = upload.fields.get("output") or "dubbed"
+
         # --- Input validation ---
-        if not youtube_url and not file:
+        if not youtube_url and not temp_filename:
             return JSONResponse(
                 status_code=400,
                 content={"error": "Either file or YouTube URL must be provided."},
             )
+        if not target_language or not lang_code:
+            return JSONResponse(
+                status_code=400,
+                content={"error": "target_language and lang_code are required."},
+            )
+        try:
+            targets = parse_dub_targets(target_language, lang_code)
+        except ValueError as e:
+            return JSONResponse(status_code=400, content={"error": str(e)})
+        languages = ",".join(language for language, _ in targets)
+        lang_codes = [code for _, code in targets]
+        if output not in DUB_OUTPUTS:
+            return JSONResponse(
+                status_code=400,
+                content={"error": f"output must be one of: {', '.join(DUB_OUTPUTS)}."},
+            )
+        if output in CAPTION_FORMATS and len(targets) > 1:
+            return JSONResponse(
+                status_code=400,
+                content={
+                    "error": f"output={output} takes one language; "
+                    "use output=subtitled for several."
+                },
+            )
 
         # --- Create request deduplication key ---
         if youtube_url:
-            request_key = f"youtube_{youtube_url}_{target_language}_{lang_code}"
+            request_key = f"youtube_{youtube_url}_{languages}_{','.join(lang_codes)}"
+        else:
+            # The upload was hashed while it streamed in
+            request_key = f"file_{upload.md5}_{languages}_{','.join(lang_codes)}"
+        if output != "dubbed":
+            request_key += f"_{output}"
+
+        # --- Serve a recent result or join an in-flight job ---
+        output_path = await asyncio.to_thread(
+            shared_state.get, f"dub:result:{request_key}"
+        )
+        record_cache("dub_result", bool(output_path and os.path.exists(output_path)))
+        if output_path and os.path.exists(output_path):
+            print(f"Serving recent result for duplicate request: {request_key}")
+            if progressive:
+                return await accept_progressive_dub(request_key, lang_codes, output)
         else:
-            # For uploaded files, we'll create key after reading file content
-            temp_filename = f"temp_{uuid.uuid4()}_{file.filename}"
-            with open(temp_filename, "wb") as f_out:
-                shutil.copyfileobj(file.file, f_out)
-
-            # Create hash of file content for deduplication
-            import hashlib
-
-            with open(temp_filename, "rb") as f:
-                file_hash = hashlib.md5(f.read()).hexdigest()
-            request_key = f"file_{file_hash}_{target_language}_{lang_code}"
-
-        # --- Check for duplicate requests ---
-        import time
-
-        with request_lock:
-            if request_key in active_requests:
-                print(f"Duplicate request detected: {request_key}")
-                return JSONResponse(
-                    status_code=429,
-                    content={"error": "Request already being processed. Please wait."},
+            if request_key in dub_jobs:
+                print(f"Duplicate request attached to in-flight job: {request_key}")
+            else:
+                print(f"Processing new request: {request_key}")
+            # join_dub_job takes ownership of the uploaded file
+            input_path, temp_filename = temp_filename, None
+            job = join_dub_job(
+                request_key,
+                input_path,
+                lambda input_path: coordinate_dub_job(
+                    get_remote_address(request),
+                    request_key,
+                    youtube_url,
+                    input_path,
+                    targets,
+                    output,
+                    upload.md5,
+                ),
+            )
+            if progressive:
+                task = asyncio.create_task(run_dub_in_background(request_key, job))
+                background_dub_tasks.add(task)
+                task.add_done_callback(background_dub_tasks.discard)
+                return await accept_progressive_dub(request_key, lang_codes, output)
+            output_path = await job
+
+        return dub_file_response(output_path)
+
+    except UploadRejected as e:
+        print(f"Rejected upload: {e.message}")
+        return JSONResponse(status_code=e.status_code, content={"error": e.message})
+
+    except AdmissionRejected as e:
+        print(f"Rejected request {request_key}: {e.message}")
+        headers = {"Retry-After": str(e.retry_after)} if e.retry_after else None
+        return JSONResponse(
+            status_code=e.status_code, content={"error": e.message}, headers=headers
+        )
+
+    except Exception as e:
+        print(f"Error processing request {request_key}: {str(e)}")
+        return JSONResponse(status_code=500, content={"error": str(e)})
+
+    finally:
+        # Clean up an upload that was not handed to a job (duplicates)
+        if temp_filename and os.path.exists(temp_filename):
+            try:
+                os.remove(temp_filename)
+                print(f"Cleaned up temp file: {temp_filename}")
+            except Exception as e:
+                print(f"Error cleaning up temp file: {e}")
+
+
+def parse_dub_targets(target_language: str, lang_code: str) -> List[Tuple[str, str]]:
+    """``(language, lang_code)`` pairs from the form's comma-separated lists."""
+    languages = [item.strip() for item in target_language.split(",") if item.strip()]
+    codes = [item.strip() for item in lang_code.split(",") if item.strip()]
+    if not codes or len(languages) != len(codes):
+        raise ValueError("target_language and lang_code must list the same number of languages.")
+    if len(set(codes)) != len(codes):
+        raise ValueError("lang_code lists a language twice.")
+    if len(codes) > DUB_MAX_LANGUAGES:
+        raise ValueError(f"At most {DUB_MAX_LANGUAGES} languages per request.")
+    return list(zip(languages, codes))
+
+
+def dub_job_id(request_key: str) -> str:
+    """URL-safe id under which a job's result is served."""
+    return hashlib.sha256(request_key.encode()).hexdigest()[:32]
+
+
+def dub_file_response(output_path: str) -> FileResponse:
+    """A finished output, with the media type and file name of what it is."""
+    name = os.path.basename(output_path)
+    if name.endswith(".srt"):
+        return FileResponse(output_path, media_type="application/x-subrip", filename="captions.srt")
+    if name.endswith(".vtt"):
+        return FileResponse(output_path, media_type="text/vtt", filename="captions.vtt")
+    filename = "subtitled_video.mp4" if name.startswith("subtitled_") else "dubbed_video.mp4"
+    return FileResponse(output_path, media_type="video/mp4", filename=filename)
+
+
+async def accept_progressive_dub(
+    request_key: str, lang_codes: List[str], output: str = "dubbed"
+) -> JSONResponse:
+    job_id = dub_job_id(request_key)
+    await asyncio.to_thread(
+        shared_state.set,
+        f"dub:job:{job_id}",
+        {
+            "request_key": request_key,
+            "lang_codes": lang_codes,
+            "output": output,
+            "created": time.time(),
+        },
+        ttl=DUB_CLAIM_TTL_SECONDS + DUB_RESULT_TTL_SECONDS,
+    )
+    return JSONResponse(
+        status_code=202,
+        content={"job_id": job_id, "result_url": f"/dub/result/{job_id}"},
+    )
+
+
+async def run_dub_in_background(request_key: str, job: Awaitable[str]) -> None:
+    """Run a progressive job; failures are kept for ``dub_result`` to report."""
+    await asyncio.to_thread(shared_state.delete, f"dub:error:{request_key}")
+    # The request's trace ends with the 202; continue it in a trace of our own
+    parent = current_span()
+    try:
+        with trace(
+            "dub.background",
+            traceparent=traceparent_of(parent),
+            sampled=parent is not None,
+        ):
+            await job
+    except AdmissionRejected as e:
+        print(f"Rejected request {request_key}: {e.message}")
+        error = {"status": e.status_code, "error": e.message, "retry_after": e.retry_after}
+    except Exception as e:
+        print(f"Error processing request {request_key}: {str(e)}")
+        error = {"status": 500, "error": str(e), "retry_after": 0}
+    else:
+        return
+    await asyncio.to_thread(
+        shared_state.set, f"dub:error:{request_key}", error, DUB_RESULT_TTL_SECONDS
+    )
+
+
+@app.get("/dub/result/{job_id}")
+async def dub_result(job_id: str, lang_code: Optional[str] = None):
+    """
+    Dubbed output of a ``delivery=progressive`` job.
+
+    Finished outputs are served as a file with HTTP Range support, so large
+    downloads can be resumed. While the job is still muxing a fragmented
+    MP4, the file is streamed as it grows so playback can start right away;
+    before that the request waits for the mux to begin.
+
+    For a multi-language job, ``lang_code`` selects one language: once the
+    job has finished, its video and that audio track are copied into an MP4
+    of their own (stream copy, made once and kept with the output).
+    """
+    job = await asyncio.to_thread(shared_state.get, f"dub:job:{job_id}")
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": "Unknown or expired job."})
+    request_key = job["request_key"]
+    lang_codes = job.get("lang_codes") or []
+    if lang_code and lang_code not in lang_codes:
+        return JSONResponse(
+            status_code=404, content={"error": f"This job has no {lang_code} track."}
+        )
+    if lang_code and job.get("output", "dubbed") != "dubbed":
+        return JSONResponse(
+            status_code=400,
+            content={"error": "lang_code selects a dubbed audio track; captions jobs have none."},
+        )
+    # A single-language output is served as it is
+    track = lang_codes.index(lang_code) if lang_code and len(lang_codes) > 1 else None
+
+    while True:
+        output_path = await asyncio.to_thread(
+            shared_state.get, f"dub:result:{request_key}"
+        )
+        if output_path and os.path.exists(output_path):
+            if track is None:
+                return dub_file_response(output_path)
+            try:
+                track_path = await get_dub_track(output_path, lang_code, track)
+            except Exception as e:
+                print(f"Error extracting {lang_code} track for {request_key}: {e}")
+                return JSONResponse(status_code=500, content={"error": str(e)})
+            return FileResponse(
+                track_path,
+                media_type="video/mp4",
+                filename=f"dubbed_video.{lang_code}.mp4",
+            )
+
+        error = await asyncio.to_thread(shared_state.get, f"dub:error:{request_key}")
+        if error:
+            headers = (
+                {"Retry-After": str(error["retry_after"])}
+                if error["retry_after"]
+                else None
+            )
+            return JSONResponse(
+                status_code=error["status"],
+                content={"error": error["error"]},
+                headers=headers,
+            )
+
+        partial_path = await asyncio.to_thread(
+            shared_state.get, f"dub:partial:{request_key}"
+        )
+        if track is None and partial_path and os.path.exists(partial_path):
+            return StreamingResponse(
+                tail_dub_output(request_key, partial_path),
+                media_type="video/mp4",
+                headers={"Accept-Ranges": "none"},
+            )
+
+        running = request_key in dub_jobs or await asyncio.to_thread(
+            shared_state.get, f"dub:active:{request_key}"
+        )
+        # The background task may not have claimed the job yet
+        if not running and time.time() - job["created"] > DUB_JOB_START_GRACE_SECONDS:
+            return JSONResponse(
+                status_code=404, content={"error": "Dubbing job is no longer running."}
+            )
+        await asyncio.sleep(DUB_POLL_SECONDS)
+
+
+async def get_dub_track(output_path: str, lang_code: str, track: int) -> str:
+    """Single-language copy of a finished multi-track output."""
+    track_path = dub_track_path(output_path, lang_code)
+    if not os.path.exists(track_path):
+        with track_stage("extract_track"):
+            await asyncio.to_thread(extract_audio_track, output_path, track, track_path)
+    return track_path
+
+
+async def tail_dub_output(request_key: str, path: str):
+    """Yield a growing output file until its job stops writing it."""
+    with open(path, "rb") as f:
+        while True:
+            chunk = await asyncio.to_thread(f.read, DUB_STREAM_CHUNK_BYTES)
+            if chunk:
+                yield chunk
+                continue
+            if await asyncio.to_thread(shared_state.get, f"dub:partial:{request_key}"):
+                await asyncio.sleep(DUB_TAIL_POLL_SECONDS)
+                continue
+            # The mux has exited; everything it wrote is on disk now
+            while chunk := await asyncio.to_thread(f.read, DUB_STREAM_CHUNK_BYTES):
+                yield chunk
+            return
+
+
+async def join_dub_job(
+    request_key: str,
+    input_path: Optional[str],
+    start: Callable[[Optional[str]], Awaitable[str]],
+) -> str:
+    """
+    Await this worker's in-flight job for the key, or start one with
+    ``start(input_path)``. The check and the start happen without yielding to
+    the loop, so only the request that starts the job hands it its upload;
+    a duplicate's copy is removed when it joins.
+    """
+    if request_key in dub_jobs:
+        if input_path and os.path.exists(input_path):
+            os.remove(input_path)
+            print(f"Cleaned up temp file: {input_path}")
+        input_path = None
+    return await dub_jobs.do(request_key, lambda: start(input_path))
+
+
+async def coordinate_dub_job(
+    client_id: str,
+    request_key: str,
+    youtube_url: Optional[str],
+    temp_filename: Optional[str],
+    targets: List[Tuple[str, str]],
+    output: str = "dubbed",
+    video_hash: Optional[str] = None,
+) -> str:
+    """
+    Run the job in this worker if it wins the host-wide claim for the key;
+    otherwise wait for the worker holding the claim to publish its result.
+    """
+    claim_key = f"dub:active:{request_key}"
+    try:
+        while True:
+            claimed = await asyncio.to_thread(
+                shared_state.add,
+                claim_key,
+                {"pid": os.getpid(), "started": time.time()},
+                DUB_CLAIM_TTL_SECONDS,
+            )
+            if claimed:
+                try:
+                    # The job takes ownership of the uploaded file
+                    job_input, temp_filename = temp_filename, None
+                    return await run_dub_job(
+                        client_id,
+                        request_key,
+                        youtube_url,
+                        job_input,
+                        targets,
+                        output,
+                        video_hash,
+                    )
+                finally:
+                    await asyncio.to_thread(shared_state.delete, claim_key)
+                    print(f"Removed request from active list: {request_key}")
+
+            print(f"Request is being processed by another worker: {request_key}")
+            while await asyncio.to_thread(shared_state.get, claim_key) is not None:
+                await asyncio.sleep(DUB_POLL_SECONDS)
+            output_path = await asyncio.to_thread(
+                shared_state.get, f"dub:result:{request_key}"
+            )
+            if output_path and os.path.exists(output_path):
+                return output_path
+            # The other worker failed; try to take the job over
+    finally:
+        if temp_filename and os.path.exists(temp_filename):
+            os.remove(temp_filename)
+
+
+async def run_dub_job(
+    client_id: str,
+    request_key: str,
+    youtube_url: Optional[str],
+    temp_filename: Optional[str],
+    targets: List[Tuple[str, str]],
+    output: str = "dubbed",
+    video_hash: Optional[str] = None,
+) -> str:
+    """
+    Admit a dubbing job against the cost budgets, then process it: probe the
+    video's length, charge it to the client's hourly budget and wait for room
+    in this worker's encode budget (captions jobs need none).
+    """
+    captions = output != "dubbed"
+    try:
+        with track_stage("probe"):
+            if temp_filename:
+                cost = await asyncio.to_thread(
+                    probe_file, temp_filename, len(targets), captions
                 )
-            active_requests[request_key] = time.time()
+            else:
+                cost = await asyncio.to_thread(
+                    probe_youtube, youtube_url, len(targets), captions
+                )
+        await asyncio.to_thread(admission.charge_client, client_id, cost)
+
+        try:
+            async with admission.slot(cost):
+                print(f"Admitted dubbing job {request_key}: {cost}")
+                job_input, temp_filename = temp_filename, None
+                if captions:
+                    return await process_caption_job(
+                        request_key, youtube_url, job_input, targets, output, video_hash
+                    )
+                return await process_dub_job(
+                    request_key, youtube_url, job_input, targets, video_hash
+                )
+        except BaseException:
+            await asyncio.to_thread(admission.refund_client, client_id, cost)
+            raise
+    finally:
+        # Inputs of jobs rejected before processing started
+        if temp_filename and os.path.exists(temp_filename):
+            os.remove(temp_filename)
 
-        print(f"Processing new request: {request_key}")
 
+async def process_dub_job(
+    request_key: str,
+    youtube_url: Optional[str],
+    temp_filename: Optional[str],
+    targets: List[Tuple[str, str]],
+    video_hash: Optional[str] = None,
+) -> str:
+    """
+    Process one dubbing job end to end and return the path of the dubbed MP4.
+
+    ``targets`` are ``(language, lang_code)`` pairs, one audio track each.
+    The transcription carries the first language's translation; the others
+    are translated from its original text, alongside TTS for the first.
+    ``video_hash`` is the upload's MD5, reused as the transcript cache key.
+    """
+    output_path = None
+
+    try:
         # --- Download from YouTube using yt-dlp CLI (if not already done) ---
         if youtube_url and not temp_filename:
-            video_id = str(uuid.uuid4())
-            temp_filename = f"temp_{video_id}.mp4"
-            command = [
-                "yt-dlp",
-                "-f",
-                "bv*[ext=mp4]+ba[ext=m4a]/bv*+ba/best[ext=mp4]/best",
-                "--merge-output-format",
-                "mp4",
-                "--recode-video",
-                "mp4",
-                "-o",
-                temp_filename,
-                youtube_url,
-            ]
-            result = subprocess.run(
-                command, stdout=subprocess.PIPE, stderr=subprocess.PIPE
-            )
-            if result.returncode != 0:
-                raise RuntimeError(f"yt-dlp failed: {result.stderr.decode()}")
+            temp_filename = await download_youtube_video(youtube_url)
 
         # --- Ensure MP4 format ---
-        temp_filename = await ensure_mp4_format(temp_filename)
+        with track_stage("convert"):
+            temp_filename = await ensure_mp4_format(temp_filename)
 
         # --- Transcribe and generate dubbing ---
         request_id = f"dub-api-{uuid.uuid4()}"
-        result_string = await transcribe_video(
+        (first_language, first_code), other_targets = targets[0], targets[1:]
+        segments = transcribe_video_segments(
             file_path=temp_filename,
             request_id=request_id,
             model_name=MODEL_NAME,
             video_cache=video_cache,
-            target_language=target_language,
+            target_language=first_language,
+            video_hash=video_hash,
         )
-
-        transcript_data = clean_json_output(result_string)
-        segments = transcript_data.get("segments", [])
-        if not segments:
-            raise ValueError("No segments found in transcript.")
-
-        output_path = f"dubbed_output_{uuid.uuid4()}.mp4"
-        await create_dubbed_video_fast(temp_filename, segments, lang_code, output_path)
+        async with aclosing(segments):
+            # Wait for the first segment so upload and transcription failures
+            # surface before ffmpeg starts
+            first = await anext(segments, None)
+            if first is None:
+                raise ValueError("No segments found in transcript.")
+
+            output_path = f"dubbed_output_{uuid.uuid4()}.mp4"
+            partial_key = f"dub:partial:{request_key}"
+            if DUB_PROGRESSIVE_OUTPUT:
+                await asyncio.to_thread(
+                    shared_state.set, partial_key, output_path, DUB_CLAIM_TTL_SECONDS
+                )
+            try:
+                # Segments flow from the transcription stream through
+                # translation and TTS into the mux in time order, every
+                # language side by side
+                async with fan_out(
+                    prepend_segment(first, segments), len(targets)
+                ) as copies:
+                    tracks = [DubTrack(copies[0], first_code, first_language)]
+                    for copy, (language, code) in zip(copies[1:], other_targets):
+                        translated = translate_segment_stream(copy, language, MODEL_NAME)
+                        tracks.append(DubTrack(translated, code, language))
+                    await dub_video_incremental(
+                        temp_filename,
+                        tracks,
+                        output_path,
+                        fragmented=DUB_PROGRESSIVE_OUTPUT,
+                        tts_concurrency=DUB_TTS_CONCURRENCY,
+                        tts_batch_size=DUB_TTS_BATCH_SIZE,
+                    )
+            finally:
+                await asyncio.to_thread(shared_state.delete, partial_key)
 
         # --- Validate output format ---
         try:
-            probe = ffmpeg.probe(output_path)
+            probe = await asyncio.to_thread(ffmpeg.probe, output_path)
             video_stream = next(
                 (s for s in probe["streams"] if s["codec_type"] == "video"), None
             )
@@ -255,20 +1008,23 @@ async def dub_video(
         except Exception as e:
             print(f"Warning: Could not verify output format: {e}")
 
-        print(f"Successfully processed request: {request_key}")
-        return FileResponse(
-            output_path, media_type="video/mp4", filename="dubbed_video.mp4"
+        await asyncio.to_thread(
+            shared_state.set,
+            f"dub:result:{request_key}",
+            output_path,
+            DUB_RESULT_TTL_SECONDS,
         )
+        print(f"Successfully processed request: {request_key}")
+        return output_path
 
-    except Exception as e:
-        print(f"Error processing request {request_key}: {str(e)}")
+    except Exception:
         # Clean up output file if it was created
         if output_path and os.path.exists(output_path):
             try:
                 os.remove(output_path)
             except:
                 pass
-        return JSONResponse(status_code=500, content={"error": str(e)})
+        raise
 
     finally:
         # Clean up temporary files
@@ -279,11 +1035,138 @@ async def dub_video(
             except Exception as e:
                 print(f"Error cleaning up temp file: {e}")
 
-        # Remove request from active requests
-        if request_key:
-            with request_lock:
-                active_requests.pop(request_key, None)
-                print(f"Removed request from active list: {request_key}")
+
+async def download_youtube_video(youtube_url: str) -> str:
+    """Download a YouTube video as MP4 with the yt-dlp CLI; returns its path."""
+    video_id = str(uuid.uuid4())
+    temp_filename = f"temp_{video_id}.mp4"
+    command = [
+        "yt-dlp",
+        "-f",
+        "bv*[ext=mp4]+ba[ext=m4a]/bv*+ba/best[ext=mp4]/best",
+        "--merge-output-format",
+        "mp4",
+        "--recode-video",
+        "mp4",
+        "-o",
+        temp_filename,
+        youtube_url,
+    ]
+    with track_stage("download"), track_upstream("youtube") as call:
+        result = await asyncio.to_thread(
+            subprocess.run,
+            command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        call.ok = result.returncode == 0
+    if result.returncode != 0:
+        if os.path.exists(temp_filename):
+            os.remove(temp_filename)
+        raise RuntimeError(f"yt-dlp failed: {result.stderr.decode()}")
+    return temp_filename
+
+
+async def process_caption_job(
+    request_key: str,
+    youtube_url: Optional[str],
+    temp_filename: Optional[str],
+    targets: List[Tuple[str, str]],
+    output: str,
+    video_hash: Optional[str] = None,
+) -> str:
+    """
+    Captions fast path: stop after transcription and return the path of an
+    SRT or WebVTT file (``output`` ``srt``/``vtt``, one language) or of the
+    input video with a soft subtitle track per language (``subtitled``).
+
+    Nothing is synthesized or encoded: cues come straight from the transcript
+    segments, further languages are translated as for a multi-language dub,
+    and the subtitled MP4 is a stream copy. The input is not converted to
+    H.264 first either, since nothing decodes it.
+    """
+    output_path = None
+    subtitle_paths = []
+
+    async def collect(segments: AsyncIterator[dict]) -> List[dict]:
+        return [segment async for segment in segments]
+
+    try:
+        if youtube_url and not temp_filename:
+            temp_filename = await download_youtube_video(youtube_url)
+
+        request_id = f"dub-api-{uuid.uuid4()}"
+        (first_language, _), other_targets = targets[0], targets[1:]
+        segments = transcribe_video_segments(
+            file_path=temp_filename,
+            request_id=request_id,
+            model_name=MODEL_NAME,
+            video_cache=video_cache,
+            target_language=first_language,
+            video_hash=video_hash,
+        )
+        async with aclosing(segments), fan_out(segments, len(targets)) as copies:
+            streams = [copies[0]] + [
+                translate_segment_stream(copy, language, MODEL_NAME)
+                for copy, (language, _) in zip(copies[1:], other_targets)
+            ]
+            tasks = [asyncio.create_task(collect(stream)) for stream in streams]
+            try:
+                tracks = await asyncio.gather(*tasks)
+            finally:
+                # Stop the other languages if one failed
+                for task in tasks:
+                    task.cancel()
+        if not tracks[0]:
+            raise ValueError("No segments found in transcript.")
+
+        with track_stage("captions"):
+            if output in CAPTION_FORMATS:
+                output_path = f"captions_{uuid.uuid4()}.{output}"
+                with open(output_path, "w", encoding="utf-8") as f:
+                    f.write(format_captions(tracks[0], output))
+            else:
+                for segments, (language, code) in zip(tracks, targets):
+                    path = f"subtitles_{uuid.uuid4()}.srt"
+                    subtitle_paths.append(path)
+                    with open(path, "w", encoding="utf-8") as f:
+                        f.write(format_captions(segments, "srt"))
+                output_path = f"subtitled_output_{uuid.uuid4()}.mp4"
+                await asyncio.to_thread(
+                    mux_soft_subtitles,
+                    temp_filename,
+                    [
+                        (path, code, language)
+                        for path, (language, code) in zip(subtitle_paths, targets)
+                    ],
+                    output_path,
+                )
+
+        await asyncio.to_thread(
+            shared_state.set,
+            f"dub:result:{request_key}",
+            output_path,
+            DUB_RESULT_TTL_SECONDS,
+        )
+        print(f"Successfully processed request: {request_key}")
+        return output_path
+
+    except Exception:
+        if output_path and os.path.exists(output_path):
+            os.remove(output_path)
+        raise
+
+    finally:
+        for path in [temp_filename, *subtitle_paths]:
+            if path and os.path.exists(path):
+                os.remove(path)
+                print(f"Cleaned up temp file: {path}")
+
+
+async def prepend_segment(first: dict, rest: AsyncIterator[dict]):
+    yield first
+    async for segment in rest:
+        yield segment
 
 
 async def ensure_mp4_format(input_path):
@@ -293,7 +1176,7 @@ async def ensure_mp4_format(input_path):
     """
     try:
         # Check if the file is already in proper MP4 format
-        probe = ffmpeg.probe(input_path)
+        probe = await asyncio.to_thread(ffmpeg.probe, input_path)
         video_stream = next(
             (s for s in probe["streams"] if s["codec_type"] == "video"), None
         )
@@ -335,10 +1218,19 @@ async def ensure_mp4_format(input_path):
             output_path,
         ]
 
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        # A full re-encode; run it without blocking the event loop
+        process = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        _, stderr = await process.communicate()
 
-        if result.returncode != 0:
-            print(f"MP4 conversion error: {result.stderr}")
+        if process.returncode != 0:
+            print(f"MP4 conversion error: {stderr.decode(errors='replace')[-2000:]}")
+            if os.path.exists(output_path):
+                os.remove(output_path)
             # If conversion fails, return original file
             return input_path
 
@@ -355,303 +1247,6 @@ async def ensure_mp4_format(input_path):
         return input_path
 
 
-async def create_dubbed_video_fast(video_path, segments, lang_code, output_path):
-    """Super fast method: Parallel TTS generation + single FFmpeg command"""
-
-    # Step 1: Generate all TTS files in parallel
-    temp_audio_files = []
-
-    async def generate_single_tts(segment, idx):
-        tts_path = f"tts_{uuid.uuid4()}.wav"
-        translated_text = segment["translated_text"]
-
-        # Run TTS generation in thread pool to avoid blocking
-        loop = asyncio.get_event_loop()
-        with ThreadPoolExecutor() as executor:
-            await loop.run_in_executor(
-                executor, generate_tts_audio, translated_text, lang_code, tts_path
-            )
-
-        return (tts_path, segment, idx)
-
-    # Generate all TTS files concurrently
-    tts_tasks = [
-        generate_single_tts(segment, idx) for idx, segment in enumerate(segments)
-    ]
-    tts_results = await asyncio.gather(*tts_tasks)
-
-    try:
-        # Step 2: Build single FFmpeg command with all inputs and filters
-        build_and_run_ffmpeg_command(video_path, tts_results, output_path)
-
-    finally:
-        # Cleanup TTS files
-        for tts_path, _, _ in tts_results:
-            if os.path.exists(tts_path):
-                os.remove(tts_path)
-
-
-def build_and_run_ffmpeg_command(video_path, tts_results, output_path):
-    """Build and execute single optimized FFmpeg command"""
-
-    # Get video duration for reference
-    probe = ffmpeg.probe(video_path)
-    video_duration = float(probe["streams"][0]["duration"])
-
-    # Sort by start time to ensure proper ordering
-    tts_results = sorted(tts_results, key=lambda x: float(x[1]["start"]))
-
-    # Build FFmpeg command
-    cmd = ["ffmpeg", "-y"]
-
-    # Add video input
-    cmd.extend(["-i", video_path])
-
-    # Add all audio inputs
-    for tts_path, _, _ in tts_results:
-        cmd.extend(["-i", tts_path])
-
-    # Build filter complex for audio processing
-    filter_parts = []
-
-    # Process each audio segment with timing
-    for idx, (tts_path, segment, _) in enumerate(tts_results):
-        start_ms = int(float(segment["start"]) * 1000)
-        input_idx = idx + 1  # +1 because video is input 0
-
-        # Delay audio to start time
-        filter_parts.append(
-            f"[{input_idx}:a]adelay={start_ms}|{start_ms}[delayed{idx}]"
-        )
-
-    # Mix all delayed audio segments
-    if len(tts_results) == 1:
-        final_audio = "[delayed0]"
-    else:
-        # Create mix inputs string
-        mix_inputs = "".join([f"[delayed{i}]" for i in range(len(tts_results))])
-        filter_parts.append(
-            f"{mix_inputs}amix=inputs={len(tts_results)}:duration=longest:dropout_transition=2[mixed_audio]"
-        )
-        final_audio = "[mixed_audio]"
-
-    # Join all filter parts
-    filter_complex = ";".join(filter_parts)
-
-    # Add filter complex to command
-    cmd.extend(["-filter_complex", filter_complex])
-
-    # Map video and final audio
-    cmd.extend(["-map", "0:v"])  # Original video
-    cmd.extend(["-map", final_audio])  # Mixed audio
-
-    # Output settings for MP4 format
-    cmd.extend(
-        [
-            "-c:v",
-            "libx264",  # Force H.264 codec for MP4 compatibility
-            "-preset",
-            "fast",  # Fast encoding preset
-            "-crf",
-            "23",  # Good quality setting
-            "-c:a",
-            "aac",  # Audio codec
-            "-b:a",
-            "128k",  # Audio bitrate
-            "-ac",
-            "2",  # Stereo output
-            "-f",
-            "mp4",  # Force MP4 container format
-            "-movflags",
-            "+faststart",  # Enable fast start for web playback
-            "-shortest",  # Match shortest stream
-            output_path,
-        ]
-    )
-
-    # Run the command
-    print(f"Running FFmpeg command: {' '.join(cmd[:10])}...")  # Debug (first 10 args)
-    result = subprocess.run(cmd, capture_output=True, text=True)
-
-    if result.returncode != 0:
-        print(f"FFmpeg error: {result.stderr}")
-        raise Exception(f"FFmpeg failed: {result.stderr}")
-
-
-# Alternative ultra-fast method if the above still has issues
-async def create_dubbed_video_ultra_fast(video_path, segments, lang_code, output_path):
-    """Ultra fast method: Direct audio stream replacement"""
-
-    temp_audio_files = []
-
-    # Generate TTS files in parallel (same as above)
-    async def generate_single_tts(segment, idx):
-        tts_path = f"tts_{uuid.uuid4()}.wav"
-        translated_text = segment["translated_text"]
-
-        loop = asyncio.get_event_loop()
-        with ThreadPoolExecutor() as executor:
-            await loop.run_in_executor(
-                executor, generate_tts_audio, translated_text, lang_code, tts_path
-            )
-
-        return (tts_path, segment)
-
-    tts_tasks = [
-        generate_single_tts(segment, idx) for idx, segment in enumerate(segments)
-    ]
-    tts_results = await asyncio.gather(*tts_tasks)
-
-    try:
-        # Create audio timeline using direct file operations (fastest)
-        create_audio_timeline_direct(video_path, tts_results, output_path)
-
-    finally:
-        for tts_path, _ in tts_results:
-            if os.path.exists(tts_path):
-                os.remove(tts_path)
-
-
-def create_audio_timeline_direct(video_path, tts_results, output_path):
-    """Direct audio timeline creation - fastest method"""
-
-    # Get video info
-    probe = ffmpeg.probe(video_path)
-    duration = float(probe["streams"][0]["duration"])
-    sample_rate = 44100
-
-    # Sort segments by start time
-    sorted_segments = sorted(tts_results, key=lambda x: float(x[1]["start"]))
-
-    # Create temporary file list for concatenation
-    file_list = f"filelist_{uuid.uuid4()}.txt"
-    temp_files = []
-
-    try:
-        current_time = 0.0
-
-        with open(file_list, "w") as f:
-            for tts_path, segment in sorted_segments:
-                start_time = float(segment["start"])
-
-                # Add silence before segment if needed
-                if start_time > current_time:
-                    silence_duration = start_time - current_time
-                    silence_file = f"silence_{uuid.uuid4()}.wav"
-
-                    # Create silence quickly
-                    subprocess.run(
-                        [
-                            "ffmpeg",
-                            "-y",
-                            "-f",
-                            "lavfi",
-                            "-i",
-                            f"anullsrc=channel_layout=stereo:sample_rate={sample_rate}",
-                            "-t",
-                            str(silence_duration),
-                            "-c:a",
-                            "pcm_s16le",
-                            silence_file,
-                        ],
-                        capture_output=True,
-                        check=True,
-                    )
-
-                    f.write(f"file '{silence_file}'\n")
-                    temp_files.append(silence_file)
-
-                # Add the TTS audio
-                f.write(f"file '{tts_path}'\n")
-
-                # Update current time
-                audio_probe = ffmpeg.probe(tts_path)
-                audio_duration = float(audio_probe["streams"][0]["duration"])
-                current_time = start_time + audio_duration
-
-            # Add final silence to match video duration
-            if current_time < duration:
-                final_silence = f"final_silence_{uuid.uuid4()}.wav"
-                subprocess.run(
-                    [
-                        "ffmpeg",
-                        "-y",
-                        "-f",
-                        "lavfi",
-                        "-i",
-                        f"anullsrc=channel_layout=stereo:sample_rate={sample_rate}",
-                        "-t",
-                        str(duration - current_time),
-                        "-c:a",
-                        "pcm_s16le",
-                        final_silence,
-                    ],
-                    capture_output=True,
-                    check=True,
-                )
-
-                f.write(f"file '{final_silence}'\n")
-                temp_files.append(final_silence)
-
-        # Concatenate audio files
-        combined_audio = f"combined_audio_{uuid.uuid4()}.wav"
-        subprocess.run(
-            [
-                "ffmpeg",
-                "-y",
-                "-f",
-                "concat",
-                "-safe",
-                "0",
-                "-i",
-                file_list,
-                "-c:a",
-                "pcm_s16le",
-                combined_audio,
-            ],
-            capture_output=True,
-            check=True,
-        )
-
-        # Combine with video (final step) - ensure MP4 output
-        subprocess.run(
-            [
-                "ffmpeg",
-                "-y",
-                "-i",
-                video_path,
-                "-i",
-                combined_audio,
-                "-c:v",
-                "libx264",  # Force H.264 codec for MP4
-                "-preset",
-                "fast",  # Fast encoding
-                "-crf",
-                "23",  # Good quality
-                "-c:a",
-                "aac",
-                "-f",
-                "mp4",  # Force MP4 container
-                "-movflags",
-                "+faststart",  # Web-optimized
-                "-shortest",
-                output_path,
-            ],
-            capture_output=True,
-            check=True,
-        )
-
-        # Cleanup
-        if os.path.exists(combined_audio):
-            os.remove(combined_audio)
-
-    finally:
-        # Clean up temp files
-        for temp_file in temp_files + [file_list]:
-            if os.path.exists(temp_file):
-                os.remove(temp_file)
-
-
 # --- Types ---
 class CleanedCourse(TypedDict):
     id: str
@@ -672,11 +1267,13 @@ class AgentState(TypedDict):
     user_question: str
     enrolled_courses: Optional[List[CleanedCourse]]
     all_courses: Optional[List[CleanedCourse]]
+    catalog_version: Optional[str]
     matched_courses: Optional[List[dict]]
 
 
 class QueryRequest(BaseModel):
-    user_question: str
+    # Empty asks for "what next", served from the nightly batch when possible
+    user_question: str = ""
 
 
 class ChatMessage(BaseModel):
@@ -687,7 +1284,11 @@ class ChatMessage(BaseModel):
 class TutorChatRequest(BaseModel):
     user_message: str
     course_id: str
-    chat_history: List[ChatMessage]
+    # Clients holding a session_id only send the new message; chat_history
+    # seeds a new session for clients that still keep the conversation
+    session_id: Optional[str] = None
+    chat_history: List[ChatMessage] = []
+    stream: bool = False  # Stream tokens over SSE instead of one JSON reply
 
 
 # --- Clean course data ---
@@ -712,23 +1313,113 @@ def clean_course_data(courses: List[dict]) -> List[CleanedCourse]:
 
 
 # --- Step 1: Get enrolled courses ---
-def fetch_enrolled(state: AgentState) -> AgentState:
-    response = requests.get(
-        f"{ENROLLED_COURSES_API}",
-        headers={"Authorization": f"Bearer {state['knewbit_jwt']}"},
-    )
+def load_enrolled(token: str) -> Tuple[Optional[str], List[dict]]:
+    """
+    The enrolled courses for ``token`` and the user id it authenticates as,
+    which is None when the Knewbit API rejected it. Cached per user for
+    tokens verified with ``KNEWBIT_JWT_SECRET``, otherwise per token, so an
+    unverified ``sub`` claim never selects someone else's entry.
+    """
+    key = enrolled_cache_key(token)
+    cached = shared_state.get(key)
+    record_cache("enrolled", cached is not None)
+    if cached is not None:
+        return cached["user_id"], cached["courses"]
+
+    with track_upstream("knewbit") as call:
+        response = requests.get(
+            f"{ENROLLED_COURSES_API}",
+            headers={"Authorization": f"Bearer {token}"},
+        )
+        call.ok = response.status_code < 500
+    if response.status_code != 200:
+        # Error bodies are not course lists
+        return None, []
     enrolled = clean_course_data(response.json())
+
+    # The API accepted the token, so its claims are genuine
+    claims = jwt_claims(token)
+    user_id = claims.get("sub")
+    ttl = ENROLLED_CACHE_TTL_SECONDS
+    if isinstance(claims.get("exp"), (int, float)):
+        ttl = min(ttl, claims["exp"] - time.time())
+    if ttl > 0:
+        shared_state.set(key, {"user_id": user_id, "courses": enrolled}, ttl=ttl)
+        if user_id and key != f"enrolled:user:{user_id}":
+            # Lets the enrollment webhook find per-token entries for the user
+            shared_state.append(
+                f"enrolled:tokens:{user_id}", key, ttl=ENROLLED_CACHE_TTL_SECONDS
+            )
+    return user_id, enrolled
+
+
+def fetch_enrolled(state: AgentState) -> AgentState:
+    _, enrolled = load_enrolled(state["knewbit_jwt"])
     return {**state, "enrolled_courses": enrolled}
 
 
 # --- Step 2: Get all platform courses ---
 def fetch_all_courses(state: AgentState) -> AgentState:
-    response = requests.get(ALL_COURSES_API)
-    all_courses = clean_course_data(response.json())
-    return {**state, "all_courses": all_courses}
+    # The catalog changes rarely, so reuse a short-lived snapshot across requests
+    snapshot = catalog_cache.get("catalog")
+    record_cache("catalog", snapshot is not None)
+    if snapshot is None:
+        with track_upstream("knewbit") as call:
+            response = requests.get(ALL_COURSES_API)
+            call.ok = response.status_code < 500
+        all_courses = clean_course_data(response.json())
+        snapshot = (all_courses, catalog_fingerprint(all_courses))
+        catalog_cache.set("catalog", snapshot)
+    all_courses, catalog_version = snapshot
+    return {**state, "all_courses": all_courses, "catalog_version": catalog_version}
+
+
+# --- Step 2b: Reuse a cached answer for the same (or a paraphrased) question ---
+def lookup_cached_recommendations(state: AgentState) -> AgentState:
+    cached = recommendation_cache.get(
+        enrollment_fingerprint(state["enrolled_courses"]),
+        state["user_question"],
+        state["catalog_version"],
+    )
+    record_cache("recommendation", cached is not None)
+    if cached is not None:
+        print("Recommendation cache hit")
+    return {**state, "matched_courses": cached}
+
+
+def route_after_cache_lookup(state: AgentState) -> str:
+    from langgraph.graph import END
+
+    return END if state.get("matched_courses") is not None else "gemini_match"
 
 
 # --- Step 3: Gemini selects best matches ---
+# Per-attempt timeout is GEMINI_TIMEOUT_SECONDS (see video_process.py); retries,
+# hedging and the circuit breaker come from the policies (see resilience.py)
+recommend_gemini = UpstreamPolicy("gemini", GEMINI_TIMEOUT_SECONDS, hedge=True)
+
+# Structured output: a bare JSON list of picks, no fences or prose to strip
+# (a plain dict, so google.genai.types is not imported at startup)
+RECOMMENDATION_CONFIG = {
+    "response_mime_type": "application/json",
+    "response_schema": {
+        "type": "array",
+        "items": {
+            "type": "object",
+            "properties": {
+                "id": {"type": "string"},
+                "title": {"type": "string"},
+                "slug": {"type": "string"},
+                "reason": {"type": "string"},
+            },
+            "required": ["id", "title", "slug", "reason"],
+        },
+    },
+    # Milliseconds; blocking calls can only be timed out by the client
+    "http_options": {"timeout": int(GEMINI_TIMEOUT_SECONDS * 1000)},
+}
+
+
 def gemini_match_courses(state: AgentState) -> AgentState:
     user_question = state["user_question"]
     enrolled_courses = state["enrolled_courses"]
@@ -767,20 +1458,79 @@ Instructions:
 4. Ensure to return only the JSON list without any additional text or explanation.
 """
 
-    result = client.models.generate_content(model="gemini-2.5-flash", contents=prompt)
+    result = recommend_gemini.call(
+        lambda: get_gemini_client().models.generate_content(
+            model="gemini-2.5-flash", contents=prompt, config=RECOMMENDATION_CONFIG
+        )
+    )
 
     try:
         content = result.text.strip()
         print("Gemini output:", content)
-        matched = safe_parse_json(content)
+        # Schema-constrained output parses directly; repair is only a fallback
+        matched = result.parsed if isinstance(result.parsed, list) else safe_parse_json(content)
     except Exception as e:
         print("Gemini output parsing failed:", e)
         matched = []
 
+    if matched:
+        recommendation_cache.set(
+            enrollment_fingerprint(enrolled_courses),
+            user_question,
+            state["catalog_version"],
+            matched,
+        )
+
     return {**state, "matched_courses": matched}
 
 
 # --- Utilities ---
+def _b64url_decode(part: str) -> bytes:
+    return base64.urlsafe_b64decode(part + "=" * (-len(part) % 4))
+
+
+def jwt_claims(token: str) -> dict:
+    """The claims of a JWT without checking its signature; {} if unreadable."""
+    try:
+        claims = json.loads(_b64url_decode(token.split(".")[1]))
+    except (IndexError, ValueError):
+        return {}
+    return claims if isinstance(claims, dict) else {}
+
+
+def verified_jwt_claims(token: str) -> Optional[dict]:
+    """
+    The claims of an unexpired HS256 JWT signed with ``KNEWBIT_JWT_SECRET``,
+    or None if there is no secret or the token does not verify.
+    """
+    if not KNEWBIT_JWT_SECRET:
+        return None
+    try:
+        header, payload, signature = token.split(".")
+        if json.loads(_b64url_decode(header)).get("alg") != "HS256":
+            return None
+        expected = hmac.new(
+            KNEWBIT_JWT_SECRET.encode(), f"{header}.{payload}".encode(), hashlib.sha256
+        ).digest()
+        if not hmac.compare_digest(expected, _b64url_decode(signature)):
+            return None
+    except (ValueError, AttributeError):
+        return None
+    claims = jwt_claims(token)
+    exp = claims.get("exp")
+    if not isinstance(exp, (int, float)) or exp <= time.time():
+        return None
+    return claims
+
+
+def enrolled_cache_key(token: str) -> str:
+    claims = verified_jwt_claims(token)
+    if claims and claims.get("sub"):
+        # Verified, so refreshed tokens for the same user share the entry
+        return f"enrolled:user:{claims['sub']}"
+    return f"enrolled:token:{hashlib.sha256(token.encode()).hexdigest()}"
+
+
 def safe_parse_json(response_text: str) -> dict:
     """Attempts to safely parse an AI-generated JSON string."""
     response_text = response_text.strip()
@@ -810,18 +1560,50 @@ def safe_parse_json(response_text: str) -> dict:
 
 
 # --- LangGraph Workflow ---
-graph = StateGraph(AgentState)
+# Compiled on first use or by the startup warm-up; importing LangGraph is slow
+recommendation_graph = None
+recommendation_graph_lock = threading.Lock()
+
+
+def build_recommendation_graph():
+    from langchain_core.runnables import RunnableLambda
+    from langgraph.graph import END, StateGraph
+
+    graph = StateGraph(AgentState)
+
+    graph.add_node(
+        "fetch_enrolled",
+        RunnableLambda(timed("recommend_fetch_enrolled")(fetch_enrolled)),
+    )
+    graph.add_node(
+        "fetch_all_courses",
+        RunnableLambda(timed("recommend_fetch_all_courses")(fetch_all_courses)),
+    )
+    graph.add_node(
+        "cache_lookup",
+        RunnableLambda(timed("recommend_cache_lookup")(lookup_cached_recommendations)),
+    )
+    graph.add_node(
+        "gemini_match",
+        RunnableLambda(timed("recommend_gemini_match")(gemini_match_courses)),
+    )
 
-graph.add_node("fetch_enrolled", RunnableLambda(fetch_enrolled))
-graph.add_node("fetch_all_courses", RunnableLambda(fetch_all_courses))
-graph.add_node("gemini_match", RunnableLambda(gemini_match_courses))
+    graph.set_entry_point("fetch_enrolled")
+    graph.add_edge("fetch_enrolled", "fetch_all_courses")
+    graph.add_edge("fetch_all_courses", "cache_lookup")
+    graph.add_conditional_edges("cache_lookup", route_after_cache_lookup)
+    graph.add_edge("gemini_match", END)
 
-graph.set_entry_point("fetch_enrolled")
-graph.add_edge("fetch_enrolled", "fetch_all_courses")
-graph.add_edge("fetch_all_courses", "gemini_match")
-graph.add_edge("gemini_match", END)
+    return graph.compile()
 
-compiled = graph.compile()
+
+def get_recommendation_graph():
+    global recommendation_graph
+    if recommendation_graph is None:
+        with recommendation_graph_lock:
+            if recommendation_graph is None:
+                recommendation_graph = build_recommendation_graph()
+    return recommendation_graph
 
 
 # --- AI Tutor Endpoint ---
@@ -837,6 +1619,10 @@ async def ai_tutor_chat(request: Request, chat_request: TutorChatRequest):
     - Adapts to learner needs
     - Stimulates curiosity with follow-up questions
     - Encourages metacognition
+
+    Set ``stream`` in the body (or send ``Accept: text/event-stream``) to get the
+    reply as Server-Sent Events: ``data: {"delta": ...}`` per chunk, then a
+    final ``event: done`` carrying the full response.
     """
     try:
         # Get course details (you'll need to implement this function)
@@ -845,76 +1631,134 @@ async def ai_tutor_chat(request: Request, chat_request: TutorChatRequest):
         if not course_details:
             raise HTTPException(status_code=404, detail="Course not found")
 
-        # Build comprehensive tutoring prompt using PARTS framework
-        tutor_prompt = build_tutor_prompt(
-            course_details=course_details,
+        # Continue the server-side conversation, or start one seeded from the
+        # client's history
+        session_id = chat_request.session_id or str(uuid.uuid4())
+        if chat_request.session_id:
+            session = await asyncio.to_thread(tutor_sessions.load, session_id)
+            prior_turns, new_turns = session["turns"], []
+        else:
+            session = {"summary": ""}
+            new_turns = [msg.model_dump() for msg in chat_request.chat_history]
+            prior_turns = new_turns[-6:]  # Last 6 messages for context
+        new_turns = new_turns + [{"role": "user", "message": chat_request.user_message}]
+
+        # Course instructions are compiled once per course; each turn only
+        # ships the conversation and the new message
+        tutor_config = await get_tutor_config(course_details)
+        tutor_contents = build_tutor_contents(
             user_message=chat_request.user_message,
-            chat_history=chat_request.chat_history,
+            turns=prior_turns,
+            summary=session["summary"],
+            passages=get_course_index(course_details).select(
+                chat_request.user_message, TUTOR_RETRIEVAL_TOKEN_BUDGET
+            ),
         )
 
+        async def save_exchange(ai_response: str):
+            # The turn is saved before replying; folding older turns into the
+            # summary is a Gemini call, so it runs after the response
+            saved = await tutor_sessions.record(
+                session_id, new_turns + [{"role": "ai", "message": ai_response}]
+            )
+            if tutor_sessions.overflow(saved):
+                task = asyncio.create_task(
+                    tutor_sessions.compact(session_id, summarize_tutor_turns)
+                )
+                background_tutor_tasks.add(task)
+                task.add_done_callback(background_tutor_tasks.discard)
+
+        if chat_request.stream or "text/event-stream" in request.headers.get(
+            "accept", ""
+        ):
+            return StreamingResponse(
+                stream_tutor_response(
+                    tutor_contents, tutor_config, session_id, save_exchange
+                ),
+                media_type="text/event-stream",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+            )
+
         # Generate response using Gemini Flash model
-        result = client.models.generate_content(
-            model="gemini-2.5-flash", contents=tutor_prompt
-        )
+        with track_stage("tutor_generation"):
+            result = await tutor_gemini.acall(
+                lambda: get_gemini_client().aio.models.generate_content(
+                    model=TUTOR_MODEL, contents=tutor_contents, config=tutor_config
+                )
+            )
 
         ai_response = result.text.strip()
+        await save_exchange(ai_response)
 
-        return {"response": ai_response, "status": "success"}
+        return {"response": ai_response, "status": "success", "session_id": session_id}
 
+    except CircuitOpenError as e:
+        raise HTTPException(
+            status_code=503,
+            detail="AI tutor is temporarily unavailable",
+            headers={"Retry-After": str(int(e.retry_after))},
+        )
     except Exception as e:
         print(f"AI Tutor error: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to generate tutor response")
 
 
-def build_tutor_prompt(
-    course_details: dict, user_message: str, chat_history: List[ChatMessage]
-) -> str:
-    """
-    Build a comprehensive tutoring prompt using LearnLM best practices and PARTS framework.
-
-    PARTS Framework:
-    - Persona: Educational AI tutor role
-    - Act: Provide personalized tutoring
-    - Recipient: Individual learner
-    - Theme: Course-specific content
-    - Structure: Conversational guidance format
-    """
+def sse_event(data: dict, event: Optional[str] = None) -> str:
+    """Format a Server-Sent Events message."""
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
 
-    # Format chat history for context
-    history_context = ""
-    if chat_history:
-        history_context = "\n\nPrevious conversation context:\n"
-        for msg in chat_history[-6:]:  # Last 6 messages for context
-            role_label = "Student" if msg.role == "user" else "You"
-            history_context += f"{role_label}: {msg.message}\n"
 
-    # Extract and format key course information
-    key_concepts = course_details.get("key_concepts", [])
-    if key_concepts and isinstance(key_concepts[0], dict):
-        # Handle array of objects format
-        key_concepts_text = ", ".join(
-            [
-                f"{concept.get('concept', concept.get('title', str(concept)))}"
-                for concept in key_concepts[:5]
-            ]
+async def stream_tutor_response(
+    tutor_contents: List["types.Content"],
+    tutor_config: "types.GenerateContentConfig",
+    session_id: str,
+    on_complete: Callable[[str], Awaitable[None]],
+):
+    """Forward Gemini's streamed reply as SSE chunks, logging time to first token."""
+    started = time.perf_counter()
+    first_token_at = None
+    parts = []
+    try:
+        with track_stage("tutor_generation"), tutor_gemini.guarded():
+            stream = await get_gemini_client().aio.models.generate_content_stream(
+                model=TUTOR_MODEL, contents=tutor_contents, config=tutor_config
+            )
+            async for chunk in stream:
+                text = chunk.text
+                if not text:
+                    continue
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                    print(
+                        f"AI Tutor time to first token: {first_token_at - started:.3f}s"
+                    )
+                    stage_seconds.observe(
+                        first_token_at - started, stage="tutor_first_token"
+                    )
+                parts.append(text)
+                yield sse_event({"delta": text})
+
+        print(f"AI Tutor stream completed in {time.perf_counter() - started:.3f}s")
+        ai_response = "".join(parts).strip()
+        # Save before "done" so a follow-up sent on receipt sees this exchange
+        await on_complete(ai_response)
+        yield sse_event(
+            {"response": ai_response, "status": "success", "session_id": session_id},
+            event="done",
         )
-    else:
-        # Handle simple array format
-        key_concepts_text = ", ".join(key_concepts[:5]) if key_concepts else "N/A"
+    except Exception as e:
+        print(f"AI Tutor streaming error: {str(e)}")
+        yield sse_event({"detail": "Failed to generate tutor response"}, event="error")
 
-    course_context = f"""
-Course Information:
-- Title: {course_details.get('title', 'N/A')}
-- Description: {course_details.get('description', course_details.get('summary', 'N/A'))}
-- Difficulty: {course_details.get('difficulty_level', 'N/A')}
-- Category: {course_details.get('category_name', 'N/A')}
-- Key Concepts: {key_concepts_text}
-- Educational Takeaways: {'; '.join(course_details.get('core_educational_takeaways', [])[:3]) if course_details.get('core_educational_takeaways') else 'N/A'}
-- Important Facts: {'; '.join(course_details.get('important_facts_figures', [])[:3]) if course_details.get('important_facts_figures') else 'N/A'}
-- Lecture Content Preview: {course_details.get('lecture_script', '')[:500] + '...' if course_details.get('lecture_script') else 'N/A'}
-"""
 
-    prompt = f"""You are an expert AI tutor specializing in personalized education. Your role is to help students deeply understand course material through effective pedagogical techniques.
+# Static tutor persona, built around LearnLM best practices and the PARTS framework:
+# - Persona: Educational AI tutor role
+# - Act: Provide personalized tutoring
+# - Recipient: Individual learner
+# - Theme: Course-specific content (appended per course)
+# - Structure: Conversational guidance format
+TUTOR_SYSTEM_INSTRUCTIONS = """You are an expert AI tutor specializing in personalized education. Your role is to help students deeply understand course material through effective pedagogical techniques.
 
 EDUCATIONAL PRINCIPLES TO FOLLOW:
 ✓ Inspire active learning - Ask questions that make students think critically
@@ -930,10 +1774,6 @@ TUTORING GUIDELINES:
 4. **Encouraging Tone**: Be supportive, patient, and enthusiastic about their learning journey
 5. **Check Understanding**: Regularly ask follow-up questions to ensure comprehension
 
-{course_context}
-
-{history_context}
-
 EXAMPLE INTERACTIONS:
 Student: "I don't understand this concept"
 Tutor: "I'd be happy to help you work through this! Can you tell me which specific part feels unclear? Sometimes breaking it down into smaller pieces can make complex concepts much more manageable. What comes to mind when you first think about [concept]?"
@@ -941,10 +1781,8 @@ Tutor: "I'd be happy to help you work through this! Can you tell me which specif
 Student: "What does [term] mean?"
 Tutor: "Great question! Before I explain [term], what do you think it might relate to based on what we've covered so far? [Brief explanation with analogy]. Does this help clarify it? What questions does this raise for you?"
 
-Current Student Question: "{user_message}"
-
 RESPONSE INSTRUCTIONS:
-- Address their specific question while encouraging deeper thinking
+- Address the student's latest question while encouraging deeper thinking
 - Use analogies and examples relevant to the course content
 - Ask 1-2 thoughtful follow-up questions to promote active learning
 - Keep responses conversational and encouraging (2-4 sentences typically)
@@ -953,16 +1791,205 @@ RESPONSE INSTRUCTIONS:
 - Encourage them to explain concepts back to you to reinforce learning
 - Adapt your language to their apparent level of understanding
 
-Respond as their dedicated AI tutor, helping them not just learn the material, but understand how to learn effectively:"""
+Respond as their dedicated AI tutor, helping them not just learn the material, but understand how to learn effectively.
+"""
+
+TUTOR_MODEL = "gemini-2.5-flash"
+# Replies are hedged; summaries fold old turns in after the reply, so only retried
+tutor_gemini = UpstreamPolicy("gemini", GEMINI_TIMEOUT_SECONDS, hedge=True)
+tutor_summary_gemini = UpstreamPolicy("gemini", GEMINI_TIMEOUT_SECONDS)
+# Explicit Gemini context caches live for an hour; drop our handle a bit earlier
+TUTOR_CONTEXT_TTL_SECONDS = 3600
+TUTOR_CONTEXT_CACHING = os.getenv("TUTOR_CONTEXT_CACHING", "true").lower() == "true"
+
+tutor_context_cache = TTLCache(max_size=256, ttl=TUTOR_CONTEXT_TTL_SECONDS - 300)
+tutor_context_builds = SingleFlight()
+course_index_cache = TTLCache(max_size=128, ttl=3600)
+TUTOR_RETRIEVAL_TOKEN_BUDGET = int(os.getenv("TUTOR_RETRIEVAL_TOKEN_BUDGET", "600"))
+
+# Conversations live server-side; set TUTOR_SESSION_DB to persist them in SQLite
+tutor_sessions = TutorSessionStore(
+    SQLiteSessionBackend(os.environ["TUTOR_SESSION_DB"])
+    if os.getenv("TUTOR_SESSION_DB")
+    else MemorySessionBackend(),
+    token_budget=int(os.getenv("TUTOR_SESSION_TOKEN_BUDGET", "1500")),
+)
+# Summarization runs after the reply; keep references so tasks are not collected
+background_tutor_tasks = set()
 
-    return prompt
+
+def build_course_context(course_details: dict) -> str:
+    """Format the per-course section of the tutor's system instruction."""
+    # Extract and format key course information
+    key_concepts = course_details.get("key_concepts", [])
+    if key_concepts and isinstance(key_concepts[0], dict):
+        # Handle array of objects format
+        key_concepts_text = ", ".join(
+            [
+                f"{concept.get('concept', concept.get('title', str(concept)))}"
+                for concept in key_concepts[:5]
+            ]
+        )
+    else:
+        # Handle simple array format
+        key_concepts_text = ", ".join(key_concepts[:5]) if key_concepts else "N/A"
+
+    return f"""
+Course Information:
+- Title: {course_details.get('title', 'N/A')}
+- Description: {course_details.get('description', course_details.get('summary', 'N/A'))}
+- Difficulty: {course_details.get('difficulty_level', 'N/A')}
+- Category: {course_details.get('category_name', 'N/A')}
+- Key Concepts: {key_concepts_text}
+- Educational Takeaways: {'; '.join(course_details.get('core_educational_takeaways', [])[:3]) if course_details.get('core_educational_takeaways') else 'N/A'}
+- Important Facts: {'; '.join(course_details.get('important_facts_figures', [])[:3]) if course_details.get('important_facts_figures') else 'N/A'}
+
+Passages from the course material relevant to each question are included with the student's message.
+"""
+
+
+async def get_tutor_config(course_details: dict) -> "types.GenerateContentConfig":
+    """
+    Return the generation config carrying the tutor's system instruction for
+    a course, compiling it at most once per course version.
+
+    When Gemini context caching is enabled the instruction is uploaded once
+    as cached content and later turns only reference it by name. Prompts
+    below the model's minimum cacheable size (or any caching error) fall
+    back to sending the precompiled instruction as ``system_instruction``.
+    """
+    key = course_version(course_details)
+    config = tutor_context_cache.get(key)
+    record_cache("tutor_context", config is not None)
+    if config is None:
+        config = await tutor_context_builds.do(
+            key, lambda: compile_tutor_config(course_details, key)
+        )
+    return config
+
+
+def course_version(course_details: dict) -> str:
+    return hashlib.md5(json.dumps(course_details, sort_keys=True).encode()).hexdigest()
+
+
+def get_course_index(course_details: dict) -> BM25Index:
+    """BM25 index over a course's material, built on first use per course version."""
+    key = course_version(course_details)
+    index = course_index_cache.get(key)
+    record_cache("course_index", index is not None)
+    if index is None:
+        index = BM25Index(course_passages(course_details))
+        course_index_cache.set(key, index)
+    return index
+
+
+async def compile_tutor_config(
+    course_details: dict, key: str
+) -> "types.GenerateContentConfig":
+    from google.genai import types
+
+    system_instruction = TUTOR_SYSTEM_INSTRUCTIONS + build_course_context(
+        course_details
+    )
+    config = types.GenerateContentConfig(system_instruction=system_instruction)
+
+    if TUTOR_CONTEXT_CACHING:
+        try:
+            cached = await get_gemini_client().aio.caches.create(
+                model=TUTOR_MODEL,
+                config=types.CreateCachedContentConfig(
+                    system_instruction=system_instruction,
+                    display_name=f"tutor-{course_details.get('id', key)}",
+                    ttl=f"{TUTOR_CONTEXT_TTL_SECONDS}s",
+                ),
+            )
+            config = types.GenerateContentConfig(cached_content=cached.name)
+            print(f"Created tutor context cache {cached.name}")
+        except Exception as e:
+            print(f"Tutor context caching unavailable, using system instruction: {e}")
+
+    tutor_context_cache.set(key, config)
+    return config
+
+
+def build_tutor_contents(
+    user_message: str,
+    turns: List[dict],
+    summary: str = "",
+    passages: Optional[List[str]] = None,
+) -> List["types.Content"]:
+    """
+    Turn the conversation summary, recent turns and new message into Gemini
+    turns, grounding the new message with any retrieved course passages.
+    """
+    from google.genai import types
+
+    contents = []
+    if summary:
+        contents.append(
+            types.Content(
+                role="user",
+                parts=[types.Part(text=f"(Summary of our earlier conversation: {summary})")],
+            )
+        )
+    contents.extend(
+        types.Content(
+            role="user" if turn["role"] == "user" else "model",
+            parts=[types.Part(text=turn["message"])],
+        )
+        for turn in turns
+    )
+    if passages:
+        material = "\n\n".join(f"[{i}] {p}" for i, p in enumerate(passages, 1))
+        user_message = (
+            f"Relevant course material:\n{material}\n\n"
+            f"Student question: {user_message}"
+        )
+    contents.append(types.Content(role="user", parts=[types.Part(text=user_message)]))
+    return contents
+
+
+async def summarize_tutor_turns(summary: str, turns: List[dict]) -> str:
+    """Fold older tutor turns into the session's running summary."""
+    transcript = "\n".join(
+        f"{'Student' if turn['role'] == 'user' else 'Tutor'}: {turn['message']}"
+        for turn in turns
+    )
+    prompt = f"""Update the running summary of a tutoring conversation.
+Keep it under 150 words. Preserve what the student has understood, what they struggled with, and any open questions.
+
+Current summary:
+{summary or "None"}
+
+Earlier turns to fold in:
+{transcript}
+
+Return only the updated summary."""
+    with track_stage("tutor_summarize"):
+        result = await tutor_summary_gemini.acall(
+            lambda: get_gemini_client().aio.models.generate_content(
+                model=TUTOR_MODEL, contents=prompt
+            )
+        )
+    return result.text.strip()
 
 
 async def get_course_by_id(course_id: str) -> Optional[dict]:
     """
     Fetch course details by course ID/slug from the course API.
     Includes fallback for when course API is unavailable.
+
+    Successful lookups are cached under both the course id and slug, and
+    concurrent misses for the same course share a single upstream request.
     """
+    cached = course_cache.get(course_id)
+    record_cache("course", cached is not None)
+    if cached is not None:
+        return cached
+    return await course_fetches.do(course_id, lambda: fetch_course(course_id))
+
+
+async def fetch_course(course_id: str) -> Optional[dict]:
     try:
         # Use the same course API that the frontend uses
         api_url = os.getenv("KNEWBIT_API_URL", "http://localhost:3001")
@@ -970,11 +1997,16 @@ async def get_course_by_id(course_id: str) -> Optional[dict]:
 
         print(f"Fetching course details from: {course_url}")
 
-        response = requests.get(course_url, timeout=10)
+        with track_upstream("knewbit") as call:
+            response = await get_course_http_client().get(course_url)
+            call.ok = response.status_code < 500
 
         if response.status_code == 200:
             course_data = response.json()
             print(f"Successfully fetched course: {course_data.get('title', 'Unknown')}")
+            for key in {course_id, course_data.get("id"), course_data.get("slug")}:
+                if key:
+                    course_cache.set(key, course_data)
             return course_data
         elif response.status_code == 404:
             print(f"Course not found: {course_id}")
@@ -984,10 +2016,10 @@ async def get_course_by_id(course_id: str) -> Optional[dict]:
             # Return fallback course data for tutoring to continue
             return create_fallback_course_data(course_id)
 
-    except requests.exceptions.Timeout:
+    except httpx.TimeoutException:
         print(f"Timeout fetching course details for: {course_id}")
         return create_fallback_course_data(course_id)
-    except requests.exceptions.ConnectionError:
+    except httpx.ConnectError:
         print(f"Connection error fetching course details for: {course_id}")
         return create_fallback_course_data(course_id)
     except Exception as e:
@@ -1030,12 +2062,85 @@ def recommend_courses(query: QueryRequest, request: Request):
             status_code=401, detail="Unauthorized: Missing authentication token."
         )
     try:
-        result = compiled.invoke(query.model_dump() | {"knewbit_jwt": token})
-        return {"recommendations": result["matched_courses"]}
+        if query.user_question.strip():
+            result = get_recommendation_graph().invoke(
+                query.model_dump() | {"knewbit_jwt": token}
+            )
+            return {"recommendations": result["matched_courses"]}
+        return {"recommendations": recommend_next_courses(token)}
+    except HTTPException:
+        raise
+    except CircuitOpenError as e:
+        raise HTTPException(
+            status_code=503,
+            detail="Recommendations are temporarily unavailable",
+            headers={"Retry-After": str(int(e.retry_after))},
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def recommend_next_courses(token: str) -> List[dict]:
+    """
+    Question-less recommendations: the nightly batch's picks for this user
+    and catalog, or a live run whose result is stored for next time.
+    """
+    # Stored picks are keyed by user id, so only trust an authenticated one:
+    # a verified signature, or else the Knewbit API accepting the token
+    claims = verified_jwt_claims(token)
+    if claims is not None:
+        user_id = claims.get("sub")
+    else:
+        user_id, _ = load_enrolled(token)
+        if user_id is None:
+            raise HTTPException(
+                status_code=401, detail="Unauthorized: Invalid authentication token."
+            )
+    catalog_version = fetch_all_courses({})["catalog_version"]
+    matched = None
+    if user_id is not None:
+        matched = precomputed_recommendations.get(user_id, catalog_version)
+        record_cache("precomputed_recommendation", matched is not None)
+    if matched is not None:
+        return matched
+
+    result = get_recommendation_graph().invoke(
+        {"knewbit_jwt": token, "user_question": NEXT_COURSE_QUESTION}
+    )
+    matched = result["matched_courses"]
+    if matched and user_id is not None:
+        precomputed_recommendations.set(user_id, result["catalog_version"], matched)
+    return matched
+
+
+class EnrollmentChange(BaseModel):
+    user_id: str
+
+
+def drop_enrolled(user_id: str) -> None:
+    """Forget a user's cached enrolled courses in every worker."""
+    keys = shared_state.get(f"enrolled:tokens:{user_id}") or []
+    for key in [f"enrolled:user:{user_id}", *keys, f"enrolled:tokens:{user_id}"]:
+        shared_state.delete(key)
+
+
+@app.post("/internal/enrollment-changed")
+async def enrollment_changed(change: EnrollmentChange, request: Request):
+    """
+    Webhook for the Knewbit API to call when a user's enrollments change, so
+    the next recommendation sees them without waiting for the cache TTL.
+    """
+    internal_key = os.getenv("INTERNAL_API_KEY")
+    if not internal_key or not hmac.compare_digest(
+        request.headers.get("X-Internal-Key", "").encode(), internal_key.encode()
+    ):
+        raise HTTPException(status_code=403, detail="Forbidden")
+    await asyncio.to_thread(drop_enrolled, change.user_id)
+    await asyncio.to_thread(precomputed_recommendations.delete_user, change.user_id)
+    print(f"Invalidated enrolled courses and recommendations for user {change.user_id}")
+    return {"status": "invalidated", "user_id": change.user_id}
+
+
 # Run the application
 if __name__ == "__main__":
     uvicorn.run(
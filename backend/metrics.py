@@ -0,0 +1,298 @@
+import asyncio
+import bisect
+import functools
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from tracing import span
+
+# Seconds; spans quick cache lookups up to multi-minute transcriptions and encodes
+DEFAULT_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600,
+)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric(ABC):
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name, self.documentation = name, documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        lines.extend(self._samples())
+        return lines
+
+    @abstractmethod
+    def _samples(self) -> List[str]:
+        """Exposition lines for the current values, without HELP/TYPE."""
+
+
+class Counter(_Metric):
+    """Monotonically increasing count, optionally split by labels."""
+
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in items
+        ]
+
+
+class Gauge(_Metric):
+    """
+    Value that goes up and down. A gauge built with ``fn`` reads its value
+    from the callback at scrape time instead of being set.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation, fn: Optional[Callable[[], float]] = None):
+        super().__init__(name, documentation)
+        self.fn = fn
+        self._value = 0.0
+
+    def set(self, value: float) -> None:
+        self._value = value
+
+    def inc(self, amount: float = 1) -> None:
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount: float = 1) -> None:
+        self.inc(-amount)
+
+    def _samples(self):
+        value = self.fn() if self.fn else self._value
+        return [f"{self.name} {_format_value(value)}"]
+
+
+class Histogram(_Metric):
+    """Distribution of observed values in cumulative buckets, plus sum and count."""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [count per bucket (+Inf last), sum]
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][idx] += 1
+            series[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the ``with`` block, including when it raises."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels) -> int:
+        series = self._series.get(self._key(labels))
+        return sum(series[0]) if series else 0
+
+    def _samples(self):
+        with self._lock:
+            items = sorted((k, (list(v[0]), v[1])) for k, v in self._series.items())
+        lines = []
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_format_value(float(bound))}"'
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}"
+                )
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Metrics are per process; with several workers, scrape each or run one per container
+stage_seconds = registry.register(
+    Histogram(
+        "knewbit_stage_duration_seconds",
+        "Time spent in each pipeline stage.",
+        ["stage"],
+    )
+)
+cache_lookups = registry.register(
+    Counter(
+        "knewbit_cache_lookups_total",
+        "Cache lookups by cache and result (hit or miss).",
+        ["cache", "result"],
+    )
+)
+upstream_requests = registry.register(
+    Counter(
+        "knewbit_upstream_requests_total",
+        "Calls to upstream services by outcome (ok or error).",
+        ["upstream", "outcome"],
+    )
+)
+upstream_seconds = registry.register(
+    Histogram(
+        "knewbit_upstream_request_duration_seconds",
+        "Latency of calls to upstream services.",
+        ["upstream"],
+    )
+)
+upstream_retries = registry.register(
+    Counter(
+        "knewbit_upstream_retries_total",
+        "Upstream calls retried after a retryable error or timeout.",
+        ["upstream"],
+    )
+)
+upstream_hedges = registry.register(
+    Counter(
+        "knewbit_upstream_hedges_total",
+        "Hedged duplicate requests by which copy answered first (original or hedge).",
+        ["upstream", "winner"],
+    )
+)
+circuit_events = registry.register(
+    Counter(
+        "knewbit_circuit_breaker_events_total",
+        "Circuit breaker transitions (opened, closed) and fast-failed calls (rejected).",
+        ["upstream", "event"],
+    )
+)
+
+
+@contextmanager
+def track_stage(stage: str):
+    """
+    ``with track_stage("download"):`` records the block under that stage,
+    and as a span when the request is traced.
+    """
+    with span(stage), stage_seconds.time(stage=stage):
+        yield
+
+
+def record_cache(cache: str, hit: bool) -> None:
+    cache_lookups.inc(cache=cache, result="hit" if hit else "miss")
+
+
+class _UpstreamCall:
+    ok = True
+
+
+@contextmanager
+def track_upstream(upstream: str):
+    """
+    Count a call to an upstream service as ok or error and time it. Raising
+    counts as an error; callers that handle failed responses without raising
+    set ``ok = False`` on the yielded object.
+    """
+    call = _UpstreamCall()
+    started = time.perf_counter()
+    with span(f"upstream.{upstream}") as upstream_span:
+        try:
+            yield call
+        except BaseException:
+            call.ok = False
+            raise
+        finally:
+            upstream_requests.inc(
+                upstream=upstream, outcome="ok" if call.ok else "error"
+            )
+            upstream_seconds.observe(time.perf_counter() - started, upstream=upstream)
+            if upstream_span is not None:
+                upstream_span.attributes["outcome"] = "ok" if call.ok else "error"
+
+
+def timed(stage: str):
+    """Decorator recording every call of a sync or async function under ``stage``."""
+
+    def decorator(fn):
+        if asyncio.iscoroutinefunction(fn):
+
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with track_stage(stage):
+                    return await fn(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with track_stage(stage):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
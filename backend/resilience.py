@@ -0,0 +1,338 @@
+import asyncio
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import httpx
+import requests
+
+from metrics import circuit_events, track_upstream, upstream_hedges, upstream_retries
+from tracing import bind_context
+
+# Shared retry, hedging and circuit breaker settings; timeouts are per policy
+UPSTREAM_MAX_RETRIES = int(os.getenv("UPSTREAM_MAX_RETRIES", "2"))
+UPSTREAM_BACKOFF_SECONDS = 0.5  # First retry waits up to this, doubling each time
+UPSTREAM_MAX_BACKOFF_SECONDS = 8
+# Extra requests hedging may add, as a fraction of calls (0 turns hedging off)
+UPSTREAM_HEDGE_RATIO = float(os.getenv("UPSTREAM_HEDGE_RATIO", "0.1"))
+HEDGE_MIN_SAMPLES = 20  # Latencies needed before the p95 hedge delay is trusted
+HEDGE_WINDOW = 200
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_SECONDS = float(os.getenv("CIRCUIT_RESET_SECONDS", "30"))
+
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+# Runs both copies of a hedged blocking call; the caller's thread only waits
+hedge_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("UPSTREAM_HEDGE_THREADS", "64")),
+    thread_name_prefix="hedge",
+)
+
+
+class UpstreamHTTPError(Exception):
+    """Non-success HTTP response from an upstream, with its status code."""
+
+    def __init__(self, status_code: int, message: str, retry_after: float = 0):
+        super().__init__(message)
+        self.status_code, self.retry_after = status_code, retry_after
+
+
+class CircuitOpenError(Exception):
+    """An upstream's circuit is open, so the call failed without being made."""
+
+    def __init__(self, upstream: str, retry_after: float):
+        super().__init__(f"{upstream} is unavailable (circuit open)")
+        self.upstream, self.retry_after = upstream, retry_after
+
+
+def retry_after_seconds(headers) -> float:
+    """Seconds from a ``Retry-After`` header (the HTTP-date form is ignored)."""
+    try:
+        return float(headers.get("Retry-After") or 0)
+    except ValueError:
+        return 0
+
+
+def is_retryable(error: BaseException) -> bool:
+    """
+    Timeouts, connection failures and 408/429/5xx responses, whether raised
+    by requests, httpx, google-genai (``code``) or the legacy SDK's
+    google.api_core exceptions (also ``code``).
+    """
+    transient = (
+        TimeoutError,
+        ConnectionError,
+        requests.ConnectionError,
+        requests.Timeout,
+        httpx.TransportError,
+    )
+    if isinstance(error, transient):
+        return True
+    status = getattr(error, "status_code", None) or getattr(error, "code", None)
+    return status in RETRYABLE_STATUS_CODES
+
+
+class CircuitBreaker:
+    """
+    Opens after ``failure_threshold`` retryable failures in a row and then
+    rejects calls for ``reset_seconds``. After that one trial call is let
+    through (half-open): success closes the circuit, failure reopens it.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+        reset_seconds: float = CIRCUIT_RESET_SECONDS,
+    ):
+        self.name = name
+        self.failure_threshold, self.reset_seconds = failure_threshold, reset_seconds
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_seconds:
+            return "half-open"
+        return "open"
+
+    def before_call(self) -> None:
+        """Raise ``CircuitOpenError`` unless a call may go ahead now."""
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return
+            if state == "half-open" and not self._trial_running:
+                self._trial_running = True
+                return
+            retry_after = self.reset_seconds - (time.monotonic() - self.opened_at)
+        circuit_events.inc(upstream=self.name, event="rejected")
+        raise CircuitOpenError(self.name, max(retry_after, 1))
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._trial_running = False
+            self.failures = 0
+            if self.opened_at is not None:
+                self.opened_at = None
+                circuit_events.inc(upstream=self.name, event="closed")
+                print(f"Circuit for {self.name} closed")
+
+    def record_failure(self) -> None:
+        with self._lock:
+            trial, self._trial_running = self._trial_running, False
+            self.failures += 1
+            if trial or (
+                self.opened_at is None and self.failures >= self.failure_threshold
+            ):
+                self.opened_at = time.monotonic()
+                circuit_events.inc(upstream=self.name, event="opened")
+                print(f"Circuit for {self.name} opened after {self.failures} failures")
+
+    def release(self) -> None:
+        """End a half-open trial that failed for a non-retryable reason."""
+        with self._lock:
+            self._trial_running = False
+
+
+breakers: Dict[str, CircuitBreaker] = {}
+breakers_lock = threading.Lock()
+
+
+def circuit_breaker(upstream: str) -> CircuitBreaker:
+    """The breaker for ``upstream``, shared by every policy calling it."""
+    with breakers_lock:
+        if upstream not in breakers:
+            breakers[upstream] = CircuitBreaker(upstream)
+        return breakers[upstream]
+
+
+class UpstreamPolicy:
+    """
+    Timeout, retry, hedging and circuit breaker policy for one kind of
+    upstream call, e.g. tutor replies from Gemini or TTS requests to Sarvam.
+
+    ``call`` (blocking) and ``acall`` (async) take a function that makes
+    the request and return its result. Each attempt is tracked with
+    ``track_upstream``. Retryable failures are retried up to ``retries``
+    times with full-jitter exponential backoff (or the server's
+    ``Retry-After`` if longer). With ``hedge``, once this policy has seen
+    enough calls, an attempt still running after the p95 latency gets a
+    duplicate, and whichever answers first wins; hedges are capped at
+    ``hedge_ratio`` of calls. Only hedge idempotent, short calls.
+
+    ``acall`` enforces ``timeout`` itself. Blocking calls cannot be
+    interrupted, so ``call`` relies on the request honouring ``timeout``.
+    """
+
+    def __init__(
+        self,
+        upstream: str,
+        timeout: float,
+        retries: int = UPSTREAM_MAX_RETRIES,
+        hedge: bool = False,
+        hedge_ratio: float = UPSTREAM_HEDGE_RATIO,
+    ):
+        self.upstream, self.timeout, self.retries = upstream, timeout, retries
+        self.hedge, self.hedge_ratio = hedge and hedge_ratio > 0, hedge_ratio
+        self.breaker = circuit_breaker(upstream)
+        self.latencies: deque = deque(maxlen=HEDGE_WINDOW)
+        self.calls = self.hedges = 0
+        self._lock = threading.Lock()
+
+    # --- Hedging ---
+    def hedge_delay(self) -> Optional[float]:
+        """p95 of recent successful attempts, or None while there are too few."""
+        if not self.hedge or len(self.latencies) < HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[int(0.95 * (len(ordered) - 1))]
+
+    def _take_hedge(self) -> bool:
+        with self._lock:
+            if self.hedges + 1 > self.hedge_ratio * self.calls:
+                return False
+            self.hedges += 1
+            return True
+
+    def _count_call(self) -> None:
+        with self._lock:
+            self.calls += 1
+
+    def backoff(self, attempt: int, error: BaseException) -> float:
+        ceiling = min(UPSTREAM_MAX_BACKOFF_SECONDS, UPSTREAM_BACKOFF_SECONDS * 2**attempt)
+        return max(random.uniform(0, ceiling), getattr(error, "retry_after", 0) or 0)
+
+    def _settle(self, error: Optional[BaseException], attempt: int) -> bool:
+        """Update the breaker after an attempt; True if the call should retry."""
+        if error is None:
+            self.breaker.record_success()
+            return False
+        if not is_retryable(error):
+            self.breaker.release()
+            return False
+        self.breaker.record_failure()
+        if attempt >= self.retries:
+            return False
+        upstream_retries.inc(upstream=self.upstream)
+        print(f"Retrying {self.upstream} call after error: {error!r}"[:300])
+        return True
+
+    @contextmanager
+    def guarded(self):
+        """
+        Circuit breaker and tracking without retries or hedging, for calls
+        that cannot be repeated once started, such as streamed replies.
+        """
+        self.breaker.before_call()
+        try:
+            with track_upstream(self.upstream):
+                yield
+        except Exception as e:
+            self._settle(e, self.retries)
+            raise
+        except BaseException:
+            # Cancelled or closed early: says nothing about the upstream
+            self.breaker.release()
+            raise
+        self._settle(None, 0)
+
+    # --- Blocking calls ---
+    def _attempt(self, fn: Callable[[], Any]) -> Any:
+        started = time.perf_counter()
+        with track_upstream(self.upstream):
+            result = fn()
+        self.latencies.append(time.perf_counter() - started)
+        return result
+
+    def _hedged(self, fn: Callable[[], Any]) -> Any:
+        delay = self.hedge_delay()
+        if delay is None:
+            return self._attempt(fn)
+        original = hedge_executor.submit(bind_context(self._attempt), fn)
+        if wait([original], timeout=delay).done or not self._take_hedge():
+            return original.result()
+        copy = hedge_executor.submit(bind_context(self._attempt), fn)
+        pending = {original, copy}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    # The slower copy finishes in the background; its result is dropped
+                    winner = "original" if future is original else "hedge"
+                    upstream_hedges.inc(upstream=self.upstream, winner=winner)
+                    return future.result()
+        return original.result()
+
+    def call(self, fn: Callable[[], Any]) -> Any:
+        self._count_call()
+        attempt = 0
+        while True:
+            self.breaker.before_call()
+            try:
+                result = self._hedged(fn)
+            except Exception as e:
+                if not self._settle(e, attempt):
+                    raise
+                time.sleep(self.backoff(attempt, e))
+                attempt += 1
+                continue
+            self._settle(None, attempt)
+            return result
+
+    # --- Async calls ---
+    async def _aattempt(self, fn: Callable[[], Awaitable[Any]]) -> Any:
+        started = time.perf_counter()
+        with track_upstream(self.upstream):
+            result = await asyncio.wait_for(fn(), self.timeout)
+        self.latencies.append(time.perf_counter() - started)
+        return result
+
+    async def _ahedged(self, fn: Callable[[], Awaitable[Any]]) -> Any:
+        delay = self.hedge_delay()
+        if delay is None:
+            return await self._aattempt(fn)
+        original = asyncio.ensure_future(self._aattempt(fn))
+        pending = {original}
+        try:
+            done, _ = await asyncio.wait(pending, timeout=delay)
+            if done or not self._take_hedge():
+                return await original
+            copy = asyncio.ensure_future(self._aattempt(fn))
+            pending.add(copy)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        winner = "original" if task is original else "hedge"
+                        upstream_hedges.inc(upstream=self.upstream, winner=winner)
+                        return task.result()
+            return original.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def acall(self, fn: Callable[[], Awaitable[Any]]) -> Any:
+        self._count_call()
+        attempt = 0
+        while True:
+            self.breaker.before_call()
+            try:
+                result = await self._ahedged(fn)
+            except Exception as e:
+                if not self._settle(e, attempt):
+                    raise
+                await asyncio.sleep(self.backoff(attempt, e))
+                attempt += 1
+                continue
+            self._settle(None, attempt)
+            return result
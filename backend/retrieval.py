@@ -0,0 +1,110 @@
+import math
+import re
+from collections import Counter
+from typing import List, Tuple
+
+from tutor_sessions import estimate_tokens
+
+_STOPWORDS = {
+    "a", "an", "the", "and", "or", "but", "if", "of", "to", "in", "on", "at",
+    "for", "with", "by", "from", "as", "is", "are", "was", "were", "be", "been",
+    "it", "its", "this", "that", "these", "those", "i", "you", "we", "they",
+    "he", "she", "do", "does", "did", "what", "which", "how", "why", "can",
+    "could", "would", "should", "will", "about", "so", "not", "no", "me", "my",
+}
+
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in re.findall(r"\w+", text.lower()) if t not in _STOPWORDS]
+
+
+def chunk_text(text: str, max_words: int = 120) -> List[str]:
+    """
+    Split text into passages of roughly ``max_words`` words on sentence
+    boundaries, carrying the last sentence over so ideas spanning a boundary
+    are still retrievable.
+    """
+    sentences = [s.strip() for s in re.split(r"(?<=[.!?])\s+", text) if s.strip()]
+    passages, current, words = [], [], 0
+    for sentence in sentences:
+        length = len(sentence.split())
+        if current and words + length > max_words:
+            passages.append(" ".join(current))
+            current = current[-1:]
+            words = len(current[0].split())
+        current.append(sentence)
+        words += length
+    if current:
+        passages.append(" ".join(current))
+    return passages
+
+
+def course_passages(course_details: dict) -> List[str]:
+    """Break a course's lecture script, takeaways, facts and concepts into passages."""
+    passages = chunk_text(course_details.get("lecture_script") or "")
+    passages += [
+        f"Key takeaway: {t}" for t in course_details.get("core_educational_takeaways") or []
+    ]
+    passages += [
+        f"Important fact: {f}" for f in course_details.get("important_facts_figures") or []
+    ]
+    for concept in course_details.get("key_concepts") or []:
+        if isinstance(concept, dict):
+            name = concept.get("concept", concept.get("title", ""))
+            detail = concept.get("description") or concept.get("explanation") or ""
+            passages.append(f"Key concept: {name}. {detail}".strip())
+        else:
+            passages.append(f"Key concept: {concept}")
+    return [p for p in passages if p.strip()]
+
+
+class BM25Index:
+    """Okapi BM25 ranking over a fixed list of passages."""
+
+    def __init__(self, passages: List[str], k1: float = 1.5, b: float = 0.75):
+        self.passages, self.k1, self.b = passages, k1, b
+        self._term_freqs = [Counter(tokenize(p)) for p in passages]
+        self._lengths = [sum(tf.values()) for tf in self._term_freqs]
+        self._avg_length = sum(self._lengths) / len(passages) if passages else 0
+        doc_freqs = Counter(term for tf in self._term_freqs for term in tf)
+        n = len(passages)
+        self._idf = {
+            term: math.log(1 + (n - df + 0.5) / (df + 0.5))
+            for term, df in doc_freqs.items()
+        }
+
+    def search(self, query: str, limit: int = 10) -> List[Tuple[float, int]]:
+        """Return up to ``limit`` (score, passage index) pairs with a positive score."""
+        terms = [t for t in set(tokenize(query)) if t in self._idf]
+        scores = []
+        for idx, tf in enumerate(self._term_freqs):
+            norm = self.k1 * (
+                1 - self.b + self.b * self._lengths[idx] / (self._avg_length or 1)
+            )
+            score = sum(
+                self._idf[t] * tf[t] * (self.k1 + 1) / (tf[t] + norm)
+                for t in terms
+                if t in tf
+            )
+            if score > 0:
+                scores.append((score, idx))
+        scores.sort(reverse=True)
+        return scores[:limit]
+
+    def select(self, query: str, token_budget: int = 600) -> List[str]:
+        """
+        Pick the highest-ranked passages that fit in ``token_budget``. When
+        nothing matches, fall back to the opening passage so the tutor still
+        has some grounding.
+        """
+        ranked = [idx for _, idx in self.search(query, limit=len(self.passages))]
+        if not ranked and self.passages:
+            ranked = [0]
+        selected, used = [], 0
+        for idx in ranked:
+            cost = estimate_tokens(self.passages[idx])
+            if used + cost > token_budget:
+                continue
+            selected.append(self.passages[idx])
+            used += cost
+        return selected
@@ -0,0 +1,344 @@
+import copy
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Any, List, Optional, Tuple
+
+import dotenv
+from limits.storage import Storage
+
+from cache import ExpiringMap
+
+dotenv.load_dotenv()
+
+
+class SharedState(ABC):
+    """
+    Key/value store shared by every worker process on the host.
+
+    Holds the dubbing dedup claims and results, cached enrolled courses, the
+    transcription cache and rate-limit counters. Values must be
+    JSON-serializable; ``ttl`` is in seconds. The operations map one-to-one
+    onto Redis commands (GET, SET EX, SET NX EX, DEL, INCRBY + EXPIRE, RPUSH,
+    TTL, SCAN + DEL), so a Redis-compatible backend can implement this
+    interface without changing callers.
+    """
+
+    @abstractmethod
+    def get(self, key: str) -> Any:
+        ...
+
+    @abstractmethod
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        ...
+
+    @abstractmethod
+    def add(self, key: str, value: Any, ttl: Optional[float] = None) -> bool:
+        """Set ``key`` only if it is absent; returns whether it was set."""
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        ...
+
+    @abstractmethod
+    def incr(self, key: str, amount: int = 1, ttl: Optional[float] = None) -> int:
+        """Increment a counter; ``ttl`` applies only when the counter is created."""
+
+    @abstractmethod
+    def append(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        """Append to the list stored at ``key``, refreshing its ttl."""
+
+    @abstractmethod
+    def expires_at(self, key: str) -> Optional[float]:
+        """Epoch time at which ``key`` expires, or None."""
+
+    @abstractmethod
+    def clear_prefix(self, prefix: str) -> int:
+        ...
+
+    @abstractmethod
+    def next_expiry(self) -> Optional[float]:
+        """Epoch time of the earliest pending expiry, or None."""
+
+    @abstractmethod
+    def purge_expired(self) -> List[Tuple[str, Any]]:
+        """Delete expired keys and return them with their values."""
+
+
+class MemoryState(SharedState):
+    """Single-process implementation on an ``ExpiringMap``, for one worker."""
+
+    def __init__(self):
+        self._data = ExpiringMap()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            return self._data.get(key)
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._data.set(key, value, ttl)
+
+    def add(self, key, value, ttl=None):
+        with self._lock:
+            if key in self._data:
+                return False
+            self._data.set(key, value, ttl)
+            return True
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key)
+
+    def incr(self, key, amount=1, ttl=None):
+        with self._lock:
+            if key not in self._data:
+                self._data.set(key, amount, ttl)
+                return amount
+            value = self._data.get(key) + amount
+            self._data.replace(key, value)
+            return value
+
+    def append(self, key, value, ttl=None):
+        with self._lock:
+            values = self._data.get(key) or []
+            values.append(value)
+            self._data.set(key, values, ttl)
+
+    def expires_at(self, key):
+        with self._lock:
+            return self._data.deadline(key)
+
+    def clear_prefix(self, prefix):
+        with self._lock:
+            keys = [k for k in self._data.keys() if k.startswith(prefix)]
+            for key in keys:
+                self._data.pop(key)
+        return len(keys)
+
+    def next_expiry(self):
+        with self._lock:
+            return self._data.next_deadline()
+
+    def purge_expired(self):
+        with self._lock:
+            return self._data.expire()
+
+
+class SQLiteState(SharedState):
+    """
+    Host-wide implementation on a SQLite file. Read-modify-write operations
+    run in ``BEGIN IMMEDIATE`` transactions, so they are atomic across
+    worker processes without any external service.
+    """
+
+    def __init__(self, path: str, timeout: float = 30):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        with self._transaction() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS shared_state ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS shared_state_expires_at "
+                "ON shared_state (expires_at)"
+            )
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(
+                self.path, timeout=self.timeout, isolation_level=None
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def with_timeout(self, timeout: float) -> "SQLiteState":
+        """Another handle on the same file that waits at most ``timeout``
+        seconds for another process's write lock."""
+        other = copy.copy(self)
+        other.timeout = timeout
+        other._local = threading.local()
+        return other
+
+    class _Transaction:
+        def __init__(self, conn):
+            self.conn = conn
+
+        def __enter__(self):
+            self.conn.execute("BEGIN IMMEDIATE")
+            return self.conn
+
+        def __exit__(self, exc_type, exc, tb):
+            self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+
+    def _transaction(self):
+        return self._Transaction(self._conn())
+
+    @staticmethod
+    def _deadline(ttl: Optional[float]) -> Optional[float]:
+        return None if ttl is None else time.time() + ttl
+
+    def _row(self, conn, key):
+        return conn.execute(
+            "SELECT value, expires_at FROM shared_state "
+            "WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (key, time.time()),
+        ).fetchone()
+
+    def get(self, key):
+        row = self._row(self._conn(), key)
+        return None if row is None else json.loads(row[0])
+
+    def set(self, key, value, ttl=None):
+        self._conn().execute(
+            "INSERT OR REPLACE INTO shared_state (key, value, expires_at) "
+            "VALUES (?, ?, ?)",
+            (key, json.dumps(value), self._deadline(ttl)),
+        )
+
+    def add(self, key, value, ttl=None):
+        with self._transaction() as conn:
+            if self._row(conn, key) is not None:
+                return False
+            conn.execute(
+                "INSERT OR REPLACE INTO shared_state (key, value, expires_at) "
+                "VALUES (?, ?, ?)",
+                (key, json.dumps(value), self._deadline(ttl)),
+            )
+            return True
+
+    def delete(self, key):
+        self._conn().execute("DELETE FROM shared_state WHERE key = ?", (key,))
+
+    def incr(self, key, amount=1, ttl=None):
+        with self._transaction() as conn:
+            row = self._row(conn, key)
+            if row is None:
+                value, expires_at = amount, self._deadline(ttl)
+            else:
+                value, expires_at = json.loads(row[0]) + amount, row[1]
+            conn.execute(
+                "INSERT OR REPLACE INTO shared_state (key, value, expires_at) "
+                "VALUES (?, ?, ?)",
+                (key, json.dumps(value), expires_at),
+            )
+            return value
+
+    def append(self, key, value, ttl=None):
+        with self._transaction() as conn:
+            row = self._row(conn, key)
+            values = [] if row is None else json.loads(row[0])
+            values.append(value)
+            conn.execute(
+                "INSERT OR REPLACE INTO shared_state (key, value, expires_at) "
+                "VALUES (?, ?, ?)",
+                (key, json.dumps(values), self._deadline(ttl)),
+            )
+
+    def expires_at(self, key):
+        row = self._row(self._conn(), key)
+        return None if row is None else row[1]
+
+    def clear_prefix(self, prefix):
+        cursor = self._conn().execute(
+            "DELETE FROM shared_state WHERE substr(key, 1, ?) = ?",
+            (len(prefix), prefix),
+        )
+        return cursor.rowcount
+
+    def next_expiry(self):
+        row = self._conn().execute(
+            "SELECT MIN(expires_at) FROM shared_state WHERE expires_at IS NOT NULL"
+        ).fetchone()
+        return row[0]
+
+    def purge_expired(self):
+        # Selecting and deleting in one transaction hands each expired entry
+        # to exactly one worker; the expires_at index keeps this O(log n + k)
+        with self._transaction() as conn:
+            rows = conn.execute(
+                "SELECT key, value FROM shared_state "
+                "WHERE expires_at IS NOT NULL AND expires_at <= ?",
+                (time.time(),),
+            ).fetchall()
+            conn.executemany(
+                "DELETE FROM shared_state WHERE key = ?", [(k,) for k, _ in rows]
+            )
+        return [(k, json.loads(v)) for k, v in rows]
+
+
+def create_shared_state(url: str) -> SharedState:
+    """Build a backend from ``memory://`` or ``sqlite:///path/to/state.db``."""
+    if url.startswith("memory://"):
+        return MemoryState()
+    if url.startswith("sqlite://"):
+        return SQLiteState(url[len("sqlite://") :])
+    raise ValueError(f"Unsupported SHARED_STATE_URL: {url}")
+
+
+DEFAULT_SHARED_STATE_URL = (
+    f"sqlite://{os.path.join(tempfile.gettempdir(), 'knewbit-max-state.db')}"
+)
+shared_state = create_shared_state(
+    os.getenv("SHARED_STATE_URL", DEFAULT_SHARED_STATE_URL)
+)
+RATE_LIMIT_LOCK_TIMEOUT_MS = float(os.getenv("RATE_LIMIT_LOCK_TIMEOUT_MS", "50"))
+
+
+class SharedStateLimitStorage(Storage):
+    """
+    ``limits`` storage over ``shared_state`` so slowapi limits such as
+    ``3/minute`` apply per host rather than per worker. Selected with
+    ``Limiter(storage_uri="shared-state://")``.
+
+    slowapi calls the storage synchronously on the event loop, so a counter
+    update waits at most ``RATE_LIMIT_LOCK_TIMEOUT_MS`` for another worker's
+    write lock. If the lock is still held the request is let through
+    uncounted: under heavy write contention limits are enforced loosely
+    rather than stalling every request on the worker.
+    """
+
+    STORAGE_SCHEME = ["shared-state"]
+
+    def __init__(self, uri=None, wrap_exceptions=False, **options):
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+        self.state = shared_state
+        if isinstance(shared_state, SQLiteState):
+            self.state = shared_state.with_timeout(RATE_LIMIT_LOCK_TIMEOUT_MS / 1000)
+
+    @property
+    def base_exceptions(self):
+        return sqlite3.Error
+
+    def incr(self, key, expiry, amount=1):
+        try:
+            return self.state.incr(f"ratelimit:{key}", amount, ttl=expiry)
+        except sqlite3.OperationalError as e:
+            # Fail open rather than block the event loop on a locked database
+            print(f"Rate limit storage busy, allowing request: {e}")
+            return 0
+
+    def get(self, key):
+        return int(self.state.get(f"ratelimit:{key}") or 0)
+
+    def get_expiry(self, key):
+        return self.state.expires_at(f"ratelimit:{key}") or time.time()
+
+    def check(self):
+        return True
+
+    def reset(self):
+        return self.state.clear_prefix("ratelimit:")
+
+    def clear(self, key):
+        self.state.delete(f"ratelimit:{key}")
@@ -0,0 +1,150 @@
+import asyncio
+import subprocess
+from types import SimpleNamespace
+
+import pytest
+
+import admission
+from admission import AdmissionController, AdmissionRejected, JobCost, probe_youtube
+from shared_state import MemoryState
+
+
+def encode_cost(units: float) -> JobCost:
+    # Encode time is the budget unit, so pick a duration that costs ``units``
+    return JobCost(units / admission.ENCODE_SECONDS_PER_VIDEO_SECOND)
+
+
+def test_slot_queues_fifo_until_budget_frees():
+    async def scenario():
+        controller = AdmissionController(MemoryState(), capacity=10)
+        order = []
+        release = asyncio.Event()
+
+        async def job(name, units, hold=False):
+            async with controller.slot(encode_cost(units)):
+                order.append(name)
+                if hold:
+                    await release.wait()
+
+        first = asyncio.create_task(job("first", 8, hold=True))
+        await asyncio.sleep(0)
+        big = asyncio.create_task(job("big", 6))
+        small = asyncio.create_task(job("small", 1))
+        await asyncio.sleep(0)
+        # "small" would fit, but strict FIFO keeps it behind "big"
+        assert order == ["first"] and controller.queue_depth == 2
+        release.set()
+        await asyncio.gather(first, big, small)
+        assert order == ["first", "big", "small"]
+        assert controller.in_use == pytest.approx(0)
+
+    asyncio.run(scenario())
+
+
+def test_full_queue_is_rejected_with_retry_after():
+    async def scenario():
+        controller = AdmissionController(MemoryState(), capacity=10, max_queue=1)
+        release = asyncio.Event()
+
+        async def job(units):
+            async with controller.slot(encode_cost(units)):
+                await release.wait()
+
+        running = asyncio.create_task(job(10))
+        await asyncio.sleep(0)
+        queued = asyncio.create_task(job(5))
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected) as rejected:
+            async with controller.slot(encode_cost(5)):
+                pass
+        assert rejected.value.status_code == 503
+        assert rejected.value.retry_after >= 1
+        release.set()
+        await asyncio.gather(running, queued)
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def scenario():
+        controller = AdmissionController(MemoryState(), capacity=10)
+        release = asyncio.Event()
+
+        async def job(units):
+            async with controller.slot(encode_cost(units)):
+                await release.wait()
+
+        running = asyncio.create_task(job(10))
+        await asyncio.sleep(0)
+        waiting = asyncio.create_task(job(5))
+        await asyncio.sleep(0)
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+        assert controller.queue_depth == 0
+        release.set()
+        await running
+        assert controller.in_use == pytest.approx(0)
+
+    asyncio.run(scenario())
+
+
+def test_captions_job_skips_the_queue():
+    async def scenario():
+        controller = AdmissionController(MemoryState(), capacity=10)
+        release = asyncio.Event()
+
+        async def job():
+            async with controller.slot(encode_cost(10)):
+                await release.wait()
+
+        running = asyncio.create_task(job())
+        await asyncio.sleep(0)
+        async with controller.slot(JobCost(600, captions=True)):
+            assert controller.queue_depth == 0
+        release.set()
+        await running
+
+    asyncio.run(scenario())
+
+
+def test_client_budget_rejects_with_429_and_refunds():
+    controller = AdmissionController(
+        MemoryState(), capacity=10, client_seconds_per_hour=100
+    )
+    controller.charge_client("client", JobCost(60))
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.charge_client("client", JobCost(60))
+    assert rejected.value.status_code == 429
+    assert 1 <= rejected.value.retry_after <= 3600
+    controller.refund_client("client", JobCost(60))
+    controller.charge_client("client", JobCost(90))
+
+
+def test_too_long_video_is_rejected_with_413():
+    controller = AdmissionController(MemoryState(), capacity=10, max_duration=60)
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.charge_client("client", JobCost(61))
+    assert rejected.value.status_code == 413
+
+
+def test_probe_youtube_timeout_is_retryable(monkeypatch):
+    def slow(cmd, **kwargs):
+        raise subprocess.TimeoutExpired(cmd, kwargs["timeout"])
+
+    monkeypatch.setattr(subprocess, "run", slow)
+    with pytest.raises(AdmissionRejected) as rejected:
+        probe_youtube("https://youtu.be/x")
+    assert rejected.value.status_code == 503
+    assert rejected.value.retry_after == admission.YOUTUBE_PROBE_RETRY_AFTER_SECONDS
+
+
+def test_probe_youtube_rejects_unreadable_metadata(monkeypatch):
+    monkeypatch.setattr(
+        subprocess,
+        "run",
+        lambda cmd, **kwargs: SimpleNamespace(returncode=0, stdout="oops", stderr=""),
+    )
+    with pytest.raises(AdmissionRejected) as rejected:
+        probe_youtube("https://youtu.be/x")
+    assert rejected.value.status_code == 400
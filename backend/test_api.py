@@ -96,6 +96,21 @@ def test_docs_endpoint(base_url: str = "http://localhost:8000") -> bool:
         return False
 
 
+def test_metrics_endpoint(base_url: str = "http://localhost:8000") -> bool:
+    """Test that Prometheus metrics are exported"""
+    try:
+        response = requests.get(f"{base_url}/metrics")
+        if response.status_code == 200 and "# TYPE" in response.text:
+            print("✅ Metrics endpoint: OK")
+            return True
+        else:
+            print(f"❌ Metrics endpoint failed: {response.status_code}")
+            return False
+    except Exception as e:
+        print(f"❌ Metrics endpoint error: {e}")
+        return False
+
+
 def main():
     """Run all API tests"""
     print("🚀 Testing Knewbit Max Backend API\n")
@@ -117,6 +132,7 @@ def main():
         test_root_endpoint,
         lambda: test_ai_tutor_endpoint(base_url, jwt_token),
         test_docs_endpoint,
+        test_metrics_endpoint,
     ]
 
     passed = 0
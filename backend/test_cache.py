@@ -0,0 +1,155 @@
+import asyncio
+
+import pytest
+
+from cache import ExpiringMap, RecommendationCache, SingleFlight, catalog_fingerprint
+
+
+def test_paraphrase_reuses_cached_recommendation():
+    cache = RecommendationCache()
+    cache.set("user", "I want to learn Python programming", "v1", [{"id": "py"}])
+    assert cache.get("user", "learn python programming!", "v1") == [{"id": "py"}]
+    assert cache.get("other-user", "learn python programming", "v1") is None
+
+
+def test_negated_question_does_not_match_near_threshold():
+    cache = RecommendationCache(similarity_threshold=0.8)
+    cache.set("user", "I want to learn python programming", "v1", [{"id": "py"}])
+    # Scores about 0.82 on terms alone; the negation must still keep it apart
+    assert cache.get("user", "I do not want python programming", "v1") is None
+    assert cache.get("user", "I don't want to learn python programming", "v1") is None
+
+
+def test_catalog_change_drops_cached_recommendations():
+    cache = RecommendationCache()
+    cache.set("user", "python", "v1", [{"id": "py"}])
+    assert cache.get("user", "python", "v2") is None
+    assert cache.get("user", "python", "v1") is None
+
+
+def test_catalog_fingerprint_ignores_volatile_fields():
+    course = {"id": "py", "slug": "python", "title": "Python", "tags": ["code"]}
+    before = catalog_fingerprint([{**course, "rating": 4.1, "enrollments": 10}])
+    after = catalog_fingerprint([{**course, "rating": 4.2, "enrollments": 11}])
+    assert before == after
+    assert catalog_fingerprint([{**course, "title": "Python 3"}]) != before
+
+
+def test_single_flight_coalesces_concurrent_calls():
+    async def scenario():
+        flights, calls = SingleFlight(), []
+        release = asyncio.Event()
+
+        async def fetch():
+            calls.append(1)
+            await release.wait()
+            return "value"
+
+        waiters = [asyncio.create_task(flights.do("key", fetch)) for _ in range(3)]
+        await asyncio.sleep(0)
+        assert "key" in flights and len(flights) == 1
+        release.set()
+        assert await asyncio.gather(*waiters) == ["value"] * 3
+        assert calls == [1] and "key" not in flights
+
+    asyncio.run(scenario())
+
+
+def test_single_flight_survives_a_cancelled_waiter():
+    async def scenario():
+        flights = SingleFlight()
+        release = asyncio.Event()
+
+        async def fetch():
+            await release.wait()
+            return "value"
+
+        first = asyncio.create_task(flights.do("key", fetch))
+        second = asyncio.create_task(flights.do("key", fetch))
+        await asyncio.sleep(0)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        release.set()
+        assert await second == "value"
+
+    asyncio.run(scenario())
+
+
+def test_single_flight_shares_errors_and_then_retries():
+    async def scenario():
+        flights, calls = SingleFlight(), []
+
+        async def fetch():
+            calls.append(1)
+            await asyncio.sleep(0)
+            raise ValueError("upstream down")
+
+        results = await asyncio.gather(
+            flights.do("key", fetch), flights.do("key", fetch), return_exceptions=True
+        )
+        assert [type(r) for r in results] == [ValueError, ValueError]
+        with pytest.raises(ValueError):
+            await flights.do("key", fetch)
+        assert len(calls) == 2
+
+    asyncio.run(scenario())
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_expiring_map_expires_in_deadline_order():
+    clock = FakeClock()
+    entries = ExpiringMap(clock)
+    entries.set("late", 1, ttl=30)
+    entries.set("early", 2, ttl=10)
+    entries.set("forever", 3)
+    assert entries.next_deadline() == 1010
+    clock.now = 1015
+    assert "early" not in entries and entries.get("early") is None
+    assert len(entries) == 3  # Expired entries are only removed by expire()
+    assert entries.expire() == [("early", 2)]
+    assert entries.next_deadline() == 1030
+    clock.now = 1100
+    assert entries.expire() == [("late", 1)]
+    assert entries.keys() == ["forever"] and entries.next_deadline() is None
+
+
+def test_expiring_map_skips_stale_heap_entries():
+    clock = FakeClock()
+    entries = ExpiringMap(clock)
+    entries.set("key", "old", ttl=10)
+    entries.set("key", "new", ttl=60)  # Leaves the old heap entry behind
+    entries.set("gone", "x", ttl=5)
+    entries.pop("gone")
+    assert entries.next_deadline() == 1060
+    clock.now = 1020
+    assert entries.expire() == []
+    assert entries.get("key") == "new"
+    assert entries.items() == [("key", "new")]
+
+
+def test_expiring_map_reports_expired_entry_overwritten_before_collection():
+    clock = FakeClock()
+    entries = ExpiringMap(clock)
+    entries.set("key", "first", ttl=10)
+    clock.now = 1020
+    entries.set("key", "second", ttl=10)
+    assert entries.expire() == [("key", "first")]
+    assert entries.get("key") == "second"
+
+
+def test_expiring_map_replace_keeps_the_deadline():
+    clock = FakeClock()
+    entries = ExpiringMap(clock)
+    entries.set("counter", 1, ttl=10)
+    entries.replace("counter", 2)
+    assert entries.deadline("counter") == 1010 and entries.get("counter") == 2
+    clock.now = 1010
+    assert entries.expire() == [("counter", 2)]
@@ -0,0 +1,58 @@
+import asyncio
+import io
+import wave
+from array import array
+
+from dub_pipeline import AudioTimeline, decode_wav
+
+
+def render(clips, total_seconds, sample_rate=10):
+    """Run clips through an AudioTimeline and return the written samples."""
+    chunks = []
+
+    async def write(data):
+        chunks.append(data)
+
+    async def run():
+        timeline = AudioTimeline(write, sample_rate=sample_rate)
+        for start, samples in clips:
+            await timeline.add(start, array("h", samples))
+        await timeline.finish(total_seconds)
+        return timeline.written
+
+    written = asyncio.run(run())
+    samples = array("h", b"".join(chunks))
+    assert len(samples) == written
+    return list(samples)
+
+
+def test_clips_are_placed_at_their_start_with_silence_between():
+    out = render([(0.2, [1, 2]), (0.6, [3])], total_seconds=1)
+    assert out == [0, 0, 1, 2, 0, 0, 3, 0, 0, 0]
+
+
+def test_overlapping_clips_are_mixed_and_clipped():
+    out = render([(0.0, [1, 30000, 1]), (0.1, [30000, 2])], total_seconds=0.5)
+    assert out == [1, 32767, 3, 0, 0]
+
+
+def test_clip_before_written_audio_is_shifted_to_write_position():
+    # Audio up to the second clip is already written when the third arrives,
+    # so it moves to the write position and mixes with the held tail
+    out = render([(0.0, [1]), (0.5, [2, 2]), (0.1, [5])], total_seconds=0.8)
+    assert out == [1, 0, 0, 0, 0, 7, 2, 0]
+
+
+def test_long_clip_runs_past_total_duration():
+    assert render([(0.0, [7] * 4)], total_seconds=0.2) == [7, 7, 7, 7]
+
+
+def test_decode_wav_downmixes_and_resamples():
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(2)
+        wav.setsampwidth(2)
+        wav.setframerate(20)
+        wav.writeframes(array("h", [100, -100, 200, -200, 300, -300, 400, -400]).tobytes())
+    assert list(decode_wav(buffer.getvalue(), sample_rate=20)) == [100, 200, 300, 400]
+    assert list(decode_wav(buffer.getvalue(), sample_rate=10)) == [100, 300]
@@ -0,0 +1,102 @@
+import asyncio
+import hashlib
+import os
+
+import pytest
+from starlette.requests import Request
+
+from ingest import UploadRejected, ingest_upload, sniff_container
+
+MP4_HEADER = b"\x00\x00\x00\x18ftypmp42" + b"\x00" * 500
+
+
+def multipart(*parts, boundary=b"B", closed=True) -> bytes:
+    body = b""
+    for name, value, filename in parts:
+        disposition = f'form-data; name="{name}"'
+        if filename is not None:
+            disposition += f'; filename="{filename}"'
+        body += b"--" + boundary + b"\r\n"
+        body += f"Content-Disposition: {disposition}\r\n\r\n".encode() + value + b"\r\n"
+    if closed:
+        body += b"--" + boundary + b"--\r\n"
+    return body
+
+
+def make_request(body: bytes, chunk_size: int = 7, content_length: bool = True):
+    chunks = [body[i : i + chunk_size] for i in range(0, len(body), chunk_size)]
+    messages = [
+        {"type": "http.request", "body": chunk, "more_body": i < len(chunks) - 1}
+        for i, chunk in enumerate(chunks)
+    ] or [{"type": "http.request", "body": b"", "more_body": False}]
+
+    async def receive():
+        return messages.pop(0)
+
+    headers = [(b"content-type", b"multipart/form-data; boundary=B")]
+    if content_length:
+        headers.append((b"content-length", str(len(body)).encode()))
+    scope = {"type": "http", "method": "POST", "path": "/dub", "headers": headers}
+    return Request(scope, receive)
+
+
+def ingest(body: bytes, max_bytes: int = 1024 * 1024, **kwargs):
+    return asyncio.run(ingest_upload(make_request(body, **kwargs), max_bytes))
+
+
+def test_streams_file_and_fields_to_disk(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    video = MP4_HEADER + os.urandom(4000)
+    upload = ingest(
+        multipart(
+            ("target_language", b"Hindi", None),
+            ("file", video, "clip.mp4"),
+            ("lang_code", b"hi-IN", None),
+        )
+    )
+    assert upload.fields == {"target_language": "Hindi", "lang_code": "hi-IN"}
+    assert upload.filename == "clip.mp4" and upload.container == "mp4"
+    assert upload.size == len(video)
+    assert upload.md5 == hashlib.md5(video).hexdigest()
+    with open(upload.path, "rb") as f:
+        assert f.read() == video
+
+
+def test_truncated_body_is_rejected_and_removed(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    body = multipart(("file", MP4_HEADER + b"x" * 4000, "clip.mp4"), closed=False)
+    with pytest.raises(UploadRejected) as rejected:
+        ingest(body[:-100])
+    assert rejected.value.status_code == 400
+    assert os.listdir(tmp_path) == []
+
+
+def test_malformed_body_is_a_400(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with pytest.raises(UploadRejected) as rejected:
+        ingest(b"not a multipart body at all")
+    assert rejected.value.status_code == 400
+
+
+def test_oversize_upload_is_cut_off_mid_stream(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    body = multipart(("file", MP4_HEADER + b"x" * 5000, "clip.mp4"))
+    with pytest.raises(UploadRejected) as rejected:
+        ingest(body, max_bytes=2000, content_length=False)
+    assert rejected.value.status_code == 413
+    assert os.listdir(tmp_path) == []
+
+
+def test_unknown_container_is_a_415(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with pytest.raises(UploadRejected) as rejected:
+        ingest(multipart(("file", b"%PDF-1.7" + b"x" * 1000, "notes.pdf")))
+    assert rejected.value.status_code == 415
+    assert os.listdir(tmp_path) == []
+
+
+def test_sniff_container_needs_repeated_ts_sync_bytes():
+    packet = b"\x47" + b"\x00" * 187
+    assert sniff_container(packet * 3) == "mpegts"
+    assert sniff_container(b"\x47" + b"\x00" * 400) is None
+    assert sniff_container(MP4_HEADER) == "mp4"
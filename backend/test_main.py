@@ -0,0 +1,121 @@
+import asyncio
+import os
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+import main
+from shared_state import MemoryState
+
+# Unsigned token whose payload claims {"sub": "victim"}
+FORGED_TOKEN = "e30.eyJzdWIiOiJ2aWN0aW0ifQ.x"
+
+
+@pytest.fixture
+def app_state(monkeypatch):
+    monkeypatch.setattr(main, "shared_state", MemoryState())
+    monkeypatch.setattr(main, "KNEWBIT_JWT_SECRET", None)
+    monkeypatch.setattr(main.limiter, "enabled", False)
+    return main
+
+
+@pytest.fixture
+def rejecting_knewbit(app_state, monkeypatch):
+    def get(url, headers=None, **kwargs):
+        return SimpleNamespace(status_code=401, json=lambda: {"error": "Invalid token"})
+
+    monkeypatch.setattr(main.requests, "get", get)
+    monkeypatch.setattr(
+        main, "fetch_all_courses", lambda state: {**state, "catalog_version": "v1"}
+    )
+    monkeypatch.setattr(
+        main.precomputed_recommendations,
+        "get",
+        lambda user_id, version: [{"id": f"picked-for-{user_id}"}],
+    )
+
+
+def test_rejected_token_gets_401_from_recommend_next_courses(rejecting_knewbit):
+    with pytest.raises(HTTPException) as rejected:
+        main.recommend_next_courses(FORGED_TOKEN)
+    assert rejected.value.status_code == 401
+
+    response = TestClient(main.app).post(
+        "/recommend-courses",
+        json={"user_question": ""},
+        headers={"Authorization": f"Bearer {FORGED_TOKEN}"},
+    )
+    assert response.status_code == 401
+
+
+def test_rejected_token_is_not_cached(rejecting_knewbit):
+    assert main.load_enrolled(FORGED_TOKEN) == (None, [])
+    assert main.shared_state.get(main.enrolled_cache_key(FORGED_TOKEN)) is None
+
+
+class FakeStreamingGemini:
+    def __init__(self, chunks):
+        self.aio = SimpleNamespace(models=self)
+        self.chunks = chunks
+
+    async def generate_content_stream(self, **kwargs):
+        async def stream():
+            for text in self.chunks:
+                yield SimpleNamespace(text=text)
+
+        return stream()
+
+
+def test_streamed_reply_is_saved_before_done(app_state, monkeypatch):
+    monkeypatch.setattr(
+        main, "get_gemini_client", lambda: FakeStreamingGemini(["Great ", "question!"])
+    )
+
+    async def scenario():
+        events, saved = [], []
+
+        async def on_complete(ai_response):
+            await asyncio.sleep(0)
+            saved.append(ai_response)
+
+        async for event in main.stream_tutor_response([], None, "session-1", on_complete):
+            if event.startswith("event: done"):
+                # Whoever reacts to "done" must already find the exchange saved
+                assert saved == ["Great question!"]
+            events.append(event)
+        return events
+
+    events = asyncio.run(scenario())
+    assert len(events) == 3 and events[-1].startswith("event: done")
+    assert '"session_id": "session-1"' in events[-1]
+
+
+def test_identical_uploads_arriving_together_leave_no_temp_file(tmp_path):
+    async def scenario():
+        release, started = asyncio.Event(), []
+        uploads = [tmp_path / "temp_first_video.mp4", tmp_path / "temp_second_video.mp4"]
+        for upload in uploads:
+            upload.write_bytes(b"video")
+
+        async def start(input_path):
+            started.append(input_path)
+            await release.wait()
+            os.remove(input_path)  # As the job does once it is done with its input
+            return "dubbed.mp4"
+
+        # Both requests saw no job for the key and queued their background task
+        jobs = [
+            asyncio.create_task(main.join_dub_job("file_same", str(upload), start))
+            for upload in uploads
+        ]
+        while not started:
+            await asyncio.sleep(0)
+        assert started == [str(uploads[0])]
+        assert uploads[0].exists() and not uploads[1].exists()
+        release.set()
+        assert await asyncio.gather(*jobs) == ["dubbed.mp4"] * 2
+
+    asyncio.run(scenario())
+    assert list(tmp_path.iterdir()) == []
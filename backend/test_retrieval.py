@@ -0,0 +1,50 @@
+from retrieval import BM25Index, chunk_text, course_passages
+
+PASSAGES = [
+    "Photosynthesis turns light into chemical energy inside the chloroplast.",
+    "The mitochondria is the powerhouse of the cell and makes ATP.",
+    "Cells divide by mitosis. Mitosis has four phases.",
+    "Mitochondria have their own DNA, inherited from the mother, and ATP synthase.",
+]
+
+
+def test_bm25_ranks_matching_passages_first():
+    index = BM25Index(PASSAGES)
+    ranked = [idx for _, idx in index.search("How do mitochondria make ATP?")]
+    assert set(ranked[:2]) == {1, 3}
+    assert 0 not in ranked and 2 not in ranked
+
+
+def test_bm25_prefers_rare_terms_and_shorter_passages():
+    index = BM25Index(["cell cell cell biology", "cell biology notes", "chloroplast cell"])
+    assert [idx for _, idx in index.search("chloroplast")] == [2]
+    # Equal term counts: the shorter passage scores higher
+    short, long = BM25Index(["atp", "atp energy energy energy energy"]).search("atp")
+    assert short[1] == 0 and short[0] > long[0]
+
+
+def test_bm25_ignores_stopwords_and_unknown_terms():
+    index = BM25Index(PASSAGES)
+    assert index.search("what is the") == []
+    assert index.search("quantum") == []
+
+
+def test_select_fits_budget_and_falls_back_to_opening_passage():
+    index = BM25Index(PASSAGES)
+    # Ranked 1 then 3 (16 and 20 tokens); only the first fits in 20 tokens
+    assert index.select("mitochondria ATP", token_budget=20) == [PASSAGES[1]]
+    assert index.select("mitochondria ATP", token_budget=40) == [PASSAGES[1], PASSAGES[3]]
+    assert index.select("quantum", token_budget=600) == [PASSAGES[0]]
+    assert BM25Index([]).select("anything") == []
+
+
+def test_chunking_carries_the_last_sentence_over():
+    text = "One two three. Four five six. Seven eight nine."
+    assert chunk_text(text, max_words=6) == [
+        "One two three. Four five six.",
+        "Four five six. Seven eight nine.",
+    ]
+    passages = course_passages(
+        {"lecture_script": text, "key_concepts": [{"concept": "ATP", "description": "Energy."}]}
+    )
+    assert passages[-1] == "Key concept: ATP. Energy."
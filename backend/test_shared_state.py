@@ -0,0 +1,119 @@
+import sqlite3
+import time
+
+import pytest
+
+import shared_state as state_module
+from shared_state import MemoryState, SharedState, SQLiteState
+
+
+class Clock:
+    def __init__(self):
+        self.now = time.time()
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(state_module.time, "time", clock)
+    return clock
+
+
+@pytest.fixture(params=["sqlite", "memory"])
+def state(request, tmp_path, clock):
+    if request.param == "sqlite":
+        return SQLiteState(str(tmp_path / "state.db"))
+    memory = MemoryState()
+    memory._data.clock = clock
+    return memory
+
+
+def test_values_expire_after_their_ttl(state, clock):
+    state.set("short", {"a": 1}, ttl=10)
+    state.set("long", [1, 2], ttl=100)
+    state.set("forever", "x")
+    assert state.get("short") == {"a": 1}
+    assert state.expires_at("short") == pytest.approx(clock.now + 10)
+    assert state.next_expiry() == pytest.approx(clock.now + 10)
+
+    clock.now += 11
+    assert state.get("short") is None and state.expires_at("short") is None
+    assert state.purge_expired() == [("short", {"a": 1})]
+    assert state.add("short", "again", ttl=10)
+    clock.now += 100
+    assert sorted(state.purge_expired()) == [("long", [1, 2]), ("short", "again")]
+    assert state.get("forever") == "x" and state.next_expiry() is None
+
+
+def test_add_only_sets_absent_keys(state, clock):
+    assert state.add("claim", "worker-1", ttl=60)
+    clock.now += 30
+    assert not state.add("claim", "worker-2", ttl=60)
+    assert state.get("claim") == "worker-1"
+    clock.now += 31  # An expired claim can be taken over
+    assert state.add("claim", "worker-2", ttl=60)
+    state.delete("claim")
+    assert state.get("claim") is None
+
+
+def test_append_extends_the_list_and_refreshes_the_ttl(state, clock):
+    state.append("log", "first", ttl=10)
+    clock.now += 8
+    state.append("log", {"second": 2}, ttl=10)
+    clock.now += 8
+    assert state.get("log") == ["first", {"second": 2}]
+    clock.now += 3
+    assert state.get("log") is None
+
+
+def test_incr_keeps_the_ttl_set_at_creation(state, clock):
+    assert state.incr("budget", 5, ttl=60) == 5
+    clock.now += 30
+    assert state.incr("budget", 2.5, ttl=60) == 7.5
+    assert state.expires_at("budget") == pytest.approx(clock.now + 30)
+
+
+def test_clear_prefix(state):
+    state.set("ratelimit:a", 1)
+    state.set("ratelimit:b", 2)
+    state.set("other", 3)
+    assert state.clear_prefix("ratelimit:") == 2
+    assert state.get("ratelimit:a") is None and state.get("other") == 3
+
+
+def test_sqlite_state_is_shared_between_instances(tmp_path):
+    path = str(tmp_path / "state.db")
+    first, second = SQLiteState(path), SQLiteState(path)
+    assert first.add("dub:active:key", "worker-1", ttl=60)
+    assert not second.add("dub:active:key", "worker-2", ttl=60)
+    second.append("list", 1)
+    first.append("list", 2)
+    assert second.get("list") == [1, 2]
+
+
+def test_incomplete_backend_cannot_be_instantiated():
+    class Partial(SharedState):
+        def get(self, key):
+            return None
+
+    with pytest.raises(TypeError):
+        Partial()
+
+
+def test_rate_limit_storage_fails_open_while_another_worker_writes(tmp_path, monkeypatch):
+    path = str(tmp_path / "state.db")
+    monkeypatch.setattr(state_module, "shared_state", SQLiteState(path))
+    storage = state_module.SharedStateLimitStorage("shared-state://")
+    assert storage.incr("ip", 60) == 1
+
+    other_worker = sqlite3.connect(path, isolation_level=None)
+    other_worker.execute("BEGIN IMMEDIATE")
+    started = time.monotonic()
+    assert storage.incr("ip", 60) == 0  # Let through uncounted
+    assert time.monotonic() - started < 1
+    assert storage.get("ip") == 1  # Reads are not blocked by the writer
+    other_worker.execute("ROLLBACK")
+    assert storage.incr("ip", 60) == 2
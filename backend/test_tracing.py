@@ -0,0 +1,33 @@
+import json
+
+import tracing
+from tracing import JsonlSink, span, trace
+
+CALLER = "00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01"
+
+
+def test_inbound_sampled_flag_does_not_force_tracing(monkeypatch):
+    monkeypatch.setattr(tracing, "TRACE_SAMPLE_RATE", 0.0)
+    with trace("GET /", traceparent=CALLER) as root:
+        assert root is None and tracing.current_span() is None
+
+
+def test_sampled_request_continues_the_callers_trace(monkeypatch):
+    monkeypatch.setattr(tracing, "TRACE_SAMPLE_RATE", 1.0)
+    monkeypatch.setattr(tracing, "sink", tracing.NullSink())
+    with trace("GET /", traceparent=CALLER.replace("-01", "-00")) as root:
+        assert root.trace.trace_id == "0af7651916cd43dd8448eb211c80319c"
+        assert root.parent_id == "b7ad6b7169203331"
+
+
+def test_jsonl_sink_writes_traces_off_the_callers_thread(tmp_path, monkeypatch):
+    sink = JsonlSink(str(tmp_path / "traces.jsonl"))
+    monkeypatch.setattr(tracing, "sink", sink)
+    with trace("GET /courses", sampled=True, **{"http.method": "GET"}):
+        with span("upstream.knewbit"):
+            pass
+    sink.flush()
+    (line,) = (tmp_path / "traces.jsonl").read_text().splitlines()
+    spans = json.loads(line)["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    assert sorted(s["name"] for s in spans) == ["GET /courses", "upstream.knewbit"]
+    assert sink._writer is not None and sink._writer.name == "trace-export"
@@ -0,0 +1,68 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from tutor_sessions import MemorySessionBackend, SQLiteSessionBackend, TutorSessionStore
+
+
+def turn(message, role="user"):
+    return {"role": role, "message": message}
+
+
+def test_workers_sharing_the_sqlite_file_keep_every_turn(tmp_path):
+    path = str(tmp_path / "sessions.db")
+    # One store per worker process, each with its own connection
+    workers = [TutorSessionStore(SQLiteSessionBackend(path)) for _ in range(4)]
+
+    def record(i):
+        asyncio.run(workers[i % 4].record("session", [turn(f"message {i}")]))
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(record, range(40)))
+    messages = {t["message"] for t in workers[0].load("session")["turns"]}
+    assert messages == {f"message {i}" for i in range(40)}
+
+
+@pytest.fixture(params=["sqlite", "memory"])
+def store(request, tmp_path):
+    if request.param == "sqlite":
+        backend = SQLiteSessionBackend(str(tmp_path / "sessions.db"))
+    else:
+        backend = MemorySessionBackend()
+    return TutorSessionStore(backend, token_budget=10, min_recent_turns=2)
+
+
+def test_compact_folds_overflow_and_keeps_turns_recorded_meanwhile(store):
+    async def scenario():
+        await store.record("s", [turn("a" * 40), turn("b" * 40, "ai")])
+        await store.record("s", [turn("c"), turn("d", "ai")])
+
+        async def summarize(summary, turns):
+            # A new exchange lands while the summary is being written
+            await store.record("s", [turn("e"), turn("f", "ai")])
+            return "summary of " + ",".join(t["message"][0] for t in turns)
+
+        await store.compact("s", summarize)
+
+    asyncio.run(scenario())
+    session = store.load("s")
+    assert session["summary"] == "summary of a,b"
+    assert [t["message"] for t in session["turns"]] == ["c", "d", "e", "f"]
+
+
+def test_compact_drops_a_stale_summary(store):
+    async def scenario():
+        await store.record("s", [turn("a" * 40), turn("b" * 40, "ai"), turn("c"), turn("d")])
+
+        async def summarize(summary, turns):
+            await store.compact("s", quick)  # Another compaction wins the race
+            return "slow"
+
+        async def quick(summary, turns):
+            return "quick"
+
+        await store.compact("s", summarize)
+
+    asyncio.run(scenario())
+    assert store.load("s")["summary"] == "quick"
@@ -0,0 +1,141 @@
+import asyncio
+import hashlib
+import json
+
+import pytest
+
+import video_process
+from resilience import UpstreamHTTPError
+from video_process import SegmentStreamParser, TTSBatching, synthesize_speech_batch
+
+SEGMENTS = [
+    {"start": 0, "end": 1.5, "translated_text": "नमस्ते {दुनिया}", "emotion": "happy"},
+    {"start": 1.5, "end": 3, "translated_text": 'He said "hi" \\ [bye]', "emotion": "calm"},
+    {"start": "3.25", "end": 4, "translated_text": "}]", "emotion": "neutral"},
+]
+
+
+def parse_in_chunks(text, size):
+    parser, segments = SegmentStreamParser(), []
+    for i in range(0, len(text), size):
+        segments += parser.feed(text[i : i + size])
+    return parser, segments
+
+
+def test_segments_are_emitted_as_each_object_closes():
+    text = json.dumps({"segments": SEGMENTS}, ensure_ascii=False)
+    for size in (1, 7, len(text)):
+        parser, segments = parse_in_chunks(text, size)
+        assert [s["translated_text"] for s in segments] == [
+            s["translated_text"] for s in SEGMENTS
+        ]
+        assert segments[2]["start"] == 3.25 and parser.done
+
+    parser = SegmentStreamParser()
+    first = json.dumps(SEGMENTS[0], ensure_ascii=False)
+    assert parser.feed('{"segments": [' + first[:-1]) == []
+    assert len(parser.feed("}, {")) == 1
+
+
+def test_unreadable_segments_are_skipped():
+    text = (
+        '```json\n{"segments": [{"start": 0, "translated_text": "ok"}, '
+        '{"end": 2, "translated_text": "no start"}, {"start": 1, "translated_text": null}, '
+        '{"start": "soon", "translated_text": "bad"}, {"start": 4, "translated_text": "also ok"}'
+        "]}\n```"
+    )
+    parser, segments = parse_in_chunks(text, 5)
+    assert [s["translated_text"] for s in segments] == ["ok", "also ok"]
+    assert parser.skipped == 3 and parser.done
+
+
+def test_text_after_the_segments_array_is_ignored():
+    parser = SegmentStreamParser()
+    parser.feed('{"segments": [], "notes": [{"start": 0, "translated_text": "x"}]}')
+    assert parser.done
+    assert parser.feed('{"start": 1, "translated_text": "y"}') == []
+
+
+@pytest.fixture
+def tts(monkeypatch):
+    """Fake Sarvam: batches fail with ``batch_error``; single texts succeed."""
+    calls = []
+    state = {"batch_error": None}
+
+    def post_tts(payload):
+        calls.append(len(payload["inputs"]) if "inputs" in payload else 1)
+        if "inputs" in payload and state["batch_error"]:
+            raise state["batch_error"]
+        return {"audios": ["AA=="] * len(payload.get("inputs", [None]))}
+
+    monkeypatch.setattr(video_process, "post_tts", post_tts)
+    monkeypatch.setattr(video_process, "tts_batching", TTSBatching(max_failures=2))
+    return calls, state
+
+
+def test_refused_batch_falls_back_for_that_batch_only(tts):
+    calls, state = tts
+    state["batch_error"] = UpstreamHTTPError(400, "TTS API Error: inputs[1] is too long")
+    assert len(synthesize_speech_batch(["a", "b"], "hi-IN")) == 2
+    state["batch_error"] = None
+    synthesize_speech_batch(["c", "d"], "hi-IN")
+    assert calls == [2, 1, 1, 2]
+
+
+def test_consecutive_failures_pause_batching(tts):
+    calls, state = tts
+    state["batch_error"] = UpstreamHTTPError(422, "TTS API Error: bad request")
+    for _ in range(3):
+        synthesize_speech_batch(["a", "b"], "hi-IN")
+    assert calls == [2, 1, 1, 2, 1, 1, 1, 1]
+    video_process.tts_batching.paused_until = 0
+    assert video_process.tts_batching.enabled()
+
+
+def test_unsupported_inputs_pauses_batching_at_once(tts):
+    calls, state = tts
+    state["batch_error"] = UpstreamHTTPError(
+        422, 'TTS API Error: {"detail": "extra fields not permitted: inputs"}'
+    )
+    synthesize_speech_batch(["a", "b"], "hi-IN")
+    synthesize_speech_batch(["c", "d"], "hi-IN")
+    assert calls == [2, 1, 1, 1, 1]
+
+
+def test_server_errors_are_not_swallowed(tts):
+    _, state = tts
+    state["batch_error"] = UpstreamHTTPError(503, "TTS API Error: unavailable")
+    with pytest.raises(UpstreamHTTPError):
+        synthesize_speech_batch(["a", "b"], "hi-IN")
+
+
+class CachedTranscripts:
+    def __init__(self):
+        self.keys = []
+
+    async def get_cached_response(self, key):
+        self.keys.append(key)
+        return {"content": json.dumps({"segments": SEGMENTS[:1]})}
+
+
+def test_transcript_cache_key_uses_known_hash_or_hashes_in_chunks(tmp_path):
+    video = tmp_path / "video.mp4"
+    video.write_bytes(b"frame" * 1000)
+    cache = CachedTranscripts()
+
+    async def transcribe(path, **kwargs):
+        segments = video_process.transcribe_video_segments(
+            path, "req", "model", cache, "Hindi", **kwargs
+        )
+        return [segment async for segment in segments]
+
+    # An upload's hash is reused; the file is not read again
+    asyncio.run(transcribe(str(tmp_path / "missing.mp4"), video_hash="abc"))
+    assert len(asyncio.run(transcribe(str(video)))) == 1
+    assert video_process.file_md5(str(video), chunk_size=7) == hashlib.md5(
+        video.read_bytes()
+    ).hexdigest()
+    assert cache.keys == [
+        "abc_Hindi_transcription",
+        f"{video_process.file_md5(str(video))}_Hindi_transcription",
+    ]
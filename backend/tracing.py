@@ -0,0 +1,336 @@
+import contextvars
+import functools
+import json
+import os
+import queue
+import random
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional
+
+import dotenv
+
+dotenv.load_dotenv()
+
+# Fraction of requests traced, whatever an inbound traceparent header asks for
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.01"))
+# OTLP/JSON lines file that finished traces are appended to (none if unset)
+TRACE_FILE = os.getenv("TRACE_FILE", "")
+SERVER_TIMING_MAX_ENTRIES = 20
+# Finished traces waiting for the export thread; more are dropped
+TRACE_EXPORT_QUEUE_SIZE = 1000
+
+_TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+
+class Trace:
+    def __init__(self, trace_id: Optional[str] = None):
+        self.trace_id = trace_id or uuid.uuid4().hex
+        self.spans: List["Span"] = []
+        self.finished = False
+
+
+class Span:
+    __slots__ = (
+        "trace", "span_id", "parent_id", "name", "attributes", "start", "end", "error",
+    )
+
+    def __init__(
+        self,
+        trace: Trace,
+        name: str,
+        parent_id: Optional[str] = None,
+        attributes: Optional[Dict[str, Any]] = None,
+    ):
+        self.trace, self.name, self.parent_id = trace, name, parent_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.attributes = attributes or {}
+        self.start, self.end = time.time_ns(), None
+        self.error: Optional[str] = None
+
+    def finish(self) -> None:
+        self.end = time.time_ns()
+        # list.append is atomic, so spans may finish on any thread
+        self.trace.spans.append(self)
+
+    @property
+    def duration_ms(self) -> float:
+        return ((self.end or time.time_ns()) - self.start) / 1e6
+
+
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar(
+    "knewbit_current_span", default=None
+)
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def _reset(token) -> None:
+    try:
+        _current_span.reset(token)
+    except ValueError:
+        # Exited in another context (e.g. an async generator resumed elsewhere)
+        pass
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    Record the ``with`` block as a child of the current span. Outside a
+    sampled trace this does nothing and yields None.
+    """
+    parent = _current_span.get()
+    if parent is None or parent.trace.finished:
+        yield None
+        return
+    child = Span(parent.trace, name, parent.span_id, attributes)
+    token = _current_span.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.error = repr(e)[:200]
+        raise
+    finally:
+        child.finish()
+        _reset(token)
+
+
+def traceparent_of(s: Optional[Span]) -> Optional[str]:
+    """W3C ``traceparent`` value continuing the trace of ``s``."""
+    if s is None:
+        return None
+    return f"00-{s.trace.trace_id}-{s.span_id}-01"
+
+
+@contextmanager
+def trace(
+    name: str,
+    traceparent: Optional[str] = None,
+    sampled: Optional[bool] = None,
+    **attributes,
+):
+    """
+    Start a new trace rooted at ``name`` if the request is sampled, and
+    export it when the block ends. Unsampled blocks clear the current span
+    so nothing below them records. ``sampled`` overrides the random choice.
+
+    A ``traceparent`` only supplies the trace and parent IDs to continue:
+    its sampled flag is ignored, so callers cannot force tracing (and its
+    export cost) onto every request.
+    """
+    parent_id, trace_id = None, None
+    if sampled is None:
+        sampled = random.random() < TRACE_SAMPLE_RATE
+    match = _TRACEPARENT.match(traceparent or "")
+    if match:
+        trace_id, parent_id = match.group(1), match.group(2)
+
+    if not sampled:
+        token = _current_span.set(None)
+        try:
+            yield None
+        finally:
+            _reset(token)
+        return
+
+    root = Span(Trace(trace_id), name, parent_id, attributes)
+    token = _current_span.set(root)
+    try:
+        yield root
+    except BaseException as e:
+        root.error = repr(e)[:200]
+        raise
+    finally:
+        root.finish()
+        root.trace.finished = True
+        _reset(token)
+        sink.export(root.trace)
+
+
+def bind_context(fn: Callable) -> Callable:
+    """
+    Carry the current trace into ``fn`` when it runs on another thread.
+    ``asyncio.to_thread`` and ``run_in_threadpool`` already do this; plain
+    ``loop.run_in_executor`` and ``ThreadPoolExecutor.submit`` do not.
+    """
+    context = contextvars.copy_context()
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        return context.run(fn, *args, **kwargs)
+
+    return wrapper
+
+
+def server_timing(root: Span) -> str:
+    """
+    ``Server-Timing`` value summarizing the trace so far: total time per
+    span name in order of first start, plus the elapsed ``total``.
+    """
+    totals: Dict[str, float] = {}
+    for s in sorted(root.trace.spans, key=lambda s: s.start):
+        if s is not root:
+            name = re.sub(r"[^A-Za-z0-9_.-]", "_", s.name)
+            totals[name] = totals.get(name, 0.0) + s.duration_ms
+    entries = [
+        f"{name};dur={ms:.1f}"
+        for name, ms in list(totals.items())[:SERVER_TIMING_MAX_ENTRIES]
+    ]
+    entries.append(f"total;dur={root.duration_ms:.1f}")
+    return ", ".join(entries)
+
+
+class JsonlSink:
+    """
+    Appends each finished trace to a file as one OTLP/JSON ``resourceSpans``
+    line, which the OpenTelemetry collector's file receiver and most trace
+    viewers can import. Traces are formatted and written by a background
+    thread, so finishing a request never waits on the disk.
+    """
+
+    def __init__(self, path: str, service_name: str = "knewbit-max-api"):
+        self.path, self.service_name = path, service_name
+        self._queue: "queue.Queue" = queue.Queue(maxsize=TRACE_EXPORT_QUEUE_SIZE)
+        self._lock = threading.Lock()
+        self._writer: Optional[threading.Thread] = None
+
+    @staticmethod
+    def _attributes(attributes: Dict[str, Any]) -> List[dict]:
+        out = []
+        for key, value in attributes.items():
+            if isinstance(value, bool):
+                out.append({"key": key, "value": {"boolValue": value}})
+            elif isinstance(value, int):
+                out.append({"key": key, "value": {"intValue": str(value)}})
+            elif isinstance(value, float):
+                out.append({"key": key, "value": {"doubleValue": value}})
+            else:
+                out.append({"key": key, "value": {"stringValue": str(value)}})
+        return out
+
+    def _span(self, s: Span) -> dict:
+        attributes = dict(s.attributes)
+        if s.error:
+            attributes["exception.message"] = s.error
+        span = {
+            "traceId": s.trace.trace_id,
+            "spanId": s.span_id,
+            "name": s.name,
+            "kind": 1,  # Internal
+            "startTimeUnixNano": str(s.start),
+            "endTimeUnixNano": str(s.end),
+            "attributes": self._attributes(attributes),
+            "status": {"code": 2 if s.error else 1},
+        }
+        if s.parent_id:
+            span["parentSpanId"] = s.parent_id
+        return span
+
+    def export(self, trace: Trace) -> None:
+        """Queue a finished trace for the writer thread."""
+        try:
+            self._queue.put_nowait((trace.trace_id, list(trace.spans)))
+        except queue.Full:
+            print(f"Trace export queue full, dropping trace {trace.trace_id}")
+            return
+        with self._lock:
+            if self._writer is None:
+                self._writer = threading.Thread(
+                    target=self._write_queued, name="trace-export", daemon=True
+                )
+                self._writer.start()
+
+    def flush(self) -> None:
+        """Block until every queued trace has been written."""
+        self._queue.join()
+
+    def _write_queued(self) -> None:
+        while True:
+            trace_id, spans = self._queue.get()
+            try:
+                self._write(trace_id, spans)
+            finally:
+                self._queue.task_done()
+
+    def _write(self, trace_id: str, spans: List[Span]) -> None:
+        line = json.dumps(
+            {
+                "resourceSpans": [
+                    {
+                        "resource": {
+                            "attributes": self._attributes(
+                                {"service.name": self.service_name}
+                            )
+                        },
+                        "scopeSpans": [
+                            {
+                                "scope": {"name": "knewbit-max"},
+                                "spans": [self._span(s) for s in spans],
+                            }
+                        ],
+                    }
+                ]
+            }
+        )
+        try:
+            with open(self.path, "a") as f:
+                f.write(line + "\n")
+        except OSError as e:
+            print(f"Could not write trace {trace_id}: {e}")
+
+
+class NullSink:
+    def export(self, trace: Trace) -> None:
+        pass
+
+    def flush(self) -> None:
+        pass
+
+
+sink = JsonlSink(TRACE_FILE) if TRACE_FILE else NullSink()
+
+
+class TracingMiddleware:
+    """
+    ASGI middleware that traces sampled HTTP requests. Traced responses carry
+    a ``Server-Timing`` header summarizing the stages that ran before the
+    response started, and an ``X-Trace-Id`` header to find the trace.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope.get("headers") or [])
+        traceparent = headers.get(b"traceparent", b"").decode("latin-1")
+        with trace(
+            f"{scope['method']} {scope['path']}",
+            traceparent=traceparent,
+            **{"http.method": scope["method"], "http.target": scope["path"]},
+        ) as root:
+            if root is None:
+                await self.app(scope, receive, send)
+                return
+
+            async def send_with_timing(message):
+                if message["type"] == "http.response.start":
+                    root.attributes["http.status_code"] = message["status"]
+                    message = {
+                        **message,
+                        "headers": list(message.get("headers") or [])
+                        + [
+                            (b"server-timing", server_timing(root).encode()),
+                            (b"x-trace-id", root.trace.trace_id.encode()),
+                        ],
+                    }
+                await send(message)
+
+            await self.app(scope, receive, send_with_timing)
@@ -0,0 +1,173 @@
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+from typing import Awaitable, Callable, List, Optional
+
+from cache import TTLCache
+
+# Summarizer signature: (previous summary, turns being folded) -> new summary
+Summarizer = Callable[[str, List[dict]], Awaitable[str]]
+# Backend update: (stored session or None) -> session to store
+Change = Callable[[Optional[dict]], dict]
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token) for budgeting."""
+    return len(text) // 4 + 1
+
+
+class MemorySessionBackend:
+    """Process-local session storage; sessions expire after ``ttl`` idle seconds."""
+
+    def __init__(self, max_sessions: int = 10000, ttl: float = 86400):
+        self._sessions = TTLCache(max_size=max_sessions, ttl=ttl)
+        self._lock = threading.Lock()
+
+    def load(self, session_id: str) -> Optional[dict]:
+        return self._sessions.get(session_id)
+
+    def update(self, session_id: str, change: Change) -> dict:
+        with self._lock:
+            session = change(self._sessions.get(session_id))
+            self._sessions.set(session_id, session)
+        return session
+
+    def delete(self, session_id: str) -> None:
+        self._sessions.pop(session_id)
+
+
+class SQLiteSessionBackend:
+    """
+    Session storage in a SQLite file, shared by workers and kept across
+    restarts. Updates run in ``BEGIN IMMEDIATE`` transactions, so concurrent
+    turns from different workers do not overwrite each other.
+    """
+
+    def __init__(self, path: str, ttl: float = 86400):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            path, timeout=30, isolation_level=None, check_same_thread=False
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS tutor_sessions ("
+            "id TEXT PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+
+    def _load(self, session_id: str) -> Optional[dict]:
+        row = self._conn.execute(
+            "SELECT data FROM tutor_sessions WHERE id = ? AND updated_at > ?",
+            (session_id, time.time() - self.ttl),
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def load(self, session_id: str) -> Optional[dict]:
+        with self._lock:
+            return self._load(session_id)
+
+    def update(self, session_id: str, change: Change) -> dict:
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                session = change(self._load(session_id))
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO tutor_sessions (id, data, updated_at) "
+                    "VALUES (?, ?, ?)",
+                    (session_id, json.dumps(session), now),
+                )
+                self._conn.execute(
+                    "DELETE FROM tutor_sessions WHERE updated_at <= ?", (now - self.ttl,)
+                )
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+        return session
+
+    def delete(self, session_id: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM tutor_sessions WHERE id = ?", (session_id,))
+
+
+class TutorSessionStore:
+    """
+    Server-side tutor conversations.
+
+    Each session holds a rolling ``summary`` of older turns plus the most
+    recent ``turns`` verbatim. Whenever the recent turns grow past
+    ``token_budget`` the oldest ones are folded into the summary, always
+    keeping at least ``min_recent_turns`` as-is. Changes go through the
+    backend's ``update``, which reads and writes the session atomically, so
+    turns recorded by several workers at once are all kept.
+    """
+
+    def __init__(
+        self,
+        backend,
+        token_budget: int = 1500,
+        min_recent_turns: int = 4,
+    ):
+        self.backend = backend
+        self.token_budget = token_budget
+        self.min_recent_turns = min_recent_turns
+
+    @staticmethod
+    def _or_new(session: Optional[dict]) -> dict:
+        return session or {"summary": "", "turns": []}
+
+    def load(self, session_id: str) -> dict:
+        return self._or_new(self.backend.load(session_id))
+
+    def overflow(self, session: dict) -> List[dict]:
+        """The oldest turns that have to be folded to get back within budget."""
+        turns = session["turns"]
+        total = sum(estimate_tokens(t["message"]) for t in turns)
+        count = 0
+        while len(turns) - count > self.min_recent_turns and total > self.token_budget:
+            total -= estimate_tokens(turns[count]["message"])
+            count += 1
+        return turns[:count]
+
+    async def record(self, session_id: str, new_turns: List[dict]) -> dict:
+        """Append turns and save right away; folding is left to ``compact``."""
+
+        def append(session: Optional[dict]) -> dict:
+            session = self._or_new(session)
+            session["turns"].extend(new_turns)
+            return session
+
+        return await asyncio.to_thread(self.backend.update, session_id, append)
+
+    async def compact(self, session_id: str, summarize: Summarizer) -> None:
+        """
+        Fold turns past the token budget into the summary. The summarizer
+        runs outside any transaction, so new turns can be recorded
+        meanwhile; its result is dropped if the session was compacted by
+        someone else in the meantime.
+        """
+        session = await asyncio.to_thread(self.load, session_id)
+        folded = self.overflow(session)
+        if not folded:
+            return
+        try:
+            summary = await summarize(session["summary"], folded)
+        except Exception as e:
+            # The turns stay in place and are folded on a later attempt
+            print(f"Tutor session summarization failed: {e}")
+            return
+
+        def fold(current: Optional[dict]) -> dict:
+            current = self._or_new(current)
+            if (
+                current["summary"] == session["summary"]
+                and current["turns"][: len(folded)] == folded
+            ):
+                current["summary"] = summary
+                del current["turns"][: len(folded)]
+            return current
+
+        await asyncio.to_thread(self.backend.update, session_id, fold)
@@ -1,26 +1,59 @@
 import hashlib
 import json
 import re
+import threading
 import time
-from typing import Any, Dict, List, Optional
+from collections import deque
+from typing import Any, AsyncIterator, Dict, List, Optional
 import asyncio
 import requests
 import base64
 import os
 from starlette.concurrency import run_in_threadpool
 import dotenv
-import google.generativeai as genai
+from shared_state import SharedState, shared_state
+from metrics import record_cache, stage_seconds, track_stage, track_upstream
+from resilience import UpstreamHTTPError, UpstreamPolicy, retry_after_seconds
 
 dotenv.load_dotenv()
 
-# Configure the Google GenAI client
-genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+# The legacy Google GenAI SDK is slow to import, so it is loaded and
+# configured on first use (or by the app's startup warm-up)
+GEMINI_BASE_URL = os.getenv("GOOGLE_GEMINI_BASE_URL")
+_genai = None
+_genai_lock = threading.Lock()
+
+
+def load_genai():
+    """Return the configured ``google.generativeai`` module."""
+    global _genai
+    if _genai is not None:
+        return _genai
+    with _genai_lock:
+        if _genai is None:
+            import google.generativeai as genai
+
+            if GEMINI_BASE_URL:
+                import google.generativeai.client as genai_client
+
+                # Same override the google-genai client honours, e.g. for the
+                # bench/ fakes. The File API reads its discovery document from
+                # a fixed URL, so move it too.
+                genai.configure(
+                    api_key=os.getenv("GOOGLE_API_KEY"),
+                    transport="rest",
+                    client_options={"api_endpoint": GEMINI_BASE_URL},
+                )
+                genai_client.GENAI_API_DISCOVERY_URL = (
+                    f"{GEMINI_BASE_URL.rstrip('/')}/$discovery/rest"
+                )
+            else:
+                genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+            _genai = genai
+    return _genai
 
 SARVAM_API_KEY = "sk_0w266dla_ZoG8JiTcFyQPpZTm58dY1ljx"
 
-# Storage for progress updates
-progress_updates: Dict[str, List[Dict[str, Any]]] = {}
-
 VIDEO_TRANSCRIPTION_PROMPT = """
 You are an expert multilingual dubbing transcriber and translator.
 
@@ -55,27 +88,22 @@ Ensure the response is valid JSON that can be parsed directly.
 
 
 class VideoCache:
-    def __init__(self, max_size=50):
-        self.cache, self.max_size = {}, max_size
+    """Transcription cache in shared state, so every worker reuses results."""
+
+    def __init__(self, state: SharedState = shared_state, ttl=86400):
+        self.state, self.ttl = state, ttl
 
     def _hash_key(self, text: str) -> str:
         return hashlib.md5(text.encode()).hexdigest()
 
     async def get_cached_response(self, k: str) -> Optional[Dict]:
-        return self.cache.get(k)
+        return await run_in_threadpool(self.state.get, f"video_cache:{k}")
 
     async def set_cached_response(self, k: str, r: Dict) -> None:
-        if len(self.cache) >= self.max_size:
-            self.cache.pop(next(iter(self.cache)))
-        self.cache[k] = r
+        await run_in_threadpool(self.state.set, f"video_cache:{k}", r, self.ttl)
 
 
 def update_progress(request_id: str, message: str) -> None:
-    if request_id not in progress_updates:
-        progress_updates[request_id] = []
-    progress_updates[request_id].append(
-        {"timestamp": time.time(), "message": message, "type": "progress"}
-    )
     print(f"[{request_id}] {message}")
 
 
@@ -90,11 +118,12 @@ async def upload_and_process_video(file_path: str, request_id: str) -> Optional[
     # Step 2: File upload
     update_progress(request_id, f"Initiating file upload: {file_path}")
     try:
-        video_file = await run_in_threadpool(
-            lambda: genai.upload_file(
-                path=file_path, display_name=os.path.basename(file_path)
+        with track_stage("gemini_upload"), track_upstream("gemini"):
+            video_file = await run_in_threadpool(
+                lambda: load_genai().upload_file(
+                    path=file_path, display_name=os.path.basename(file_path)
+                )
             )
-        )
         update_progress(
             request_id,
             f"Upload successful - File name: {video_file.name}, Size: {os.path.getsize(file_path)} bytes",
@@ -105,15 +134,21 @@ async def upload_and_process_video(file_path: str, request_id: str) -> Optional[
 
     # Step 3: Processing monitoring
     update_progress(request_id, "Beginning processing status monitoring...")
+    with track_stage("gemini_poll"):
+        return await poll_until_active(video_file, request_id)
+
+
+async def poll_until_active(video_file: Any, request_id: str) -> Optional[Any]:
     attempt = 1
     while True:
         update_progress(
             request_id, f"Checking processing status (Attempt {attempt})..."
         )
         try:
-            video_file = await run_in_threadpool(
-                lambda: genai.get_file(name=video_file.name)
-            )
+            with track_upstream("gemini"):
+                video_file = await run_in_threadpool(
+                    lambda: load_genai().get_file(name=video_file.name)
+                )
 
             # Step 4a: Check for successful completion
             if video_file.state.name == "ACTIVE":
@@ -149,65 +184,227 @@ async def upload_and_process_video(file_path: str, request_id: str) -> Optional[
     #     return None
 
 
-async def transcribe_video(
+class TranscriptionError(Exception):
+    """Transcription failed before any usable segment was produced."""
+
+
+# Structured output: Gemini must answer with exactly this shape, no fences or prose
+TRANSCRIPT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "segments": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "start": {"type": "number"},
+                    "end": {"type": "number"},
+                    "original_text": {"type": "string"},
+                    "translated_text": {"type": "string"},
+                    "emotion": {"type": "string"},
+                },
+                "required": ["start", "end", "original_text", "translated_text", "emotion"],
+            },
+        }
+    },
+    "required": ["segments"],
+}
+TRANSCRIPT_GENERATION_CONFIG = {
+    "response_mime_type": "application/json",
+    "response_schema": TRANSCRIPT_SCHEMA,
+}
+_SEGMENTS_ARRAY = re.compile(r'"segments"\s*:\s*\[')
+
+
+class SegmentStreamParser:
+    """
+    Pulls complete segment objects out of transcript JSON as it streams in.
+
+    Text is scanned once, tracking string and nesting state; each object
+    directly inside the ``segments`` array is decoded as soon as its closing
+    brace arrives. Segments that fail to decode or lack a start time and
+    text are skipped rather than failing the whole transcript.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.done = False  # The segments array has closed
+        self.skipped = 0
+        self._pos = -1  # Scan position; -1 until the array is found
+        self._depth = 0  # Nesting inside the array
+        self._in_string = False
+        self._escaped = False
+        self._item_start = 0
+
+    def feed(self, chunk: str) -> List[dict]:
+        self.text += chunk
+        if self._pos < 0:
+            match = _SEGMENTS_ARRAY.search(self.text)
+            if not match:
+                return []
+            self._pos = match.end()
+
+        segments = []
+        text, i = self.text, self._pos
+        while i < len(text) and not self.done:
+            char = text[i]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in "{[":
+                if self._depth == 0:
+                    self._item_start = i
+                self._depth += 1
+            elif char in "}]":
+                if self._depth == 0:
+                    self.done = char == "]"
+                else:
+                    self._depth -= 1
+                    if self._depth == 0:
+                        segment = self._decode(text[self._item_start : i + 1])
+                        if segment is not None:
+                            segments.append(segment)
+            i += 1
+        self._pos = i
+        return segments
+
+    def _decode(self, raw: str) -> Optional[dict]:
+        try:
+            segment = json.loads(raw)
+            segment["start"] = float(segment["start"])
+            if not isinstance(segment.get("translated_text"), str):
+                raise ValueError("translated_text missing")
+            return segment
+        except (ValueError, TypeError, KeyError) as e:
+            self.skipped += 1
+            print(f"Skipping unreadable transcript segment ({e}): {raw[:200]}")
+            return None
+
+
+def file_md5(file_path: str, chunk_size: int = 1024 * 1024) -> str:
+    """MD5 of a file, read in chunks so large videos are not held in memory."""
+    digest = hashlib.md5()
+    with open(file_path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+async def transcribe_video_segments(
     file_path: str,
     request_id: str,
     model_name: str,
     video_cache: VideoCache,
     target_language: str,
-) -> str:
-    try:
-        with open(file_path, "rb") as f:
-            video_hash = hashlib.md5(f.read()).hexdigest()
-    except IOError as e:
-        return json.dumps({"error": f"Could not read file: {e}"})
-
-    cache_key = f"{video_hash}_transcription"
-    if cached := await video_cache.get_cached_response(cache_key):
+    video_hash: Optional[str] = None,
+) -> AsyncIterator[dict]:
+    """
+    Transcribe and translate a video, yielding dubbing segments in order as
+    Gemini streams them, so TTS can start long before the response ends.
+
+    The response is constrained to ``TRANSCRIPT_SCHEMA``. Complete
+    transcripts are cached by video hash and replayed on later calls; pass
+    ``video_hash`` when it is already known (uploads are hashed on arrival).
+    Raises ``TranscriptionError`` if nothing usable comes back.
+    """
+    if video_hash is None:
+        try:
+            video_hash = await asyncio.to_thread(file_md5, file_path)
+        except IOError as e:
+            raise TranscriptionError(f"Could not read file: {e}")
+
+    # Translations are part of the transcript, so the language is part of the key
+    cache_key = f"{video_hash}_{target_language}_transcription"
+    cached = await video_cache.get_cached_response(cache_key)
+    record_cache("transcription", bool(cached))
+    if cached:
         update_progress(request_id, f"Cache hit: {cache_key}")
-        return cached.get("content", "")
+        for segment in clean_json_output(cached.get("content", "")).get("segments", []):
+            yield segment
+        return
 
     video_file = None
+    loop = asyncio.get_running_loop()
+    chunks: asyncio.Queue = asyncio.Queue()
+    stop = threading.Event()
+    pump = None
     try:
         video_file = await upload_and_process_video(file_path, request_id)
         if not video_file:
-            return json.dumps({"error": "Video upload or processing failed."})
+            raise TranscriptionError("Video upload or processing failed.")
 
         update_progress(
             request_id, f"Running transcription with model '{model_name}'..."
         )
-        model = genai.GenerativeModel(model_name)
-        response = await run_in_threadpool(
-            lambda: model.generate_content(
-                [
-                    VIDEO_TRANSCRIPTION_PROMPT.replace(
-                        "{target_language}", target_language
-                    ),
-                    video_file,
-                ],
-                request_options={"timeout": 600},
-            )
-        )
-
-        content = (
-            response.parts[0].text
-            if response.parts
-            else json.dumps({"error": "Empty model response."})
-        )
-        update_progress(request_id, "Transcription completed.")
-        await video_cache.set_cached_response(cache_key, {"content": content})
-        return content
-
-    except Exception as e:
-        error_message = f"Transcription error: {str(e)}"
-        update_progress(request_id, error_message)
-        return json.dumps({"error": error_message})
+        model = load_genai().GenerativeModel(model_name)
+        prompt = VIDEO_TRANSCRIPTION_PROMPT.replace("{target_language}", target_language)
+
+        def generate():
+            # Runs on a worker thread; chunks are handed to the event loop as they arrive
+            try:
+                with track_stage("transcription"), track_upstream("gemini"):
+                    response = model.generate_content(
+                        [prompt, video_file],
+                        generation_config=TRANSCRIPT_GENERATION_CONFIG,
+                        stream=True,
+                        request_options={"timeout": 600},
+                    )
+                    for chunk in response:
+                        if stop.is_set():
+                            break
+                        if chunk.parts:
+                            loop.call_soon_threadsafe(chunks.put_nowait, chunk.text)
+            except Exception as e:
+                loop.call_soon_threadsafe(chunks.put_nowait, e)
+            finally:
+                loop.call_soon_threadsafe(chunks.put_nowait, None)
+
+        started = time.perf_counter()
+        pump = asyncio.ensure_future(asyncio.to_thread(generate))
+        parser = SegmentStreamParser()
+        count = 0
+        while (item := await chunks.get()) is not None:
+            if isinstance(item, Exception):
+                raise TranscriptionError(f"Transcription error: {item}") from item
+            for segment in parser.feed(item):
+                if count == 0:
+                    stage_seconds.observe(
+                        time.perf_counter() - started, stage="transcription_first_segment"
+                    )
+                count += 1
+                yield segment
+
+        if count == 0:
+            # Not the expected shape (e.g. a bare list); try the whole text once
+            for segment in clean_json_output(parser.text).get("segments", []):
+                count += 1
+                yield segment
+        if count == 0:
+            raise TranscriptionError("No segments found in transcript.")
+
+        update_progress(request_id, f"Transcription completed: {count} segments.")
+        if parser.done and not parser.skipped:
+            await video_cache.set_cached_response(cache_key, {"content": parser.text})
+
+    except TranscriptionError as e:
+        update_progress(request_id, str(e))
+        raise
 
     finally:
+        stop.set()
+        if pump is not None:
+            await asyncio.shield(pump)
         if video_file:
-            await run_in_threadpool(lambda: genai.delete_file(name=video_file.name))
+            await run_in_threadpool(
+                lambda: load_genai().delete_file(name=video_file.name)
+            )
             update_progress(request_id, f"Deleted remote file: {video_file.name}")
-        progress_updates.pop(request_id, None)
 
 
 def clean_json_output(raw: str) -> dict:
@@ -224,27 +421,271 @@ def clean_json_output(raw: str) -> dict:
         }
 
 
-def generate_tts_audio(text: str, lang_code: str, output_path: str):
+# --- Translation into further dubbing languages ---
+# A multi-language job transcribes once; the other languages are translated
+# from the transcript's original text, a few segments per request
+SEGMENT_TRANSLATION_PROMPT = """
+You are an expert multilingual dubbing translator.
+
+Translate each transcript line below into **{target_language}**, optimized for dubbing.
 
+⚠️ Dubbing Requirements:
+- Each translation must be speakable within the line's "seconds".
+- It must **preserve the tone, emotion, and intent** given for the line.
+- Use natural, conversational phrasing suited for voiceover—not overly literal.
+
+🎯 Return a JSON array of strings with exactly one translation per line, in the same order.
+
+Lines (JSON):
+{lines}
+"""
+TRANSLATION_GENERATION_CONFIG = {
+    "response_mime_type": "application/json",
+    "response_schema": {"type": "array", "items": {"type": "string"}},
+}
+# Small first batch so TTS can start early, doubling up to the maximum
+TRANSLATION_FIRST_BATCH_SEGMENTS = 4
+TRANSLATION_MAX_BATCH_SEGMENTS = 24
+TRANSLATION_CONCURRENCY = 2  # Requests in flight per language
+# Per attempt, shared with recommendation and tutor generation in main.py
+GEMINI_TIMEOUT_SECONDS = float(os.getenv("GEMINI_TIMEOUT_SECONDS", "60"))
+translation_gemini = UpstreamPolicy("gemini", GEMINI_TIMEOUT_SECONDS)
+
+
+class TranslationError(Exception):
+    """Gemini did not return one translation per transcript line."""
+
+
+def translate_segments(
+    segments: List[dict], target_language: str, model_name: str
+) -> List[str]:
+    """Translate the ``original_text`` of ``segments``; one text per segment."""
+    lines = [
+        {
+            "text": segment.get("original_text", ""),
+            "seconds": round(float(segment.get("end", 0)) - float(segment["start"]), 1),
+            "emotion": segment.get("emotion", "neutral"),
+        }
+        for segment in segments
+    ]
+    prompt = SEGMENT_TRANSLATION_PROMPT.replace(
+        "{target_language}", target_language
+    ).replace("{lines}", json.dumps(lines, ensure_ascii=False))
+    model = load_genai().GenerativeModel(model_name)
+
+    def attempt():
+        response = model.generate_content(
+            prompt,
+            generation_config=TRANSLATION_GENERATION_CONFIG,
+            request_options={"timeout": translation_gemini.timeout},
+        )
+        return clean_json_output(response.text)
+
+    translations = translation_gemini.call(attempt)
+    if (
+        isinstance(translations, list)
+        and len(translations) == len(segments)
+        and all(isinstance(text, str) for text in translations)
+    ):
+        return translations
+    if len(segments) == 1:
+        raise TranslationError(f"Unusable translation into {target_language}: {translations}"[:300])
+    print(f"Translation into {target_language} did not match its lines, retrying singly")
+    return [
+        translate_segments([segment], target_language, model_name)[0]
+        for segment in segments
+    ]
+
+
+async def translate_segment_stream(
+    segments: AsyncIterator[dict],
+    target_language: str,
+    model_name: str,
+    window: int = TRANSLATION_CONCURRENCY,
+) -> AsyncIterator[dict]:
+    """
+    Re-translate transcript segments into ``target_language`` as they
+    arrive and yield copies, in order, with ``translated_text`` replaced.
+    At most ``window`` batch requests are in flight; the source is only
+    read further once the oldest batch has been consumed.
+    """
+
+    async def translate(batch):
+        with track_stage("translation"):
+            texts = await asyncio.to_thread(
+                translate_segments, batch, target_language, model_name
+            )
+        return [
+            {**segment, "translated_text": text} for segment, text in zip(batch, texts)
+        ]
+
+    pending = deque()
+    batch, batch_size = [], TRANSLATION_FIRST_BATCH_SEGMENTS
+    try:
+        async for segment in segments:
+            batch.append(segment)
+            if len(batch) < batch_size:
+                continue
+            if len(pending) >= window:
+                for translated in await pending.popleft():
+                    yield translated
+            pending.append(asyncio.create_task(translate(batch)))
+            batch = []
+            batch_size = min(2 * batch_size, TRANSLATION_MAX_BATCH_SEGMENTS)
+        if batch:
+            pending.append(asyncio.create_task(translate(batch)))
+        while pending:
+            for translated in await pending.popleft():
+                yield translated
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+TTS_SAMPLE_RATE = 22050
+TTS_URL = os.getenv("SARVAM_TTS_URL", "https://api.sarvam.ai/text-to-speech")
+# Multi-input requests: at most this many texts, each at most this long
+TTS_BATCH_MAX_INPUTS = 3
+TTS_BATCH_MAX_CHARS = 500
+# Batching is paused for a while once the API rejects ``inputs`` as a field,
+# or after this many failed batches in a row
+TTS_BATCH_MAX_FAILURES = 3
+TTS_BATCH_RETRY_SECONDS = 600
+# Wording of a 400/422 that rejects the ``inputs`` field itself, as opposed
+# to one of the texts in it
+_UNSUPPORTED_WORDING = (
+    r"(not (permitted|allowed|supported)|unsupported|unknown|unexpected|unrecognized|extra)"
+)
+TTS_INPUTS_UNSUPPORTED = re.compile(
+    rf"\binputs\b.{{0,40}}\b{_UNSUPPORTED_WORDING}"
+    rf"|\b{_UNSUPPORTED_WORDING}\b.{{0,40}}\binputs\b",
+    re.IGNORECASE,
+)
+# Per-request timeout; 429s and 5xx are retried and slow requests hedged
+SARVAM_TIMEOUT_SECONDS = float(os.getenv("SARVAM_TIMEOUT_SECONDS", "30"))
+tts_sarvam = UpstreamPolicy("sarvam", SARVAM_TIMEOUT_SECONDS, hedge=True)
+
+
+def post_tts(payload: dict) -> dict:
+    """Send one Sarvam TTS request under ``tts_sarvam`` and return the JSON reply."""
     headers = {
         "api-subscription-key": SARVAM_API_KEY,
         "Content-Type": "application/json",
     }
-    payload = {"text": text, "target_language_code": lang_code, "speaker": "karun"}
-    response = requests.post(
-        "https://api.sarvam.ai/text-to-speech", headers=headers, json=payload
-    )
-    if response.status_code != 200:
-        raise Exception(f"TTS API Error: {response.text}")
 
-    data = response.json()
+    def attempt():
+        response = requests.post(
+            TTS_URL, headers=headers, json=payload, timeout=tts_sarvam.timeout
+        )
+        if response.status_code != 200:
+            raise UpstreamHTTPError(
+                response.status_code,
+                f"TTS API Error: {response.text}",
+                retry_after=retry_after_seconds(response.headers),
+            )
+        return response.json()
+
+    return tts_sarvam.call(attempt)
+
+
+def synthesize_speech(text: str, lang_code: str) -> bytes:
+    """Synthesize ``text`` with Sarvam TTS and return the WAV bytes."""
+    data = post_tts(
+        {
+            "text": text,
+            "target_language_code": lang_code,
+            "speaker": "karun",
+            "speech_sample_rate": TTS_SAMPLE_RATE,
+        }
+    )
 
     if "audios" not in data or not data["audios"]:
         raise ValueError("No audio data received from TTS API")
 
+    return base64.b64decode(data["audios"][0])
+
+
+class TTSBatching:
+    """
+    Whether multi-input TTS requests are worth sending right now.
+
+    A failed batch only costs that batch, which is resent one text at a
+    time. Batching is paused for ``retry_seconds`` when the API says it
+    does not take ``inputs`` at all, or after ``max_failures`` failed
+    batches in a row, and then tried again.
+    """
+
+    def __init__(
+        self,
+        max_failures: int = TTS_BATCH_MAX_FAILURES,
+        retry_seconds: float = TTS_BATCH_RETRY_SECONDS,
+    ):
+        self.max_failures, self.retry_seconds = max_failures, retry_seconds
+        self.failures = 0
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def enabled(self) -> bool:
+        return time.monotonic() >= self.paused_until
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+
+    def record_failure(self, unsupported: bool = False) -> None:
+        with self._lock:
+            self.failures += 1
+            if unsupported or self.failures >= self.max_failures:
+                reason = (
+                    "inputs unsupported"
+                    if unsupported
+                    else f"{self.failures} failed batches in a row"
+                )
+                print(f"Pausing batched TTS requests for {self.retry_seconds:.0f}s ({reason})")
+                self.paused_until = time.monotonic() + self.retry_seconds
+                self.failures = 0
+
+
+tts_batching = TTSBatching()
+
+
+def synthesize_speech_batch(texts: List[str], lang_code: str) -> List[bytes]:
+    """
+    Synthesize several texts in one request using the ``inputs`` array and
+    return one WAV clip per text. If the API refuses the batch or returns
+    the wrong number of clips, that batch is resent one text at a time.
+    """
+    if len(texts) == 1 or not tts_batching.enabled():
+        return [synthesize_speech(text, lang_code) for text in texts]
+
+    try:
+        data = post_tts(
+            {
+                "inputs": texts,
+                "target_language_code": lang_code,
+                "speaker": "karun",
+                "speech_sample_rate": TTS_SAMPLE_RATE,
+            }
+        )
+    except UpstreamHTTPError as e:
+        if e.status_code not in (400, 422):
+            raise
+        print(f"TTS API refused a batched request, sending texts singly: {e}")
+        tts_batching.record_failure(bool(TTS_INPUTS_UNSUPPORTED.search(str(e))))
+        return [synthesize_speech(text, lang_code) for text in texts]
+
+    audios = data.get("audios") or []
+    if len(audios) != len(texts):
+        print(f"TTS API returned {len(audios)} clips for {len(texts)} texts, retrying singly")
+        tts_batching.record_failure()
+        return [synthesize_speech(text, lang_code) for text in texts]
+    tts_batching.record_success()
+    return [base64.b64decode(audio) for audio in audios]
+
+
+def generate_tts_audio(text: str, lang_code: str, output_path: str):
     # Decode and save WAV file directly
-    audio_base64 = data["audios"][0]
-    audio_bytes = base64.b64decode(audio_base64)
+    audio_bytes = synthesize_speech(text, lang_code)
 
     with open(output_path, "wb") as f:
         f.write(audio_bytes)